@@ -1,20 +1,67 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import glob
+import time
+import hashlib
 import datetime
+import multiprocessing
 import pymysql
 import codecs
-from pymysqlreplication import BinLogStreamReader
 from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent
 from binlog2sql_util import command_line_args, concat_sql_from_binlog_event, create_unique_file, \
-    is_dml_event, event_type
+    is_dml_event, event_type, MultiRowSqlMerger, get_checkpoint_file, save_checkpoint, load_checkpoint, \
+    get_time_index_file, get_table_metadata_cache_file
+from binlog2sql_local import BinLogFileReader, SchemaSnapshot, list_local_binlog_files, dump_schema_snapshot
+from binlog2sql_util2 import SqlValueEscaper, DEFAULT_HEX_BLOB_THRESHOLD
+from binlog2sql_spool import SqlSpoolWriter, SqlSpoolReader, truncate_spool, remove_spool, SPOOL_FLAG_NEW_TRANSACTION
+from binlog2sql_compress import OutputCompressor
+from binlog2sql_loaddata import LoadDataWriter, write_load_data_script, truncate_load_data_files
+from binlog2sql_apply import SqlApplier, get_replica_settings_list
+from binlog2sql_timeindex import BinlogTimeIndex
+from binlog2sql_filter import EventFilterPlan
+from binlog2sql_metacache import TableMetadataCache, CachedBinLogStreamReader
+from binlog2sql_compact import RowChangeCompactor, DEFAULT_COMPACT_MEMORY_ROWS
+from binlog2sql_pipeline import BinlogEventReader, SqlBatchWriter, PIPELINE_QUEUE_EVENTS, PIPELINE_QUEUE_BATCHES, \
+    iter_event_rows
+from binlog2sql_metrics import ProcessMetrics, MetricsExporter, create_profiler, get_peak_rss
+from binlog2sql_gtid import GtidRangeFilter, GtidTransactionTracker
+from binlog2sql_rowindex import RowChangeIndex, RowLookupStream, format_row_key
+from binlog2sql_eventspool import EventSpoolWriter, EventSpoolRecorder, EventSpoolReader, load_event_spool_meta, \
+    check_event_spool_filters
+from binlog2sql_catalog import RollbackCatalog, get_rollback_catalog_file
 
 SPLIT_LINE_FLAG = "##=================SPLIT==LINE=====================##"
 SPLIT_TRAN_FLAG = "##=================NEW=TRANSACTION=================##"
 EMPTY_LINE_FLAG = "\n"
 MAX_SQL_COUNT_PER_FILE = 10000
 MAX_SQL_COUNT_PER_WRITE = 10000
+MAX_ROLLBACK_FILE_ID = 9999
+# 并行解析时每个进程使用独立的server_id，避免复制连接互相踢出，同时避开常规实例的server_id范围
+WORKER_SERVER_ID_BASE = 4294000000
+# 离线模式下无法获取max_allowed_packet，使用MySQL 5.7的默认值
+DEFAULT_MAX_ALLOWED_PACKET = 4194304
+# 多行合并语句预留给协议头和注释的字节数
+MULTI_ROW_RESERVED_BYTES = 1024
+# 指定内存预算时，读取队列和每批写入临时文件的SQL分别占预算的比例
+MEMORY_BUDGET_QUEUE_RATIO = 4
+MEMORY_BUDGET_BATCH_RATIO = 8
+
+
+def get_next_event_pos(binlog_event, last_pos):
+    """
+    返回当前事件结束后的位点，切换binlog文件时位点回到新文件的起始位置
+    :param binlog_event:
+    :param last_pos:
+    :return:
+    """
+    if isinstance(binlog_event, RotateEvent):
+        return binlog_event.position
+    if isinstance(binlog_event, FormatDescriptionEvent) and not binlog_event.packet.log_pos:
+        return last_pos
+    return binlog_event.packet.log_pos
 
 
 class Binlog2sql(object):
@@ -23,18 +70,66 @@ class Binlog2sql(object):
                  start_time=None, stop_time=None, only_schemas=None, only_tables=None, no_pk=False,
                  flashback=False, stop_never=False, back_interval=1.0, only_dml=True, sql_type=None,
                  rollback_with_primary_key=False, rollback_with_changed_value=False,
-                 pseudo_thread_id=0):
+                 pseudo_thread_id=0, binlog_dir=None, schema_file=None, workers=1, multi_row=False,
+                 max_statement_bytes=0, checkpoint_interval=0, resume_file=None, time_index=False,
+                 table_cache=False, compression=None, compress_workers=0, load_data=None,
+                 metrics_file=None, metrics_format='json', metrics_interval=10, compact=False,
+                 compact_memory_rows=DEFAULT_COMPACT_MEMORY_ROWS, pipeline=True, start_gtid_set=None,
+                 include_gtids=None, exclude_gtids=None, hex_blob_threshold=DEFAULT_HEX_BLOB_THRESHOLD,
+                 output_dir=None, row_index=None, lookup_table=None, lookup_key=None, event_spool=None,
+                 replay_event_spool=None, memory_budget=0, freeze_schema=False):
         """
         conn_setting: {'host': 127.0.0.1, 'port': 3306, 'user': user, 'passwd': passwd, 'charset': 'utf8'}
+        binlog_dir: 本地binlog文件目录，指定后不再连接数据库，表结构从schema_file快照文件中读取
+        workers: 并行解析binlog文件的进程数
+        multi_row: 将连续的同表同类型行合并为多行语句，max_statement_bytes默认根据max_allowed_packet计算
+        checkpoint_interval: 保存断点的间隔秒数，0表示不保存断点
+        resume_file: 断点文件，从断点位置继续解析并沿用断点中记录的输出文件
+        time_index: 使用并更新binlog时间索引，根据start_time直接定位起始文件和位点
+        table_cache: 使用磁盘上的表元数据缓存，减少TableMap事件对information_schema的查询
+        compression: 输出文件和临时文件的压缩格式(gzip/zstd)，compress_workers为压缩线程数
+        load_data: 回滚DELETE时将行数据按表输出为LOAD DATA格式(tsv/csv)的数据文件，并生成加载脚本
+        metrics_file: 每隔metrics_interval秒将统计结果以metrics_format(json/prometheus)格式导出到该文件
+        compact: 回滚时按(表, 主键)合并行变更，每行只生成一条净回滚语句，内存中超过compact_memory_rows行后写入磁盘
+        pipeline: 读取事件、生成SQL、写入临时文件分别在读取线程、当前线程和写入线程中执行，通过有界队列连接
+        start_gtid_set: 已执行的GTID集合，在线解析时通过auto_position从该集合之后开始，不需要start_file
+        include_gtids/exclude_gtids: 只处理/不处理这些GTID的事务，在线解析指定include_gtids时同样使用auto_position
+        hex_blob_threshold: 不小于该字节数的二进制字段值直接输出为十六进制字面量
+        output_dir: 输出文件、断点、时间索引和表元数据缓存所在的目录，默认为程序目录下的log目录
+        row_index: 行变更索引文件，解析时按(表, 主键)记录行变更所在的binlog位点
+        lookup_table/lookup_key: 查询模式，从row_index中查找schema.table表中主键为lookup_key的行，
+            只读取包含该行变更的事务并生成该行的SQL，不需要start_file
+        event_spool: 将读取到的解码后事件保存到该事件文件
+        replay_event_spool: 从事件文件回放事件，不再连接数据库或读取binlog文件，未指定start_file时回放整个文件
+        memory_budget: 内存预算(MB)，指定后行事件逐行解码，读取队列按字节数限制，生成的SQL按字节数分批写入临时文件
+        freeze_schema: binlog范围内表结构不变，同一table_id的TableMap事件只解析一次，与only_dml无关
         """
 
-        if not start_file:
+        self.gtid_filter = GtidRangeFilter(include_gtids=include_gtids, exclude_gtids=exclude_gtids,
+                                           start_gtid_set=start_gtid_set) \
+            if start_gtid_set or include_gtids or exclude_gtids else None
+        self.start_gtid_set, self.include_gtids, self.exclude_gtids = start_gtid_set, include_gtids, exclude_gtids
+        # 在线解析时由实例根据GTID集合确定起始位点，从断点继续时仍按断点中的位点解析
+        self.gtid_auto_position = bool(start_gtid_set or include_gtids) and not binlog_dir and not replay_event_spool
+        self.auto_position = None
+        self.row_index_file = row_index
+        self.event_spool_file = event_spool
+        self.replay_event_spool = replay_event_spool
+        self.event_spool_meta = load_event_spool_meta(replay_event_spool) if replay_event_spool else None
+        if self.event_spool_meta is not None and not start_file and not lookup_key:
+            start_file, start_pos = self.event_spool_meta['first_file'], self.event_spool_meta['first_pos']
+            end_file = end_file or self.event_spool_meta['last_file']
+        self.row_lookup_changes = None
+        if lookup_key:
+            start_file, start_pos, end_file, end_pos, only_schemas, only_tables = self.init_row_lookup(
+                lookup_table, lookup_key)
+        if not start_file and not self.gtid_auto_position:
             raise ValueError('Lack of parameter: start_file')
 
         self.conn_setting = connection_settings
         self.start_file = start_file
         self.start_pos = start_pos if start_pos else 4  # use binlog v4
-        self.end_file = end_file if end_file else start_file
+        self.end_file = end_file if end_file else (None if self.gtid_auto_position else start_file)
         self.end_pos = end_pos
         self.pseudo_thread_id = pseudo_thread_id
         if start_time:
@@ -53,283 +148,813 @@ class Binlog2sql(object):
         self.no_pk, self.flashback, self.stop_never, self.back_interval = (no_pk, flashback, stop_never, back_interval)
         self.only_dml = only_dml
         self.sql_type = [t.upper() for t in sql_type] if sql_type else []
+        self.event_filter = EventFilterPlan(sql_type=self.sql_type, freeze_schema=freeze_schema)
+        if self.event_spool_meta is not None:
+            check_event_spool_filters(self.event_spool_meta, self.start_file, self.start_pos, self.only_schemas,
+                                      self.only_tables, self.sql_type, self.only_dml)
         self.binlogList = []
+        self.binlog_dir = binlog_dir
+        self.schema_file = schema_file
+        self.workers = workers if workers else 1
         file_name = '%s_%s' % (self.conn_setting['host'], self.conn_setting['port'])
-        self.connection = pymysql.connect(**self.conn_setting)
-        execute_sql_file, rollback_sql_file, tmp_sql_file = create_unique_file(file_name)
-        self.execute_sql_file = execute_sql_file
+        self.output_dir = output_dir
+        execute_sql_file, rollback_sql_file, tmp_sql_file = create_unique_file(file_name, output_dir)
+        self.compression = compression
+        self.compressor = OutputCompressor(compression=compression, compress_workers=compress_workers)
+        self.execute_sql_file = self.compressor.get_output_file(execute_sql_file)
         self.rollback_sql_file = rollback_sql_file
         self.tmp_sql_file = tmp_sql_file
         self.rollback_sql_files = list()
-        with self.connection as cursor:
-            cursor.execute("SHOW MASTER STATUS")
-            self.eof_file, self.eof_pos = cursor.fetchone()[:2]
-            cursor.execute("SHOW MASTER LOGS")
-            bin_index = [row[0] for row in cursor.fetchall()]
-            if self.start_file not in bin_index:
-                raise ValueError('parameter error: start_file %s not in mysql server' % self.start_file)
-            binlog2i = lambda x: x.split('.')[1]
-            for binary in bin_index:
-                if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.end_file):
-                    self.binlogList.append(binary)
-
-            cursor.execute("SELECT @@server_id")
-            self.server_id = cursor.fetchone()[0]
-            if not self.server_id:
-                raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
+        self.rollback_catalog = None
+        self.load_data = load_data
+        self.load_data_file_prefix = tmp_sql_file.replace("_tmp.spool", "_load")
+        self.load_data_tables = list()
+        self.compact = compact
+        self.compact_memory_rows = compact_memory_rows
+        self.pipeline = pipeline
+        self.checkpoint_file = get_checkpoint_file(tmp_sql_file)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = load_checkpoint(resume_file) if resume_file else None
+        if self.checkpoint:
+            self.checkpoint_file = resume_file
+            self.execute_sql_file = self.checkpoint['execute_sql_file']
+            self.rollback_sql_file = self.checkpoint['rollback_sql_file']
+            self.tmp_sql_file = self.checkpoint['tmp_sql_file']
+            self.load_data_file_prefix = self.checkpoint.get('load_data_file_prefix', self.load_data_file_prefix)
+            self.load_data_tables = self.checkpoint.get('load_data_tables', [])
+        self.hex_blob_threshold = hex_blob_threshold
+        self.escaper = SqlValueEscaper(self.conn_setting['charset'], hex_blob_threshold=hex_blob_threshold)
+        self.max_allowed_packet = DEFAULT_MAX_ALLOWED_PACKET
+        self.server_uuid = None
+        self.binlog_sizes = dict()
+        self.time_index = None
+        self.table_cache = None
+        if table_cache and not self.binlog_dir and not self.replay_event_spool:
+            self.table_cache = TableMetadataCache(
+                get_table_metadata_cache_file(self.conn_setting['host'], self.conn_setting['port'], output_dir))
+        if self.replay_event_spool:
+            self.init_spool_binlog()
+        elif self.binlog_dir:
+            self.init_local_binlog()
+        else:
+            self.init_server_binlog()
+        self.metrics = ProcessMetrics() if metrics_file else None
+        self.metrics_file, self.metrics_format, self.metrics_interval = metrics_file, metrics_format, metrics_interval
+        self.metrics_exporter = MetricsExporter(metrics_file, metrics_format, metrics_interval) \
+            if metrics_file else None
+        if self.metrics is not None:
+            self.metrics.set_binlog_eof(self.eof_file, self.eof_pos, self.binlog_sizes)
+        if time_index and not self.replay_event_spool:
+            self.init_time_index()
+        if self.checkpoint:
+            self.resume_from_checkpoint()
+        elif self.time_index is not None and start_time and self.auto_position is None \
+                and self.row_lookup_changes is None:
+            self.seek_start_time()
+        self.multi_row = multi_row
+        self.max_statement_bytes = max_statement_bytes if max_statement_bytes \
+            else self.max_allowed_packet - MULTI_ROW_RESERVED_BYTES
+        self.memory_budget = memory_budget
+        self.max_queue_bytes = memory_budget * 1048576 // MEMORY_BUDGET_QUEUE_RATIO
+        self.max_batch_bytes = memory_budget * 1048576 // MEMORY_BUDGET_BATCH_RATIO
+        if self.max_batch_bytes:
+            # 合并中的多行语句同样占用内存
+            self.max_statement_bytes = min(self.max_statement_bytes, self.max_batch_bytes)
+        self.worker_peak_rss_kb = 0
+
+    def init_row_lookup(self, lookup_table, lookup_key):
+        """
+        从行变更索引中查找指定行的变更，解析范围为第一个变更所在事务的起始位点到最后一个变更的结束位点
+        :param lookup_table: schema.table
+        :param lookup_key: 按主键顺序排列的主键字段值
+        :return: (start_file, start_pos, end_file, end_pos, only_schemas, only_tables)
+        """
+        schema, table = lookup_table.split('.', 1)
+        self.row_lookup_key = format_row_key(lookup_key)
+        row_index = RowChangeIndex(self.row_index_file)
+        try:
+            self.row_lookup_changes = row_index.find_changes(schema, table, self.row_lookup_key)
+        finally:
+            row_index.close()
+        if not self.row_lookup_changes:
+            raise ValueError('no changes of %s %s in row index %s' % (lookup_table, lookup_key, self.row_index_file))
+        print("row index: {0} changes of {1} {2}".format(
+            len(self.row_lookup_changes), lookup_table, ' '.join(lookup_key)))
+        for log_file, _, end_pos, timestamp, row_event_type in self.row_lookup_changes:
+            print("{0} {1}:{2} {3}".format(datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                                           log_file, end_pos, row_event_type))
+        first_change, last_change = self.row_lookup_changes[0], self.row_lookup_changes[-1]
+        return first_change[0], first_change[1], last_change[0], last_change[2], [schema], [table]
+
+    def init_server_binlog(self):
+        """
+        从数据库实例获取binlog文件列表、最新位点和server_id，生成SQL不依赖数据库连接，获取后即关闭连接
+        :return:
+        """
+        connection = pymysql.connect(**self.conn_setting)
+        try:
+            with connection as cursor:
+                cursor.execute("SHOW MASTER STATUS")
+                self.eof_file, self.eof_pos = cursor.fetchone()[:2]
+                cursor.execute("SHOW MASTER LOGS")
+                master_logs = cursor.fetchall()
+                bin_index = [row[0] for row in master_logs]
+                self.binlog_sizes = {row[0]: row[1] for row in master_logs}
+                if self.gtid_auto_position:
+                    # 起始位点由实例确定，所有binlog文件都在解析范围内
+                    self.start_file, self.start_pos = bin_index[0], 4
+                    self.end_file = self.end_file or self.eof_file
+                    if self.checkpoint is None:
+                        cursor.execute("SELECT @@GLOBAL.gtid_executed")
+                        self.auto_position = self.gtid_filter.get_auto_position(cursor.fetchone()[0])
+                self.init_binlog_list(bin_index)
+
+                cursor.execute("SELECT @@server_id, @@max_allowed_packet")
+                self.server_id, self.max_allowed_packet = cursor.fetchone()[:2]
+                cursor.execute("SHOW VARIABLES LIKE 'server_uuid'")
+                server_uuid_row = cursor.fetchone()
+                self.server_uuid = server_uuid_row[1] if server_uuid_row else None
+                if self.table_cache is not None:
+                    self.table_cache.load_fingerprints(cursor)
+                if not self.server_id:
+                    raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'],
+                                                                     self.conn_setting['port']))
+        finally:
+            connection.close()
+
+    def init_local_binlog(self):
+        """
+        从本地binlog目录获取binlog文件列表，最后一个文件的大小作为结束位点
+        :return:
+        """
+        if not self.schema_file:
+            raise ValueError('Lack of parameter: schema_file')
+        bin_index = list_local_binlog_files(self.binlog_dir, self.start_file)
+        self.init_binlog_list(bin_index)
+        self.eof_file = self.binlogList[-1]
+        self.eof_pos = os.path.getsize(os.path.join(self.binlog_dir, self.eof_file))
+        self.binlog_sizes = {binlog_file: os.path.getsize(os.path.join(self.binlog_dir, binlog_file))
+                             for binlog_file in bin_index}
+        self.server_id = None
+
+    def init_spool_binlog(self):
+        """
+        从事件文件的meta信息获取binlog文件列表，最后记录的位点作为结束位点
+        :return:
+        """
+        meta = self.event_spool_meta
+        print("replay event spool {0}: {1}:{2} - {3}:{4}, events:{5}, recorded with databases:{6}, tables:{7}, "
+              "sql type:{8}".format(self.replay_event_spool, meta['first_file'], meta['first_pos'],
+                                    meta['last_file'], meta['last_pos'], meta['event_count'],
+                                    meta.get('only_schemas'), meta.get('only_tables'), meta.get('sql_type')))
+        self.init_binlog_list(meta['binlog_files'])
+        self.eof_file, self.eof_pos = meta['last_file'], meta['last_pos']
+        self.server_id = None
+
+    def init_binlog_list(self, bin_index):
+        if self.start_file not in bin_index:
+            raise ValueError('parameter error: start_file %s not in mysql server' % self.start_file)
+        self.bin_index = bin_index
+        binlog2i = lambda x: x.split('.')[1]
+        for binary in bin_index:
+            if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.end_file):
+                self.binlogList.append(binary)
+
+    def init_time_index(self):
+        """
+        加载时间索引，在线实例按server_uuid区分，本地binlog按目录区分
+        :return:
+        """
+        if self.binlog_dir:
+            dir_hash = hashlib.md5(os.path.realpath(self.binlog_dir).encode('utf-8')).hexdigest()[:16]
+            server_key = "local_{0}".format(dir_hash)
+        elif self.server_uuid:
+            server_key = self.server_uuid
+        else:
+            server_key = "{0}_{1}".format(self.conn_setting['host'], self.conn_setting['port'])
+        self.time_index = BinlogTimeIndex(get_time_index_file(server_key, self.output_dir))
+        self.time_index.prune(self.bin_index, self.binlog_sizes)
+
+    def seek_start_time(self):
+        """
+        根据时间索引将起始位点移动到start_time之前最近的采样点
+        :return:
+        """
+        start_position = self.time_index.find_start_position(
+            binlog_files=self.binlogList, start_time=self.start_time.timestamp(),
+            start_file=self.start_file, start_pos=self.start_pos)
+        if start_position is None:
+            return
+        log_file, log_pos = start_position
+        self.binlogList = self.binlogList[self.binlogList.index(log_file):]
+        self.start_file, self.start_pos = log_file, log_pos
+        print("seek start datetime to {0}:{1} by time index".format(log_file, log_pos))
+
+    def resume_from_checkpoint(self):
+        """
+        将起始位点设置为断点中最后一个完整事务的结束位点，并丢弃临时文件中断点之后写入的记录
+        :return:
+        """
+        if self.checkpoint['stage'] != 'parse':
+            return
+        log_file = self.checkpoint['log_file']
+        if log_file not in self.binlogList:
+            raise ValueError('parameter error: checkpoint file %s not in binlog range' % log_file)
+        self.binlogList = self.binlogList[self.binlogList.index(log_file):]
+        self.start_file, self.start_pos = log_file, self.checkpoint['log_pos']
+        if self.gtid_filter is not None:
+            # 断点位于BEGIN，之前的GtidEvent不会再次读取，沿用断点中该事务的GTID选择结果
+            self.gtid_filter.reader_tracker = GtidTransactionTracker(
+                self.gtid_filter, selected=self.checkpoint.get('transaction_selected'),
+                has_gtid=self.checkpoint.get('transaction_has_gtid', True))
+        truncate_spool(self.tmp_sql_file, self.checkpoint['spool_record_count'])
+        if self.load_data:
+            truncate_load_data_files(self.load_data_file_prefix, self.load_data_tables)
+        print("resume from {0}:{1}, spool records:{2}".format(
+            self.start_file, self.start_pos, self.checkpoint['spool_record_count']))
+
+    def save_checkpoint(self, stage, log_file=None, log_pos=None, spool_record_count=0, transaction_tracker=None):
+        """
+        保存断点，stage为parse时记录已完整写入临时文件的最后一个事务的结束位点
+        :param stage: parse/result/finished
+        :param transaction_tracker: 断点位置的事务的GTID选择状态
+        :return:
+        """
+        save_checkpoint(self.checkpoint_file, {
+            'stage': stage, 'log_file': log_file, 'log_pos': log_pos,
+            'spool_record_count': spool_record_count,
+            'transaction_selected': transaction_tracker.selected if transaction_tracker else True,
+            'transaction_has_gtid': transaction_tracker.has_gtid if transaction_tracker else False,
+            'execute_sql_file': self.execute_sql_file, 'rollback_sql_file': self.rollback_sql_file,
+            'tmp_sql_file': self.tmp_sql_file, 'flashback': self.flashback,
+            'load_data_file_prefix': self.load_data_file_prefix, 'load_data_tables': self.load_data_tables,
+            'update_time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        self.checkpoint_time = time.time()
+
+    def export_metrics(self):
+        """
+        导出统计结果，持续解析在线实例时先刷新最新位点用于计算延迟
+        :return:
+        """
+        if self.stop_never and not self.binlog_dir:
+            connection = pymysql.connect(**self.conn_setting)
+            try:
+                with connection as cursor:
+                    cursor.execute("SHOW MASTER STATUS")
+                    eof_file, eof_pos = cursor.fetchone()[:2]
+                    cursor.execute("SHOW MASTER LOGS")
+                    self.metrics.set_binlog_eof(eof_file, eof_pos, {row[0]: row[1] for row in cursor.fetchall()})
+            finally:
+                connection.close()
+        self.metrics_exporter.export(self.metrics)
+
+    def create_binlog_stream(self, log_file=None, log_pos=None):
+        """
+        创建binlog事件源，本地模式下直接读取binlog文件；查询行变更时只读取索引中记录的事务
+        :param log_file: 起始文件，默认为start_file
+        :param log_pos: 起始位点，默认为start_pos
+        :return:
+        """
+        if self.row_lookup_changes is not None and log_file is None:
+            return RowLookupStream(self.create_binlog_stream, self.row_lookup_changes, self.row_lookup_key)
+        log_file, log_pos = (log_file, log_pos) if log_file else (self.start_file, self.start_pos)
+        if self.replay_event_spool:
+            return EventSpoolReader(self.replay_event_spool, log_file=log_file, log_pos=log_pos,
+                                    only_schemas=self.only_schemas, only_tables=self.only_tables,
+                                    only_events=self.event_filter.only_events)
+        if self.binlog_dir:
+            return BinLogFileReader(binlog_dir=self.binlog_dir, binlog_files=self.binlogList,
+                                    schema_snapshot=SchemaSnapshot(self.schema_file, self.conn_setting['charset']),
+                                    log_file=log_file, log_pos=log_pos,
+                                    only_schemas=self.only_schemas, only_tables=self.only_tables,
+                                    only_events=self.event_filter.only_events,
+                                    ignored_events=self.event_filter.ignored_events,
+                                    freeze_schema=self.event_filter.freeze_schema)
+        # auto_position时实例跳过的事务不会发送，无法通过结束位点判断解析结束，改为读取到最新位点后由实例结束
+        return CachedBinLogStreamReader(connection_settings=self.conn_setting, server_id=self.server_id,
+                                        log_file=log_file, log_pos=log_pos,
+                                        only_schemas=self.only_schemas, only_tables=self.only_tables,
+                                        resume_stream=True, blocking=self.stop_never or self.auto_position is None,
+                                        auto_position=self.auto_position,
+                                        only_events=self.event_filter.only_events,
+                                        ignored_events=self.event_filter.ignored_events,
+                                        freeze_schema=self.event_filter.freeze_schema,
+                                        table_metadata_cache=self.table_cache)
 
     def process_binlog(self):
-        stream = BinLogStreamReader(connection_settings=self.conn_setting, server_id=self.server_id,
-                                    log_file=self.start_file, log_pos=self.start_pos, only_schemas=self.only_schemas,
-                                    only_tables=self.only_tables, resume_stream=True, blocking=True)
+        if self.checkpoint and self.checkpoint['stage'] == 'finished':
+            print("checkpoint {0} already finished".format(self.checkpoint_file))
+            return True
+        if self.checkpoint and self.checkpoint['stage'] == 'parse':
+            self.process_binlog_to_tmp()
+        elif self.checkpoint is None:
+            # 合并行变更需要按顺序解析整个回滚窗口，auto_position时起始位点由实例确定
+            if self.workers > 1 and len(self.binlogList) > 1 and not self.compact and self.auto_position is None \
+                    and self.row_lookup_changes is None and not self.replay_event_spool:
+                self.process_binlog_parallel()
+            else:
+                self.process_binlog_to_tmp()
+        if self.time_index is not None:
+            self.time_index.save()
+        if self.checkpoint_interval > 0:
+            self.save_checkpoint(stage='result')
+        result_start = time.perf_counter()
+        self.create_result_sql()
+        if self.metrics is not None:
+            self.metrics.add_time('result', time.perf_counter() - result_start)
+        if self.load_data:
+            self.create_load_data_script()
+        self.compressor.close()
+        if self.checkpoint_interval > 0:
+            self.save_checkpoint(stage='finished')
+        if self.metrics_exporter is not None:
+            self.export_metrics()
+        print("peak rss: {0:.1f} MB{1}".format(get_peak_rss() / 1024.0, ", workers: {0:.1f} MB".format(
+            self.worker_peak_rss_kb / 1024.0) if self.worker_peak_rss_kb else ''))
+        return True
+
+    def create_load_data_script(self):
+        """
+        生成加载所有数据文件的脚本，执行后恢复被删除的行
+        :return:
+        """
+        load_data_script_file = self.load_data_file_prefix + "_data.sql"
+        write_load_data_script(load_data_script_file, self.load_data_tables)
+        print("load data script: {0}, tables:{1}, rows:{2}".format(
+            load_data_script_file, len(self.load_data_tables),
+            sum(table_item['row_count'] for table_item in self.load_data_tables)))
+
+    def process_binlog_to_tmp(self):
+        """
+        解析binlog事件并将生成的SQL写入临时文件
+        :return:
+        """
+        stream = self.create_binlog_stream()
+        if self.event_spool_file and not self.replay_event_spool:
+            stream = EventSpoolRecorder(stream, self.create_event_spool_writer(self.event_spool_file))
+        # 解析线程按同样的规则跟踪事务的选择状态，从断点继续时为断点所在事务的选择结果
+        transaction_tracker = None
+        transaction_selected = True
+        if self.gtid_filter is not None:
+            reader_tracker = self.gtid_filter.reader_tracker
+            transaction_tracker = GtidTransactionTracker(self.gtid_filter, selected=reader_tracker.selected,
+                                                         has_gtid=reader_tracker.has_gtid)
+        event_reader = BinlogEventReader(
+            stream, max_queue_events=PIPELINE_QUEUE_EVENTS if self.pipeline else 0,
+            prefetch_rows=None if self.memory_budget else self.is_rows_event_selected, stage_timer=self.metrics,
+            event_filter=self.gtid_filter.accept_event if self.gtid_filter is not None else None,
+            max_queue_bytes=self.max_queue_bytes)
         flag_last_event = False
         slave_proxy_id = 0
         e_start_pos, last_pos = stream.log_pos, stream.log_pos
-        self.touch_tmp_sql_file()
         # to simplify code, we do not use flock for tmp_file.
+        self.tmp_spool = SqlSpoolWriter(self.tmp_sql_file, compressor=self.compressor)
+        self.tmp_new_transaction = True
+        sql_writer = SqlBatchWriter(self.write_tmp_sql, PIPELINE_QUEUE_BATCHES if self.pipeline else 0)
+        self.checkpoint_time = time.time()
         transaction_count = 0
-        with self.connection as cursor:
-            sql_list = []
-            for binlog_event in stream:
-                # for attr_name in dir(binlog_event):
-                #     print attr_name + ":" + str(getattr(binlog_event, attr_name))
-                if not self.stop_never:
-                    try:
-                        event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-                    except OSError:
-                        event_time = datetime.datetime(1980, 1, 1, 0, 0)
-                    if (stream.log_file == self.end_file and stream.log_pos == self.end_pos) or \
-                            (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
-                        flag_last_event = True
-                    elif event_time < self.start_time:
-                        if not (isinstance(binlog_event, RotateEvent)
-                                or isinstance(binlog_event, FormatDescriptionEvent)):
-                            last_pos = binlog_event.packet.log_pos
-                        continue
-                    elif (stream.log_file not in self.binlogList) or \
-                            (self.end_pos and stream.log_file == self.end_file and stream.log_pos > self.end_pos) or \
-                            (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
-                            (event_time >= self.stop_time):
-                        break
-                    # else:
-                    #     raise ValueError('unknown binlog file or position')
-                if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
-                    e_start_pos = last_pos
-                    transaction_count += 1
-                    if transaction_count % 100 == 0:
-                        print("process binlog at {}".format(last_pos))
-                    slave_proxy_id = binlog_event.slave_proxy_id
-                    if len(sql_list) == 0 or sql_list[-1] != SPLIT_TRAN_FLAG:
-                        sql_list.append(SPLIT_TRAN_FLAG)
-
-                if self.pseudo_thread_id > 0:
-                    if self.pseudo_thread_id != slave_proxy_id:
-                        continue
-                if isinstance(binlog_event, QueryEvent) and not self.only_dml:
-                    sql = concat_sql_from_binlog_event(
-                        cursor=cursor, binlog_event=binlog_event,
-                        flashback=self.flashback, no_pk=self.no_pk,
-                        rollback_with_primary_key=self.rollback_with_primary_key,
-                        rollback_with_changed_value=self.rollback_with_changed_value)
-                    if sql:
-                        sql_list.append(sql)
-                        if len(sql_list) == MAX_SQL_COUNT_PER_WRITE:
-                            self.write_tmp_sql(sql_list=sql_list)
-                elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
-                    for row in binlog_event.rows:
-                        sql = concat_sql_from_binlog_event(
-                            cursor=cursor, binlog_event=binlog_event, no_pk=self.no_pk,
+        sql_list = []
+        # 指定内存预算时sql_list中SQL的字节数
+        sql_list_bytes = 0
+        if self.multi_row:
+            multi_row_merger = MultiRowSqlMerger(
+                max_statement_bytes=self.max_statement_bytes, flashback=self.flashback, no_pk=self.no_pk,
+                rollback_with_primary_key=self.rollback_with_primary_key, escaper=self.escaper,
+                stage_timer=self.metrics)
+        else:
+            multi_row_merger = None
+        load_data_writer = LoadDataWriter(
+            file_prefix=self.load_data_file_prefix, data_format=self.load_data,
+            charset=self.conn_setting['charset'], table_items=self.load_data_tables) if self.load_data else None
+        row_compactor = RowChangeCompactor(
+            spill_file=self.tmp_sql_file.replace("_tmp.spool", "_compact.db"),
+            max_memory_rows=self.compact_memory_rows) if self.compact else None
+        if row_compactor is not None:
+            print("WARNING: --compact writes one net rollback statement per row as its own transaction, "
+                  "the original transactions are not atomic and the statement order is not kept")
+        # 合并时没有主键、按原顺序生成回滚语句的表
+        compact_skipped_tables = set()
+        row_index = RowChangeIndex(self.row_index_file) \
+            if self.row_index_file and self.row_lookup_changes is None else None
+        for binlog_event, log_file, log_pos in event_reader:
+            # for attr_name in dir(binlog_event):
+            #     print attr_name + ":" + str(getattr(binlog_event, attr_name))
+            self.event_filter.observe(binlog_event, last_pos)
+            if transaction_tracker is not None:
+                transaction_selected = transaction_tracker.update(binlog_event)
+            if self.metrics is not None:
+                self.metrics.observe_event(binlog_event, log_file, log_pos)
+            if self.time_index is not None and isinstance(binlog_event, QueryEvent) \
+                    and binlog_event.query == 'BEGIN':
+                self.time_index.add_sample(log_file, last_pos, binlog_event.timestamp)
+            if not self.stop_never:
+                try:
+                    event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+                except OSError:
+                    event_time = datetime.datetime(1980, 1, 1, 0, 0)
+                if (log_file == self.end_file and log_pos == self.end_pos) or \
+                        (log_file == self.eof_file and log_pos == self.eof_pos):
+                    flag_last_event = True
+                elif event_time < self.start_time:
+                    last_pos = get_next_event_pos(binlog_event, last_pos)
+                    continue
+                elif (log_file not in self.binlogList) or \
+                        (self.end_pos and log_file == self.end_file and log_pos > self.end_pos) or \
+                        (log_file == self.eof_file and log_pos > self.eof_pos) or \
+                        (event_time >= self.stop_time):
+                    break
+                # else:
+                #     raise ValueError('unknown binlog file or position')
+            if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
+                e_start_pos = last_pos
+                transaction_count += 1
+                if transaction_count % 100 == 0 and self.metrics is None:
+                    print("process binlog at {}".format(last_pos))
+                if self.metrics_exporter is not None and self.metrics_exporter.is_due():
+                    self.export_metrics()
+                slave_proxy_id = binlog_event.slave_proxy_id
+                if multi_row_merger:
+                    sql_list.extend(multi_row_merger.flush())
+                # 合并中的行变更不保存到断点中
+                if 0 < self.checkpoint_interval <= time.time() - self.checkpoint_time and row_compactor is None:
+                    # BEGIN之前的事务已经全部解析，写入临时文件后以BEGIN的位点作为断点
+                    sql_writer.write(sql_list)
+                    sql_list, sql_list_bytes = [], 0
+                    sql_writer.sync()
+                    self.tmp_spool.flush()
+                    if load_data_writer:
+                        self.load_data_tables = load_data_writer.checkpoint()
+                    self.save_checkpoint(stage='parse', log_file=log_file, log_pos=e_start_pos,
+                                         spool_record_count=self.tmp_spool.record_count,
+                                         transaction_tracker=transaction_tracker)
+                    if self.time_index is not None:
+                        self.time_index.save()
+                    if self.table_cache is not None:
+                        self.table_cache.save()
+                    if row_index is not None:
+                        row_index.flush()
+                if len(sql_list) == 0 or sql_list[-1] != SPLIT_TRAN_FLAG:
+                    sql_list.append(SPLIT_TRAN_FLAG)
+
+            if self.pseudo_thread_id > 0:
+                if self.pseudo_thread_id != slave_proxy_id:
+                    continue
+            if row_index is not None and transaction_selected and is_dml_event(binlog_event) \
+                    and event_type(binlog_event) in self.sql_type:
+                row_index.add_event(binlog_event, log_file, e_start_pos)
+            if not transaction_selected:
+                # GTID不在范围内的事务，行事件已在读取线程中丢弃，DDL语句同样不生成SQL
+                pass
+            elif isinstance(binlog_event, QueryEvent) and not self.only_dml:
+                sql = concat_sql_from_binlog_event(
+                    binlog_event=binlog_event, escaper=self.escaper,
+                    flashback=self.flashback, no_pk=self.no_pk,
+                    rollback_with_primary_key=self.rollback_with_primary_key,
+                    rollback_with_changed_value=self.rollback_with_changed_value)
+                if sql:
+                    if multi_row_merger:
+                        sql_list.extend(multi_row_merger.flush())
+                    sql_list.append(sql)
+                    if len(sql_list) == MAX_SQL_COUNT_PER_WRITE:
+                        sql_writer.write(sql_list)
+                        sql_list, sql_list_bytes = [], 0
+            elif load_data_writer and event_type(binlog_event) == 'DELETE':
+                row_count = 0
+                for row in iter_event_rows(binlog_event):
+                    row_count += 1
+                    load_data_writer.write_row(binlog_event, row['values'])
+                if self.metrics is not None:
+                    self.metrics.observe_rows(binlog_event, row_count)
+            elif row_compactor is not None and is_dml_event(binlog_event) \
+                    and event_type(binlog_event) in self.sql_type and row_compactor.has_primary_key(binlog_event):
+                if self.metrics is not None:
+                    self.metrics.observe_rows(binlog_event, len(binlog_event.rows))
+                row_compactor.add_event(binlog_event, e_start_pos)
+            elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
+                if row_compactor is not None:
+                    compact_skipped_tables.add('{0}.{1}'.format(binlog_event.schema, binlog_event.table))
+                row_count = 0
+                # 逐行解码，之前已经解码的事件直接使用解码结果
+                for row in iter_event_rows(binlog_event):
+                    row_count += 1
+                    merged_sql_list = multi_row_merger.add_row(
+                        binlog_event=binlog_event, row=row, e_start_pos=e_start_pos) if multi_row_merger else None
+                    if merged_sql_list is None:
+                        merged_sql_list = multi_row_merger.flush() if multi_row_merger else []
+                        merged_sql_list.append(concat_sql_from_binlog_event(
+                            binlog_event=binlog_event, escaper=self.escaper, no_pk=self.no_pk,
                             row=row, flashback=self.flashback, e_start_pos=e_start_pos,
                             rollback_with_primary_key=self.rollback_with_primary_key,
-                            rollback_with_changed_value=self.rollback_with_changed_value)
-                        sql_list.append(sql)
-                        if len(sql_list) == MAX_SQL_COUNT_PER_WRITE:
-                            self.write_tmp_sql(sql_list=sql_list)
-                            sql_list = []
-
-                if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
-                    last_pos = binlog_event.packet.log_pos
-                if flag_last_event:
-                    break
-            self.write_tmp_sql(sql_list=sql_list)
-            stream.close()
+                            rollback_with_changed_value=self.rollback_with_changed_value,
+                            stage_timer=self.metrics))
+                    sql_list.extend(merged_sql_list)
+                    if self.max_batch_bytes:
+                        sql_list_bytes += sum(len(sql) for sql in merged_sql_list)
+                    if len(sql_list) >= MAX_SQL_COUNT_PER_WRITE or \
+                            (self.max_batch_bytes and sql_list_bytes >= self.max_batch_bytes):
+                        sql_writer.write(sql_list)
+                        sql_list, sql_list_bytes = [], 0
+                if self.metrics is not None:
+                    self.metrics.observe_rows(binlog_event, row_count)
 
-            if self.flashback:
-                self.create_rollback_sql()
-            else:
-                self.create_execute_sql()
-            print("===============================================")
-            if not self.flashback:
-                print("执行脚本文件：\n{0}".format(self.execute_sql_file))
-            else:
-                print("回滚脚本文件:")
-                new_file_list = list(reversed(self.rollback_sql_files))
-                for tmp_file in new_file_list:
-                    print(tmp_file)
-            print("===============================================")
-        return True
+            last_pos = get_next_event_pos(binlog_event, last_pos)
+            if flag_last_event:
+                break
+        event_reader.close()
+        if multi_row_merger:
+            sql_list.extend(multi_row_merger.flush())
+        if row_compactor is not None:
+            sql_list = self.write_compacted_sql(row_compactor, sql_list, sql_writer)
+            if compact_skipped_tables:
+                print("WARNING: tables without primary key are not compacted: {0}, the compacted rollback "
+                      "statements run before their rollback statements".format(
+                          ', '.join(sorted(compact_skipped_tables))))
+        sql_writer.write(sql_list)
+        sql_writer.close()
+        self.tmp_spool.close()
+        if load_data_writer:
+            self.load_data_tables = load_data_writer.close()
+        if row_index is not None:
+            row_index.close()
+            print("row index: {0} row changes recorded to {1}".format(row_index.row_count, self.row_index_file))
+        stream.close()
+        if self.table_cache is not None:
+            self.table_cache.save()
+        print(self.event_filter.report())
+        if self.gtid_filter is not None:
+            print(self.gtid_filter.report())
+
+    def create_event_spool_writer(self, spool_file):
+        return EventSpoolWriter(spool_file, meta={
+            'source': self.binlog_dir or '{0}:{1}'.format(self.conn_setting['host'], self.conn_setting['port']),
+            'charset': self.conn_setting['charset'], 'only_schemas': self.only_schemas,
+            'only_tables': self.only_tables, 'sql_type': self.sql_type, 'only_dml': self.only_dml})
 
-    def touch_tmp_sql_file(self):
+    def is_rows_event_selected(self, binlog_event):
         """
-        创建临时文件并写入第一条事务标志和第一条分隔符
+        行事件是否需要生成SQL，读取线程中预先解码这些事件的行数据
+        """
+        if event_type(binlog_event) not in self.sql_type:
+            return False
+        try:
+            event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+        except OSError:
+            return False
+        return self.stop_never or self.start_time <= event_time < self.stop_time
+
+    def write_compacted_sql(self, row_compactor, sql_list, sql_writer):
+        """
+        生成合并后每行的净回滚语句，每条语句作为独立的事务写入临时文件
+        :param row_compactor:
+        :param sql_list: 未写入临时文件的SQL
+        :param sql_writer:
+        :return: 未写入临时文件的SQL
+        """
+        statement_count = 0
+        for binlog_event, row, e_start_pos in row_compactor.iter_net_rows():
+            sql_list.append(SPLIT_TRAN_FLAG)
+            sql_list.append(concat_sql_from_binlog_event(
+                binlog_event=binlog_event, escaper=self.escaper, row=row, flashback=self.flashback,
+                e_start_pos=e_start_pos, rollback_with_primary_key=self.rollback_with_primary_key,
+                rollback_with_changed_value=self.rollback_with_changed_value, stage_timer=self.metrics))
+            statement_count += 1
+            if len(sql_list) >= MAX_SQL_COUNT_PER_WRITE:
+                sql_writer.write(sql_list)
+                sql_list = []
+        row_compactor.close()
+        print("compact rows: {0} rows -> {1} statements, spilled {2} times".format(
+            row_compactor.row_count, statement_count, row_compactor.spill_count))
+        return sql_list
+
+    def process_binlog_parallel(self):
+        """
+        每个binlog文件由独立进程解析到各自的临时文件，再按binlog顺序合并到临时文件
         :return:
         """
-        with codecs.open(self.tmp_sql_file, "a+", 'utf-8') as f_tmp:
-            f_tmp.writelines(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
-            f_tmp.writelines(SPLIT_LINE_FLAG + EMPTY_LINE_FLAG)
+        worker_jobs = []
+        for file_index, binlog_file in enumerate(self.binlogList):
+            part_sql_file = "{0}.part{1}".format(self.tmp_sql_file, file_index)
+            worker_jobs.append((self.get_worker_kwargs(binlog_file), file_index, part_sql_file))
+        load_data_writer = LoadDataWriter(
+            file_prefix=self.load_data_file_prefix, data_format=self.load_data,
+            charset=self.conn_setting['charset']) if self.load_data else None
+        event_spool_writer = self.create_event_spool_writer(self.event_spool_file) if self.event_spool_file else None
+        with SqlSpoolWriter(self.tmp_sql_file, compressor=self.compressor) as tmp_spool:
+            with multiprocessing.Pool(processes=self.workers) as pool:
+                for part_sql_file, time_index_files, load_data_tables, metrics_snapshot, peak_rss_kb in \
+                        pool.imap(process_binlog_file, worker_jobs):
+                    self.worker_peak_rss_kb = max(self.worker_peak_rss_kb, peak_rss_kb)
+                    print("merge binlog part file {0}".format(part_sql_file))
+                    if self.time_index is not None:
+                        self.time_index.merge(time_index_files)
+                    tmp_spool.append_spool(part_sql_file)
+                    remove_spool(part_sql_file)
+                    if load_data_writer:
+                        load_data_writer.append_tables(load_data_tables)
+                    if event_spool_writer:
+                        event_spool_writer.append_part(get_part_event_spool_file(self.event_spool_file, part_sql_file))
+                    if self.metrics is not None:
+                        self.metrics.merge(metrics_snapshot)
+                        if self.metrics_exporter.is_due():
+                            self.export_metrics()
+        if event_spool_writer:
+            event_spool_writer.close()
+        if load_data_writer:
+            self.load_data_tables = load_data_writer.close()
 
-    def touch_rollback_sub_file(self, rollback_file_id):
+    def get_worker_kwargs(self, binlog_file):
         """
-        创建临时文件并写入第一条事务标志和第一条分隔符
+        生成解析单个binlog文件的Binlog2sql参数，起始文件使用start_pos，结束文件使用end_pos
+        :param binlog_file:
         :return:
         """
-        tmp_rollback_sql_file = str(self.rollback_sql_file).replace("[file_id]", str(rollback_file_id))
-        with codecs.open(tmp_rollback_sql_file, "a+", 'utf-8') as f_tmp:
-            print("touch file")
-            f_tmp.writelines(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+        return dict(
+            connection_settings=dict(self.conn_setting),
+            start_file=binlog_file, end_file=binlog_file,
+            start_pos=self.start_pos if binlog_file == self.start_file else 4,
+            end_pos=self.end_pos if binlog_file == self.end_file else None,
+            start_time=self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            stop_time=self.stop_time.strftime("%Y-%m-%d %H:%M:%S"),
+            only_schemas=self.only_schemas, only_tables=self.only_tables, no_pk=self.no_pk,
+            flashback=self.flashback, back_interval=self.back_interval, only_dml=self.only_dml,
+            sql_type=self.sql_type, rollback_with_primary_key=self.rollback_with_primary_key,
+            rollback_with_changed_value=self.rollback_with_changed_value,
+            pseudo_thread_id=self.pseudo_thread_id, binlog_dir=self.binlog_dir, schema_file=self.schema_file,
+            multi_row=self.multi_row, max_statement_bytes=self.max_statement_bytes,
+            time_index=self.time_index is not None, table_cache=self.table_cache is not None,
+            compression=self.compression, load_data=self.load_data, pipeline=self.pipeline,
+            metrics_file=self.metrics_file, metrics_format=self.metrics_format,
+            start_gtid_set=self.start_gtid_set, include_gtids=self.include_gtids,
+            exclude_gtids=self.exclude_gtids, hex_blob_threshold=self.hex_blob_threshold,
+            output_dir=self.output_dir, row_index=self.row_index_file, event_spool=self.event_spool_file,
+            memory_budget=self.memory_budget, freeze_schema=self.event_filter.freeze_schema
+        )
+
+    def create_result_sql(self):
+        """
+        根据临时文件生成执行脚本或回滚脚本
+        :return:
+        """
+        if self.checkpoint:
+            # 结果文件由临时文件完整生成，删除中断前生成的部分结果
+            result_files = glob.glob(glob.escape(self.rollback_sql_file).replace("[[]file_id]", "*"))
+            result_files.append(self.execute_sql_file)
+            result_files.append(get_rollback_catalog_file(self.rollback_sql_file))
+            for result_file in result_files:
+                if os.path.exists(result_file):
+                    os.remove(result_file)
+        if self.flashback:
+            self.create_rollback_sql()
+        else:
+            self.create_execute_sql()
+        print("===============================================")
+        if not self.flashback:
+            print("执行脚本文件：\n{0}".format(self.execute_sql_file))
+        else:
+            print("回滚脚本文件:")
+            for tmp_file in self.rollback_sql_files:
+                print(tmp_file)
+            print("回滚目录文件:\n{0}".format(self.rollback_catalog.catalog_file))
+        print("===============================================")
 
     def write_tmp_sql(self, sql_list):
         """
-        批量将缓存的SQL脚本写入到临时文件，两条SQL之间使用分隔符分割
-        :param sql_list: 
-        :return: 
+        批量将缓存的SQL脚本写入到临时文件，事务标志记录在临时文件索引中
+        :param sql_list:
+        :return:
         """""
-        print("{0} binlog process,please wait...".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        print("process item:{}".format(len(sql_list)))
-        with codecs.open(self.tmp_sql_file, "a+", 'utf-8') as f_tmp:
-            for sql_item in sql_list:
-                if self.get_sql_count(sql_item) > 0:
-                    f_tmp.writelines(sql_item)
-                    f_tmp.writelines(EMPTY_LINE_FLAG + SPLIT_LINE_FLAG + EMPTY_LINE_FLAG)
+        if self.metrics is None:
+            print("{0} binlog process,please wait...".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            print("process item:{}".format(len(sql_list)))
+        write_start, write_offset = time.perf_counter(), self.tmp_spool.offset
+        for sql_item in sql_list:
+            if sql_item == SPLIT_TRAN_FLAG:
+                self.tmp_new_transaction = True
+            elif sql_item:
+                self.tmp_spool.write(sql_item, new_transaction=self.tmp_new_transaction)
+                self.tmp_new_transaction = False
+        if self.metrics is not None:
+            self.metrics.add_time('write', time.perf_counter() - write_start)
+            self.metrics.bytes_written += self.tmp_spool.offset - write_offset
 
     def create_execute_sql(self):
         """
-        根据临时文件创建回滚脚本
+        根据临时文件创建执行脚本
         :return:
         """
-        with codecs.open(self.tmp_sql_file, "r", 'utf-8') as f_tmp:
-            sql_item_list = []
-            while True:
-                lines = f_tmp.readlines(MAX_SQL_COUNT_PER_WRITE)
-                sql_item = []
-                if lines:
-                    for line in lines:
-                        if str(line).find(SPLIT_LINE_FLAG) >= 0:
-                            if self.get_sql_count(sql_item) > 0:
-                                sql_item_list.append(sql_item)
-                                sql_item = []
-                            if len(sql_item_list) == MAX_SQL_COUNT_PER_FILE:
-                                self.write_execute_file(sql_item_list)
-                                sql_item_list = []
-                        else:
-                            sql_item.append(line)
-                else:
-                    break
-            self.write_execute_file(sql_item_list)
-
-    def write_execute_file(self, sql_list):
-        with codecs.open(self.execute_sql_file, "a+", 'utf-8') as f_tmp:
-            has_sql = True
-            for sql_item in sql_list:
-                for sql_line in sql_item:
-                    if sql_line.find(SPLIT_TRAN_FLAG) >= 0:
-                        if has_sql:
-                            f_tmp.writelines(sql_line)
-                            has_sql = False
-                    else:
-                        has_sql = True
-                        f_tmp.writelines(sql_line)
-
-    def get_sql_count(self, row_item: list):
-        """
-        检查一组SQL中是否包含SQL
-        """
-        sql_count = 0
-        for line_item in row_item:
-            if str(line_item).find(SPLIT_TRAN_FLAG) >= 0:
-                pass
-            elif str(line_item).find(SPLIT_LINE_FLAG) >= 0:
-                pass
-            elif str(line_item).strip() == "":
-                pass
+        with SqlSpoolReader(self.tmp_sql_file) as tmp_reader, \
+                self.compressor.open_text_file(self.execute_sql_file) as f_execute:
+            for sql_item, new_transaction in tmp_reader.iter_records():
+                if new_transaction:
+                    f_execute.write(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+                f_execute.write(sql_item + EMPTY_LINE_FLAG)
+
+    def iter_apply_sql(self):
+        """
+        按执行顺序读取临时文件，回滚模式下倒序读取
+        :return: (SQL, 是否为事务最后一条)的迭代器
+        """
+        with SqlSpoolReader(self.tmp_sql_file) as tmp_reader:
+            if self.flashback:
+                # 倒序读取时事务的第一条SQL即为回滚事务的最后一条
+                for sql_item, new_transaction in tmp_reader.iter_records(reverse=True):
+                    yield sql_item, new_transaction
             else:
-                sql_count += 1
-        return sql_count
+                last_sql_item = None
+                for sql_item, new_transaction in tmp_reader.iter_records():
+                    if last_sql_item is not None:
+                        yield last_sql_item, new_transaction
+                    last_sql_item = sql_item
+                if last_sql_item is not None:
+                    yield last_sql_item, True
+
+    def apply_result_sql(self, sql_applier):
+        """
+        将生成的执行脚本或回滚脚本直接在目标实例上执行
+        :param sql_applier:
+        :return:
+        """
+        print("{0} start apply sql...".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        applied_sql_count = sql_applier.apply(self.iter_apply_sql())
+        print("{0} apply sql finished, sql count:{1}".format(
+            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), applied_sql_count))
+
+    def touch_rollback_sub_file(self, rollback_file_id):
+        """
+        创建回滚文件并写入第一条事务标志
+        :return: 回滚文件路径和文件对象
+        """
+        tmp_rollback_sql_file = self.compressor.get_output_file(
+            str(self.rollback_sql_file).replace("[file_id]", str(rollback_file_id)))
+        f_rollback = self.rollback_catalog.open_file(tmp_rollback_sql_file, self.compressor)
+        f_rollback.write(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+        return tmp_rollback_sql_file, f_rollback
 
     def create_rollback_sql(self):
         """
-        根据临时文件创建回滚脚本
+        倒序读取临时文件创建回滚脚本，每个回滚文件最多包含MAX_SQL_COUNT_PER_FILE条SQL，
+        编号越小的文件中包含的SQL执行时间越晚，文件分组与正序按MAX_SQL_COUNT_PER_FILE分组保持一致。
+        同时将每组语句的文件偏移、位点、时间、表名和事务编号写入回滚目录文件
         :return:
         """
-        with codecs.open(self.tmp_sql_file, "r", 'utf-8') as f_tmp:
-            sql_item = [SPLIT_LINE_FLAG]
-            sql_item_list = []
-            rollback_file_id = 9999
-            while True:
-                lines = f_tmp.readlines(MAX_SQL_COUNT_PER_WRITE)
-                if lines:
-                    for line in lines:
-                        if str(line).find(SPLIT_LINE_FLAG) >= 0 or str(line).find(SPLIT_TRAN_FLAG) >= 0:
-                            # 只有包含SQL语句的记录才会呗
-                            if self.get_sql_count(sql_item) > 0:
-                                sql_item_list.append(sql_item)
-                            sql_item = [SPLIT_LINE_FLAG, EMPTY_LINE_FLAG]
-                            if str(line).find(SPLIT_TRAN_FLAG) >= 0:
-                                sql_item.append(SPLIT_TRAN_FLAG)
-                            if len(sql_item_list) == MAX_SQL_COUNT_PER_FILE:
-                                self.touch_rollback_sub_file(rollback_file_id)
-                                self.write_rollback_sub_file(rollback_file_id, sql_item_list)
-                                sql_item_list = []
-                                rollback_file_id -= 1
-                        else:
-                            sql_item.append(line)
-                else:
-                    break
-            self.touch_rollback_sub_file(rollback_file_id)
-            self.write_rollback_sub_file(rollback_file_id, sql_item_list)
+        self.rollback_catalog = RollbackCatalog(get_rollback_catalog_file(self.rollback_sql_file))
+        with SqlSpoolReader(self.tmp_sql_file) as tmp_reader:
+            record_count = len(tmp_reader)
+            # 事务编号按binlog中的顺序从1开始，倒序读取时从最大的编号开始
+            transaction_id = sum(1 for _, _, flags in tmp_reader.iter_index() if flags & SPOOL_FLAG_NEW_TRANSACTION)
+            file_count = max(1, (record_count + MAX_SQL_COUNT_PER_FILE - 1) // MAX_SQL_COUNT_PER_FILE)
+            rollback_file_id = MAX_ROLLBACK_FILE_ID - file_count + 1
+            file_sql_count = record_count - (file_count - 1) * MAX_SQL_COUNT_PER_FILE
+            tmp_rollback_sql_file, f_rollback = self.touch_rollback_sub_file(rollback_file_id)
+            start_info, next_start_info = "", ""
+            has_new_transaction = False
+            for sql_item, new_transaction in tmp_reader.iter_records(reverse=True):
+                if f_rollback is None:
+                    tmp_rollback_sql_file, f_rollback = self.touch_rollback_sub_file(rollback_file_id)
+                    start_info, next_start_info = "", ""
+                    has_new_transaction = False
+                f_rollback.write(EMPTY_LINE_FLAG)
+                if has_new_transaction:
+                    f_rollback.write(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+                    has_new_transaction = False
+                if sql_item.startswith("### start"):
+                    next_start_info = sql_item.split(EMPTY_LINE_FLAG, 1)[0] + EMPTY_LINE_FLAG
+                    if not start_info:
+                        start_info = next_start_info
+                statement_offset = f_rollback.offset
+                f_rollback.write(sql_item + EMPTY_LINE_FLAG)
+                self.rollback_catalog.add_statement(f_rollback, sql_item, statement_offset, transaction_id)
+                # 倒序读取时遇到事务的第一条SQL，说明该事务的回滚语句已经全部写入
+                has_new_transaction = new_transaction
+                if new_transaction:
+                    transaction_id -= 1
+                file_sql_count -= 1
+                if file_sql_count == 0:
+                    self.close_rollback_sub_file(f_rollback, tmp_rollback_sql_file, start_info, next_start_info)
+                    f_rollback = None
+                    rollback_file_id += 1
+                    file_sql_count = MAX_SQL_COUNT_PER_FILE
+            if f_rollback is not None:
+                self.close_rollback_sub_file(f_rollback, tmp_rollback_sql_file, start_info, next_start_info)
+        self.rollback_catalog.close()
 
-    def write_rollback_sub_file(self, rollback_file_id, sql_item_list):
+    def close_rollback_sub_file(self, f_rollback, tmp_rollback_sql_file, start_info, next_start_info):
         """
-        将拆分后的回滚SQL列表写入指定文件号的回滚文件
-        :param rollback_file_id:
-        :param sql_item_list:
+        关闭回滚文件并将回滚文件信息写入回滚索引文件
         :return:
         """
         print(
             "{0} generate rollback script,please wait...".format(
                 datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         )
-        tmp_rollback_sql_file = str(self.rollback_sql_file).replace("[file_id]", str(rollback_file_id))
-        with codecs.open(tmp_rollback_sql_file, "a+", 'utf-8') as f_tmp:
-            row_count = len(sql_item_list)
-            is_start_info = True
-            start_info = ""
-            next_start_info = ""
-            has_sql = True
-            for row_index in range(row_count):
-                row_item = sql_item_list[row_count - row_index - 1]
-                for line_item in row_item:
-                    if line_item.startswith("### start"):
-                        if is_start_info is True:
-                            start_info = line_item
-                            is_start_info = False
-                        next_start_info = line_item
-                        f_tmp.writelines(line_item)
-                    elif line_item.find(SPLIT_LINE_FLAG) >= 0:
-                        pass
-                    elif line_item.find(SPLIT_TRAN_FLAG) >= 0:
-                        if has_sql:
-                            f_tmp.writelines(line_item)
-                            has_sql = False
-                    else:
-                        f_tmp.writelines(line_item)
-                        has_sql = True
-            self.write_rollback_info_file(
-                tmp_rollback_sql_file=tmp_rollback_sql_file,
-                start_info=start_info,
-                next_start_info=next_start_info
-            )
-            self.rollback_sql_files.append(tmp_rollback_sql_file)
+        f_rollback.close()
+        self.write_rollback_info_file(
+            tmp_rollback_sql_file=tmp_rollback_sql_file,
+            start_info=start_info,
+            next_start_info=next_start_info
+        )
+        self.rollback_sql_files.append(tmp_rollback_sql_file)
 
     def write_rollback_info_file(self, tmp_rollback_sql_file, start_info, next_start_info):
         """
@@ -349,9 +974,47 @@ class Binlog2sql(object):
             f_tmp.writelines(end_info)
 
 
+def get_part_event_spool_file(event_spool_file, part_sql_file):
+    """
+    并行模式下每个进程的事件文件，与临时文件使用相同的序号
+    """
+    return "{0}.{1}".format(event_spool_file, part_sql_file.rsplit('.', 1)[1])
+
+
+def process_binlog_file(worker_job):
+    """
+    并行模式下的进程入口，解析单个binlog文件并返回生成的临时文件
+    :param worker_job: (Binlog2sql参数, 文件序号, 临时文件路径)
+    :return: 临时文件路径、该文件的时间索引采样点、LOAD DATA数据文件、统计结果和进程的峰值内存，由主进程合并
+    """
+    worker_kwargs, file_index, part_sql_file = worker_job
+    binlog2sql = Binlog2sql(**worker_kwargs)
+    if binlog2sql.server_id:
+        binlog2sql.server_id = WORKER_SERVER_ID_BASE + file_index
+    binlog2sql.tmp_sql_file = part_sql_file
+    binlog2sql.load_data_file_prefix = part_sql_file.replace("_tmp.spool.part", "_load.part")
+    if binlog2sql.event_spool_file:
+        binlog2sql.event_spool_file = get_part_event_spool_file(binlog2sql.event_spool_file, part_sql_file)
+    # 统计结果由主进程合并后导出
+    binlog2sql.metrics_exporter = None
+    binlog2sql.process_binlog_to_tmp()
+    binlog2sql.compressor.close()
+    time_index_files = dict()
+    if binlog2sql.time_index is not None:
+        time_index_files = {log_file: samples for log_file, samples in binlog2sql.time_index.files.items()
+                            if log_file in binlog2sql.binlogList}
+    metrics_snapshot = binlog2sql.metrics.snapshot() if binlog2sql.metrics is not None else None
+    return part_sql_file, time_index_files, binlog2sql.load_data_tables, metrics_snapshot, get_peak_rss()
+
+
 if __name__ == '__main__':
     args = command_line_args(sys.argv[1:])
     conn_setting = {'host': args.host, 'port': args.port, 'user': args.user, 'passwd': args.password, 'charset': 'utf8'}
+    if args.dump_schema:
+        table_count = dump_schema_snapshot(connection_settings=conn_setting, snapshot_file=args.schema_file,
+                                           only_schemas=args.databases, only_tables=args.tables)
+        print("dump {0} tables to {1}".format(table_count, args.schema_file))
+        sys.exit(0)
     binlog2sql = Binlog2sql(connection_settings=conn_setting, start_file=args.start_file, start_pos=args.start_pos,
                             end_file=args.end_file, end_pos=args.end_pos, start_time=args.start_time,
                             stop_time=args.stop_time, only_schemas=args.databases, only_tables=args.tables,
@@ -359,5 +1022,32 @@ if __name__ == '__main__':
                             back_interval=args.back_interval, only_dml=args.only_dml, sql_type=args.sql_type,
                             rollback_with_primary_key=args.rollback_with_primary_key,
                             rollback_with_changed_value=args.rollback_with_changed_value,
-                            pseudo_thread_id=args.pseudo_thread_id)
-    binlog2sql.process_binlog()
+                            pseudo_thread_id=args.pseudo_thread_id,
+                            binlog_dir=args.binlog_dir, schema_file=args.schema_file, workers=args.workers,
+                            multi_row=args.multi_row, max_statement_bytes=args.max_statement_bytes,
+                            checkpoint_interval=args.checkpoint_interval, resume_file=args.resume,
+                            time_index=args.time_index, table_cache=args.table_cache,
+                            compression=args.compress, compress_workers=args.compress_workers,
+                            load_data=args.load_data, metrics_file=args.metrics_file,
+                            metrics_format=args.metrics_format, metrics_interval=args.metrics_interval,
+                            compact=args.compact, compact_memory_rows=args.compact_memory_rows,
+                            pipeline=args.pipeline, start_gtid_set=args.start_gtid_set,
+                            include_gtids=args.include_gtids, exclude_gtids=args.exclude_gtids,
+                            hex_blob_threshold=args.hex_blob_threshold, output_dir=args.output_dir,
+                            row_index=args.row_index, lookup_table=args.lookup_table, lookup_key=args.lookup_key,
+                            event_spool=args.event_spool, replay_event_spool=args.replay_event_spool,
+                            memory_budget=args.memory_budget, freeze_schema=args.freeze_schema)
+    profiler = create_profiler(args.profile, args.profile_sample_interval) if args.profile else None
+    if profiler is not None:
+        profiler.start()
+    try:
+        binlog2sql.process_binlog()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    if args.apply:
+        apply_setting = dict(conn_setting, host=args.apply_host or args.host, port=args.apply_port or args.port)
+        sql_applier = SqlApplier(connection_settings=apply_setting, batch_size=args.apply_batch_size,
+                                 back_interval=args.back_interval, max_replica_lag=args.apply_max_lag,
+                                 replica_settings_list=get_replica_settings_list(args.apply_replicas, apply_setting))
+        binlog2sql.apply_result_sql(sql_applier)
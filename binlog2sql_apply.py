@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import datetime
+import threading
+import pymysql
+from pymysql.cursors import DictCursor
+
+DEFAULT_APPLY_BATCH_SIZE = 1000
+# 读取线程最多预先准备的批次数
+MAX_PREPARED_BATCH_COUNT = 4
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+
+
+def split_sql_statements(sql_item):
+    """
+    去掉SQL记录中的注释行，并将DDL记录中的USE语句拆分为单独的语句
+    :param sql_item:
+    :return:
+    """
+    sql_lines = [sql_line for sql_line in sql_item.split('\n') if not sql_line.startswith('###')]
+    if sql_lines and sql_lines[0].startswith('USE ') and len(sql_lines) > 1:
+        return [sql_lines[0], '\n'.join(sql_lines[1:])]
+    sql_text = '\n'.join(sql_lines).strip()
+    return [sql_text] if sql_text else []
+
+
+def get_replica_settings_list(replicas, connection_settings):
+    """
+    根据host:port格式的从库列表生成从库连接配置，用户名和密码与目标实例相同
+    :param replicas:
+    :param connection_settings:
+    :return:
+    """
+    replica_settings_list = []
+    for replica in replicas or []:
+        host, _, port = replica.partition(':')
+        replica_settings_list.append(dict(connection_settings, host=host, port=int(port) if port else 3306))
+    return replica_settings_list
+
+
+class ReusableConnection(object):
+    """
+    在批次之间复用同一个数据库连接，连接异常时由调用方丢弃，下次获取时重新创建
+    """
+
+    def __init__(self, connection_settings):
+        self.connection_settings = connection_settings
+        self.connection = None
+
+    def get_connection(self):
+        connection, self.connection = self.connection, None
+        if connection is None:
+            connection = pymysql.connect(**self.connection_settings)
+        return connection
+
+    def release_connection(self, connection, discard=False):
+        if discard or not connection.open:
+            connection.close()
+            return
+        self.connection = connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class SqlApplier(object):
+    """
+    将生成的SQL按批次在目标实例上执行，每个批次作为一个事务提交，批次之间按back_interval和从库延迟限流。
+    读取线程负责准备下一批SQL，执行线程按顺序提交，保证执行顺序与SQL文件一致
+    """
+
+    def __init__(self, connection_settings, batch_size=DEFAULT_APPLY_BATCH_SIZE, back_interval=1.0,
+                 max_replica_lag=0, replica_settings_list=None):
+        self.connection_settings = dict(connection_settings, autocommit=False)
+        self.batch_size = batch_size
+        self.back_interval = back_interval
+        self.max_replica_lag = max_replica_lag
+        self.target_connection = ReusableConnection(self.connection_settings)
+        self.replica_connections = [ReusableConnection(dict(replica_settings, cursorclass=DictCursor))
+                                    for replica_settings in (replica_settings_list or [])]
+        self.applied_sql_count = 0
+        self.applied_batch_count = 0
+
+    def iter_batches(self, sql_items):
+        """
+        将(SQL, 是否为事务最后一条)按批次分组，批次只在事务边界处切分
+        """
+        sql_batch = []
+        for sql_item, transaction_end in sql_items:
+            sql_batch.extend(split_sql_statements(sql_item))
+            if transaction_end and len(sql_batch) >= self.batch_size:
+                yield sql_batch
+                sql_batch = []
+        if sql_batch:
+            yield sql_batch
+
+    @staticmethod
+    def put_batch(batch_queue, item, stop_event):
+        """
+        队列已满时等待执行线程取出，执行线程异常退出后不再等待
+        :return: 是否已放入队列
+        """
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def prepare_batches(self, sql_items, batch_queue, stop_event):
+        try:
+            for sql_batch in self.iter_batches(sql_items):
+                if not self.put_batch(batch_queue, sql_batch, stop_event):
+                    return
+            self.put_batch(batch_queue, None, stop_event)
+        except Exception as ex:
+            self.put_batch(batch_queue, ex, stop_event)
+
+    def apply(self, sql_items):
+        """
+        执行SQL
+        :param sql_items: 按执行顺序返回(SQL, 是否为事务最后一条)的迭代器
+        :return: 执行的SQL数量
+        """
+        batch_queue = queue.Queue(maxsize=MAX_PREPARED_BATCH_COUNT)
+        stop_event = threading.Event()
+        reader = threading.Thread(target=self.prepare_batches, args=(sql_items, batch_queue, stop_event))
+        reader.daemon = True
+        reader.start()
+        try:
+            while True:
+                sql_batch = batch_queue.get()
+                if sql_batch is None:
+                    break
+                if isinstance(sql_batch, Exception):
+                    raise sql_batch
+                self.wait_replica_lag()
+                self.apply_batch(sql_batch)
+                if self.back_interval > 0:
+                    time.sleep(self.back_interval)
+        finally:
+            stop_event.set()
+            reader.join()
+            self.close()
+        return self.applied_sql_count
+
+    def apply_batch(self, sql_batch):
+        connection = self.target_connection.get_connection()
+        try:
+            with connection.cursor() as cursor:
+                for sql in sql_batch:
+                    cursor.execute(sql)
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            finally:
+                self.target_connection.release_connection(connection, discard=True)
+            raise
+        self.target_connection.release_connection(connection)
+        self.applied_sql_count += len(sql_batch)
+        self.applied_batch_count += 1
+        if self.applied_batch_count % 100 == 0:
+            print("{0} apply sql count:{1}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                                   self.applied_sql_count))
+
+    def get_replica_lag(self):
+        """
+        返回所有从库中最大的复制延迟，复制中断时返回None
+        """
+        max_lag = 0
+        for replica_connection in self.replica_connections:
+            connection = replica_connection.get_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SHOW SLAVE STATUS")
+                    slave_status = cursor.fetchone()
+            except Exception:
+                replica_connection.release_connection(connection, discard=True)
+                raise
+            replica_connection.release_connection(connection)
+            if not slave_status:
+                continue
+            if slave_status['Seconds_Behind_Master'] is None:
+                return None
+            max_lag = max(max_lag, slave_status['Seconds_Behind_Master'])
+        return max_lag
+
+    def wait_replica_lag(self):
+        if self.max_replica_lag <= 0 or not self.replica_connections:
+            return
+        while True:
+            replica_lag = self.get_replica_lag()
+            if replica_lag is not None and replica_lag <= self.max_replica_lag:
+                return
+            print("replica lag {0} exceed {1} seconds, wait...".format(replica_lag, self.max_replica_lag))
+            time.sleep(REPLICA_LAG_CHECK_INTERVAL)
+
+    def close(self):
+        self.target_connection.close()
+        for replica_connection in self.replica_connections:
+            replica_connection.close()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+离线性能基准测试，不依赖MySQL实例，使用构造的行事件驱动SQL生成、临时文件写入和脚本生成各阶段，
+输出每个阶段的rows/sec、bytes/sec和峰值内存，并可以与保存的基准结果对比。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import decimal
+import argparse
+import datetime
+import tempfile
+import contextlib
+from types import SimpleNamespace
+from pymysqlreplication.constants import FIELD_TYPE
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql import Binlog2sql, SPLIT_TRAN_FLAG, MAX_SQL_COUNT_PER_WRITE
+from binlog2sql_util import concat_sql_from_binlog_event, MultiRowSqlMerger
+from binlog2sql_spool import SqlSpoolWriter
+from binlog2sql_pipeline import set_event_rows
+from binlog2sql_metrics import get_peak_rss
+
+BENCHMARK_EVENT_TYPES = {
+    'INSERT': WriteRowsEvent,
+    'UPDATE': UpdateRowsEvent,
+    'DELETE': DeleteRowsEvent,
+}
+# 字段类型: (binlog字段类型, 字符集)
+BENCHMARK_COLUMN_TYPES = {
+    'int': (FIELD_TYPE.LONG, None),
+    'bigint': (FIELD_TYPE.LONGLONG, None),
+    'decimal': (FIELD_TYPE.NEWDECIMAL, None),
+    'varchar': (FIELD_TYPE.VARCHAR, 'utf8mb4'),
+    'datetime': (FIELD_TYPE.DATETIME2, None),
+    'json': (FIELD_TYPE.JSON, None),
+    'blob': (FIELD_TYPE.BLOB, None),
+    'text': (FIELD_TYPE.BLOB, 'utf8mb4'),
+}
+BENCHMARK_STAGES = ['format', 'concat', 'write_tmp', 'create_result']
+BENCHMARK_START_TIME = datetime.datetime(2020, 9, 13, 13, 0, 0)
+BENCHMARK_BINLOG_FILE = 'mysql-bin.000001'
+
+
+def reset_peak_rss():
+    """
+    重置进程的峰值内存，仅Linux支持，其他平台返回False，峰值内存为进程启动以来的最大值
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f_clear:
+            f_clear.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class SyntheticRowsEventGenerator(object):
+    """
+    构造与pymysqlreplication行事件结构一致的事件对象，行数据直接写入事件，不经过二进制解码
+    """
+
+    def __init__(self, column_types, json_size=256, blob_size=1024, seed=0):
+        """
+        :param column_types: 除主键id外的字段类型列表
+        :param json_size: JSON字段的大致字节数
+        :param blob_size: BLOB/TEXT字段的字节数
+        :param seed:
+        """
+        self.random = random.Random(seed)
+        self.columns = [SimpleNamespace(name='id', type=FIELD_TYPE.LONGLONG, character_set_name=None)]
+        for column_index, column_type in enumerate(column_types):
+            field_type, charset = BENCHMARK_COLUMN_TYPES[column_type]
+            self.columns.append(SimpleNamespace(name='c{0}_{1}'.format(column_index, column_type),
+                                                type=field_type, character_set_name=charset))
+        self.column_types = ['bigint'] + list(column_types)
+        self.json_size = json_size
+        self.blob_size = blob_size
+        self.log_pos = 4
+
+    def make_value(self, column_type, row_id):
+        if column_type == 'int':
+            return self.random.randint(-2147483648, 2147483647)
+        elif column_type == 'bigint':
+            return row_id
+        elif column_type == 'decimal':
+            return decimal.Decimal(self.random.randint(0, 99999999)) / 100
+        elif column_type == 'varchar':
+            return "name_{0}_it's\t{1}".format(row_id, self.random.random())
+        elif column_type == 'datetime':
+            return BENCHMARK_START_TIME + datetime.timedelta(seconds=self.random.randint(0, 86400))
+        elif column_type == 'json':
+            # binlog中的JSON解码后key和字符串值为bytes
+            item_count = max(1, self.json_size // 32)
+            return {b'k%d' % i: [i, b'v%d' % self.random.randint(0, 999999), None] for i in range(item_count)}
+        elif column_type == 'blob':
+            # 按64字节重复填充，大字段时构造事件不成为瓶颈
+            chunk = bytes(self.random.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(64))
+            return (chunk * (self.blob_size // 64 + 1))[:self.blob_size]
+        elif column_type == 'text':
+            chunk = "文本_{0}_it's\n".format(self.random.randint(0, 999999))
+            return (chunk * (self.blob_size // len(chunk.encode('utf-8')) + 1))[:self.blob_size // 3]
+        return None
+
+    def make_values(self, row_id):
+        return {column.name: self.make_value(column_type, row_id)
+                for column, column_type in zip(self.columns, self.column_types)}
+
+    def make_event(self, sql_type, first_row_id, row_count, timestamp):
+        event_class = BENCHMARK_EVENT_TYPES[sql_type]
+        binlog_event = event_class.__new__(event_class)
+        binlog_event.schema = 'bench_db'
+        binlog_event.table = 'bench_table'
+        binlog_event.primary_key = 'id'
+        binlog_event.columns = self.columns
+        binlog_event.timestamp = timestamp
+        rows = []
+        for row_id in range(first_row_id, first_row_id + row_count):
+            if sql_type == 'UPDATE':
+                rows.append({'before_values': self.make_values(row_id), 'after_values': self.make_values(row_id)})
+            else:
+                rows.append({'values': self.make_values(row_id)})
+        set_event_rows(binlog_event, rows)
+        self.log_pos += 100 + 50 * row_count
+        binlog_event.packet = SimpleNamespace(log_pos=self.log_pos, event_size=100 + 50 * row_count)
+        return binlog_event
+
+    def generate(self, sql_types, row_count, rows_per_event, events_per_transaction):
+        """
+        :return: [(事务起始位点, [事件])]
+        """
+        transactions = []
+        row_id = 1
+        event_index = 0
+        timestamp = int(time.mktime(BENCHMARK_START_TIME.timetuple()))
+        while row_id <= row_count:
+            start_pos = self.log_pos
+            events = []
+            for _ in range(events_per_transaction):
+                if row_id > row_count:
+                    break
+                event_rows = min(rows_per_event, row_count - row_id + 1)
+                sql_type = sql_types[event_index % len(sql_types)]
+                events.append(self.make_event(sql_type, row_id, event_rows, timestamp))
+                row_id += event_rows
+                event_index += 1
+            transactions.append((start_pos, events))
+            timestamp += 1
+        return transactions
+
+
+class BenchmarkRunner(object):
+    """
+    依次执行各阶段并记录耗时、处理的行数、字节数和峰值内存
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix='binlog2sql_benchmark_')
+        self.results = dict()
+        self.row_count = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        :param name: 阶段名称，阶段内设置stat['rows']和stat['bytes']
+        """
+        stat = {'rows': 0, 'bytes': 0}
+        reset_peak_rss()
+        start_time = time.perf_counter()
+        with open(os.devnull, 'w') as f_null, contextlib.redirect_stdout(f_null):
+            yield stat
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        self.results[name] = {
+            'seconds': round(elapsed, 6),
+            'rows': stat['rows'],
+            'bytes': stat['bytes'],
+            'rows_per_sec': round(stat['rows'] / elapsed, 1),
+            'bytes_per_sec': round(stat['bytes'] / elapsed, 1),
+            'peak_rss_kb': get_peak_rss(),
+        }
+
+    def create_binlog2sql(self):
+        """
+        使用只包含文件头的本地binlog文件初始化Binlog2sql，输出文件重定向到临时目录
+        """
+        binlog_dir = os.path.join(self.work_dir, 'binlog')
+        os.makedirs(binlog_dir)
+        with open(os.path.join(binlog_dir, BENCHMARK_BINLOG_FILE), 'wb') as f_binlog:
+            f_binlog.write(b'\xfebin')
+        schema_file = os.path.join(self.work_dir, 'schema.json')
+        with open(schema_file, 'w') as f_schema:
+            json.dump({}, f_schema)
+        binlog2sql = Binlog2sql(
+            connection_settings={'host': 'benchmark', 'port': 0, 'user': '', 'passwd': '', 'charset': 'utf8'},
+            start_file=BENCHMARK_BINLOG_FILE, flashback=self.args.flashback,
+            rollback_with_primary_key=self.args.rollback_with_primary_key,
+            binlog_dir=binlog_dir, schema_file=schema_file, multi_row=self.args.multi_row,
+            compression=self.args.compress)
+        output_prefix = os.path.join(self.work_dir, 'benchmark')
+        binlog2sql.execute_sql_file = binlog2sql.compressor.get_output_file(output_prefix + '_executed.sql')
+        binlog2sql.rollback_sql_file = output_prefix + '_rollback_[file_id].sql'
+        binlog2sql.tmp_sql_file = output_prefix + '_tmp.spool'
+        return binlog2sql
+
+    def run(self):
+        args = self.args
+        generator = SyntheticRowsEventGenerator(
+            column_types=args.column_types, json_size=args.json_size, blob_size=args.blob_size, seed=args.seed)
+        transactions = generator.generate(
+            sql_types=args.sql_type, row_count=args.rows, rows_per_event=args.rows_per_event,
+            events_per_transaction=args.events_per_transaction)
+        binlog2sql = self.create_binlog2sql()
+        try:
+            self.run_format(binlog2sql.escaper, transactions)
+            sql_list = self.run_concat(binlog2sql, transactions)
+            self.run_write_tmp(binlog2sql, sql_list)
+            del sql_list
+            self.run_create_result(binlog2sql)
+            binlog2sql.compressor.close()
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return self.results
+
+    def run_format(self, escaper, transactions):
+        with self.stage('format') as stat:
+            for _, events in transactions:
+                for binlog_event in events:
+                    converters = escaper.get_column_converters(binlog_event)
+                    for row in binlog_event.rows:
+                        for values in row.values():
+                            for value in escaper.convert_values(converters, values.keys(), values.values()):
+                                stat['bytes'] += len(value)
+                        stat['rows'] += 1
+
+    def run_concat(self, binlog2sql, transactions):
+        """
+        与process_binlog_to_tmp一致，每个事务前插入事务标志
+        """
+        sql_list = []
+        with self.stage('concat') as stat:
+            multi_row_merger = MultiRowSqlMerger(
+                max_statement_bytes=binlog2sql.max_statement_bytes, flashback=binlog2sql.flashback,
+                rollback_with_primary_key=binlog2sql.rollback_with_primary_key,
+                escaper=binlog2sql.escaper) if binlog2sql.multi_row else None
+            for e_start_pos, events in transactions:
+                sql_list.append(SPLIT_TRAN_FLAG)
+                for binlog_event in events:
+                    for row in binlog_event.rows:
+                        merged_sql_list = multi_row_merger.add_row(
+                            binlog_event=binlog_event, row=row, e_start_pos=e_start_pos) \
+                            if multi_row_merger else None
+                        if merged_sql_list is None:
+                            merged_sql_list = multi_row_merger.flush() if multi_row_merger else []
+                            merged_sql_list.append(concat_sql_from_binlog_event(
+                                binlog_event=binlog_event, row=row, e_start_pos=e_start_pos,
+                                flashback=binlog2sql.flashback, escaper=binlog2sql.escaper,
+                                rollback_with_primary_key=binlog2sql.rollback_with_primary_key))
+                        sql_list.extend(merged_sql_list)
+                        stat['rows'] += 1
+                if multi_row_merger:
+                    sql_list.extend(multi_row_merger.flush())
+            stat['bytes'] = sum(len(sql) for sql in sql_list)
+        return sql_list
+
+    def run_write_tmp(self, binlog2sql, sql_list):
+        with self.stage('write_tmp') as stat:
+            binlog2sql.tmp_spool = SqlSpoolWriter(binlog2sql.tmp_sql_file, compressor=binlog2sql.compressor)
+            binlog2sql.tmp_new_transaction = True
+            for index in range(0, len(sql_list), MAX_SQL_COUNT_PER_WRITE):
+                binlog2sql.write_tmp_sql(sql_list=sql_list[index:index + MAX_SQL_COUNT_PER_WRITE])
+            binlog2sql.tmp_spool.close()
+            stat['rows'] = self.results['concat']['rows']
+            stat['bytes'] = os.path.getsize(binlog2sql.tmp_sql_file)
+
+    def run_create_result(self, binlog2sql):
+        with self.stage('create_result') as stat:
+            if binlog2sql.flashback:
+                binlog2sql.create_rollback_sql()
+                result_files = binlog2sql.rollback_sql_files
+            else:
+                binlog2sql.create_execute_sql()
+                result_files = [binlog2sql.execute_sql_file]
+            stat['rows'] = self.results['concat']['rows']
+            stat['bytes'] = sum(os.path.getsize(result_file) for result_file in result_files)
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """
+    与基准结果对比rows/sec
+    :param results:
+    :param baseline:
+    :param max_regression: 允许下降的百分比
+    :return: 下降超过阈值的阶段列表
+    """
+    regressions = []
+    print("{0:<14}{1:>16}{2:>16}{3:>10}".format('stage', 'baseline rows/s', 'current rows/s', 'change'))
+    for stage in BENCHMARK_STAGES:
+        if stage not in results or stage not in baseline.get('stages', {}):
+            continue
+        baseline_rate = baseline['stages'][stage]['rows_per_sec']
+        current_rate = results[stage]['rows_per_sec']
+        change = (current_rate - baseline_rate) * 100.0 / baseline_rate if baseline_rate else 0.0
+        print("{0:<14}{1:>16.1f}{2:>16.1f}{3:>9.1f}%".format(stage, baseline_rate, current_rate, change))
+        if change < -max_regression:
+            regressions.append(stage)
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Offline benchmark of binlog2sql with synthetic rows events')
+    parser.add_argument('--rows', dest='rows', type=int, default=100000, help='Total number of rows. default: 100000')
+    parser.add_argument('--rows-per-event', dest='rows_per_event', type=int, default=10,
+                        help='Rows in each rows event. default: 10')
+    parser.add_argument('--events-per-transaction', dest='events_per_transaction', type=int, default=10,
+                        help='Rows events in each transaction. default: 10')
+    parser.add_argument('--sql-type', dest='sql_type', type=str, nargs='*', default=['INSERT', 'UPDATE', 'DELETE'],
+                        choices=['INSERT', 'UPDATE', 'DELETE'],
+                        help='Rows event types, used in turn. default: INSERT UPDATE DELETE')
+    parser.add_argument('--column-types', dest='column_types', type=str, nargs='*',
+                        default=['int', 'varchar', 'datetime', 'decimal'], choices=sorted(BENCHMARK_COLUMN_TYPES),
+                        help='Column types besides the bigint primary key. default: int varchar datetime decimal')
+    parser.add_argument('--json-size', dest='json_size', type=int, default=256,
+                        help='Approximate size of json values in bytes. default: 256')
+    parser.add_argument('--blob-size', dest='blob_size', type=int, default=1024,
+                        help='Size of blob and text values in bytes. default: 1024')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed. default: 0')
+    parser.add_argument('-B', '--flashback', dest='flashback', action='store_true', default=False,
+                        help='Benchmark rollback sql generation')
+    parser.add_argument('--rollback-with-primary-key', dest='rollback_with_primary_key', action='store_true',
+                        default=False, help='Rollback sql only contains the primary key')
+    parser.add_argument('--multi-row', dest='multi_row', action='store_true', default=False,
+                        help='Merge consecutive rows into multi-row statements')
+    parser.add_argument('--compress', dest='compress', type=str, choices=['none', 'gzip', 'zstd'], default='none',
+                        help='Compression of tmp and result files. default: none')
+    parser.add_argument('--save-baseline', dest='save_baseline', type=str, default=None,
+                        help='Save the results to a baseline json file')
+    parser.add_argument('--baseline', dest='baseline', type=str, default=None,
+                        help='Compare the results with a saved baseline json file')
+    parser.add_argument('--max-regression', dest='max_regression', type=float, default=10.0,
+                        help='Exit with status 1 when rows/sec of a stage drops more than this percent '
+                             'compared to the baseline. default: 10')
+    args = parser.parse_args(args)
+    if args.rows < 1 or args.rows_per_event < 1 or args.events_per_transaction < 1:
+        raise ValueError('rows, rows-per-event and events-per-transaction must be positive')
+    if args.flashback and not args.sql_type:
+        raise ValueError('Lack of parameter: sql_type')
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    results = BenchmarkRunner(args).run()
+    print("{0:<14}{1:>10}{2:>12}{3:>14}{4:>16}{5:>14}".format(
+        'stage', 'seconds', 'rows', 'rows/s', 'MB/s', 'peak rss MB'))
+    for stage in BENCHMARK_STAGES:
+        result = results[stage]
+        print("{0:<14}{1:>10.3f}{2:>12}{3:>14.1f}{4:>16.2f}{5:>14.1f}".format(
+            stage, result['seconds'], result['rows'], result['rows_per_sec'],
+            result['bytes_per_sec'] / 1048576, result['peak_rss_kb'] / 1024.0))
+    report = {
+        'created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': sys.version.split()[0],
+        'options': {key: value for key, value in vars(args).items()
+                    if key not in ('save_baseline', 'baseline', 'max_regression')},
+        'stages': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f_baseline:
+            json.dump(report, f_baseline, indent=1)
+        print("save baseline to {0}".format(args.save_baseline))
+    if args.baseline:
+        with open(args.baseline, 'r') as f_baseline:
+            baseline = json.load(f_baseline)
+        if baseline.get('options') != report['options']:
+            print("warning: baseline options differ from current options")
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print("regression over {0}% in stages: {1}".format(args.max_regression, ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回滚脚本目录：生成回滚脚本时将每组连续的同事务、同表、同类型语句所在的文件、字节偏移、binlog位点、时间、
+表名、事件类型和事务编号记录到sqlite文件中，之后按时间范围、表或事务直接从偏移处读取部分回滚语句，
+不需要重新解析binlog或扫描整个回滚文件。
+"""
+
+import os
+import re
+import sys
+import bisect
+import sqlite3
+import argparse
+import datetime
+from binlog2sql_compress import get_block_codec_by_id
+
+SPLIT_TRAN_FLAG = "##=================NEW=TRANSACTION=================##"
+EMPTY_LINE_FLAG = "\n"
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS catalog_files (
+        file_id INTEGER PRIMARY KEY,
+        file_path TEXT NOT NULL UNIQUE,
+        codec_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS catalog_blocks (
+        file_id INTEGER NOT NULL,
+        raw_offset INTEGER NOT NULL,
+        file_offset INTEGER NOT NULL,
+        compressed_size INTEGER NOT NULL,
+        raw_size INTEGER NOT NULL,
+        PRIMARY KEY (file_id, raw_offset)
+    );
+    CREATE TABLE IF NOT EXISTS statement_groups (
+        group_id INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL,
+        byte_offset INTEGER NOT NULL,
+        byte_length INTEGER NOT NULL,
+        transaction_id INTEGER NOT NULL,
+        start_pos INTEGER,
+        end_pos INTEGER,
+        event_time TEXT,
+        schema_name TEXT,
+        table_name TEXT,
+        event_type TEXT,
+        sql_type TEXT,
+        statement_count INTEGER NOT NULL,
+        max_event_time TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_groups_time ON statement_groups (event_time, max_event_time);
+    CREATE INDEX IF NOT EXISTS idx_groups_table ON statement_groups (schema_name, table_name);
+    CREATE INDEX IF NOT EXISTS idx_groups_transaction ON statement_groups (transaction_id);
+"""
+CATALOG_INSERT = """
+    INSERT INTO statement_groups (file_id, byte_offset, byte_length, transaction_id, start_pos, end_pos, event_time,
+                                  schema_name, table_name, event_type, sql_type, statement_count, max_event_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+CATALOG_SELECT = """
+    SELECT f.file_path, f.codec_id, g.file_id, g.byte_offset, g.byte_length, g.transaction_id, g.start_pos, g.end_pos,
+           g.event_time, g.schema_name, g.table_name, g.event_type, g.sql_type, g.statement_count, g.max_event_time
+    FROM statement_groups g JOIN catalog_files f ON f.file_id = g.file_id
+"""
+# 内存中缓存的语句组数，超过后写入sqlite文件
+CATALOG_BATCH_GROUPS = 10000
+# 回滚语句的位点注释和语句开头的库表名
+STATEMENT_PATTERN = re.compile(r'### start (\S+) end (\S+) time ([^\n]*)\n(INSERT INTO|UPDATE|DELETE FROM) '
+                               r'`((?:[^`]|``)*)`\.`((?:[^`]|``)*)`')
+# 回滚语句类型对应的原始事件类型
+ROLLBACK_EVENT_TYPES = {'INSERT': 'DELETE', 'UPDATE': 'UPDATE', 'DELETE': 'INSERT'}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def get_rollback_catalog_file(rollback_sql_file):
+    """
+    :param rollback_sql_file: 包含[file_id]的回滚文件路径模板
+    :return: 与回滚文件同名前缀的目录文件路径
+    """
+    return str(rollback_sql_file).replace("[file_id].sql", "catalog.db")
+
+
+def text_bytes(text):
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def parse_int(value):
+    return int(value) if value.isdigit() else None
+
+
+def parse_statement(sql_item):
+    """
+    :return: (起始位点, 结束位点, 时间, 库名, 表名, 语句类型)，无法识别的语句返回None
+    """
+    match = STATEMENT_PATTERN.match(sql_item)
+    if match is None:
+        return None
+    start_pos, end_pos, event_time, sql_type, schema, table = match.groups()
+    return parse_int(start_pos), parse_int(end_pos), event_time, schema.replace('``', '`'), \
+        table.replace('``', '`'), sql_type.split(' ', 1)[0]
+
+
+class CatalogFileWriter(object):
+    """
+    回滚文件的写入包装，记录已写入的原始字节数，接口与open_text_file返回的文件对象一致(write/close)
+    """
+
+    def __init__(self, catalog, file_id, f_output, offset):
+        self.catalog = catalog
+        self.file_id = file_id
+        self.f_output = f_output
+        self.offset = offset
+
+    def write(self, text):
+        self.f_output.write(text)
+        self.offset += text_bytes(text)
+
+    def close(self):
+        self.catalog.flush_group()
+        self.f_output.close()
+
+
+class RollbackCatalog(object):
+    """
+    生成回滚脚本时记录语句组的目录，同一文件中连续的同事务、同表、同类型语句合并为一组
+    """
+
+    def __init__(self, catalog_file):
+        self.catalog_file = catalog_file
+        self.connection = sqlite3.connect(catalog_file)
+        self.connection.executescript(CATALOG_SCHEMA)
+        self.groups = []
+        self.group = None
+        self.group_count = 0
+
+    def open_file(self, file_path, compressor):
+        """
+        以追加方式打开回滚文件并登记到目录中，压缩时同时记录每个压缩块的位置
+        :param file_path: 已包含压缩格式后缀的文件路径
+        :param compressor: OutputCompressor
+        :return: CatalogFileWriter
+        """
+        file_path = os.path.abspath(file_path)
+        codec_id = compressor.codec.codec_id if compressor.codec is not None else None
+        self.connection.execute("INSERT OR IGNORE INTO catalog_files (file_path, codec_id) VALUES (?, ?)",
+                                (file_path, codec_id))
+        file_id = self.connection.execute("SELECT file_id FROM catalog_files WHERE file_path = ?",
+                                          (file_path,)).fetchone()[0]
+
+        def write_block_entry(raw_offset, file_offset, compressed_size, raw_size):
+            self.connection.execute("INSERT OR REPLACE INTO catalog_blocks VALUES (?, ?, ?, ?, ?)",
+                                    (file_id, raw_offset, file_offset, compressed_size, raw_size))
+
+        if codec_id is None:
+            offset = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            f_output = compressor.open_text_file(file_path)
+        else:
+            # 压缩文件中的偏移为原始数据中的偏移
+            row = self.connection.execute("SELECT MAX(raw_offset + raw_size) FROM catalog_blocks WHERE file_id = ?",
+                                          (file_id,)).fetchone()
+            offset = row[0] or 0
+            f_output = compressor.open_text_file(file_path, on_block_written=write_block_entry)
+            f_output.block_writer.raw_offset = offset
+        return CatalogFileWriter(self, file_id, f_output, offset)
+
+    def add_statement(self, f_writer, sql_item, start_offset, transaction_id):
+        """
+        :param f_writer: 写入该语句的CatalogFileWriter
+        :param sql_item: 回滚语句，包含位点注释
+        :param start_offset: 语句在文件中的起始偏移，语句及其后的换行已经写入
+        :param transaction_id: 事务编号，按binlog中的顺序从1开始
+        :return:
+        """
+        statement = parse_statement(sql_item) or (None, None, None, None, None, None)
+        start_pos, end_pos, event_time, schema, table, sql_type = statement
+        group = self.group
+        if group is not None and group[0] == f_writer.file_id and group[3] == transaction_id \
+                and group[7] == schema and group[8] == table and group[10] == sql_type:
+            group[2] = f_writer.offset - group[1]
+            if start_pos is not None:
+                group[4] = start_pos if group[4] is None else min(group[4], start_pos)
+            if end_pos is not None:
+                group[5] = end_pos if group[5] is None else max(group[5], end_pos)
+            if event_time is not None:
+                group[6] = event_time if group[6] is None else min(group[6], event_time)
+                group[12] = event_time if group[12] is None else max(group[12], event_time)
+            group[11] += 1
+            return
+        self.flush_group()
+        self.group = [f_writer.file_id, start_offset, f_writer.offset - start_offset, transaction_id, start_pos,
+                      end_pos, event_time, schema, table, ROLLBACK_EVENT_TYPES.get(sql_type), sql_type, 1, event_time]
+
+    def flush_group(self):
+        if self.group is not None:
+            self.groups.append(tuple(self.group))
+            self.group = None
+        if len(self.groups) >= CATALOG_BATCH_GROUPS:
+            self.flush()
+
+    def flush(self):
+        if self.groups:
+            self.connection.executemany(CATALOG_INSERT, self.groups)
+            self.group_count += len(self.groups)
+            self.groups = []
+        self.connection.commit()
+
+    def close(self):
+        self.flush_group()
+        self.flush()
+        self.connection.close()
+
+
+class CatalogFileReader(object):
+    """
+    按原始数据偏移读取回滚文件，压缩文件只解压包含所需数据的块
+    """
+
+    def __init__(self, file_path, codec_id=None, block_entries=None):
+        self.f_data = open(file_path, "rb")
+        self.codec = get_block_codec_by_id(codec_id) if codec_id else None
+        self.block_entries = block_entries or []
+        self.block_raw_offsets = [block_entry[0] for block_entry in self.block_entries]
+        self.cached_block_index = -1
+        self.cached_block = b''
+
+    def read_block(self, block_index):
+        if block_index != self.cached_block_index:
+            _, file_offset, compressed_size, _ = self.block_entries[block_index]
+            self.f_data.seek(file_offset)
+            self.cached_block = self.codec.decompress(self.f_data.read(compressed_size))
+            self.cached_block_index = block_index
+        return self.cached_block
+
+    def read(self, offset, length):
+        if self.codec is None:
+            self.f_data.seek(offset)
+            return self.f_data.read(length)
+        # 一组语句可能跨越多个压缩块
+        data = []
+        block_index = bisect.bisect_right(self.block_raw_offsets, offset) - 1
+        while length > 0 and 0 <= block_index < len(self.block_entries):
+            block = self.read_block(block_index)
+            block_offset = offset - self.block_raw_offsets[block_index]
+            chunk = block[block_offset:block_offset + length]
+            data.append(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+            block_index += 1
+        return b''.join(data)
+
+    def close(self):
+        self.f_data.close()
+
+
+class RollbackCatalogReader(object):
+    """
+    查询回滚脚本目录并从回滚文件中读取选中的语句组
+    """
+
+    def __init__(self, catalog_file):
+        if not os.path.exists(catalog_file):
+            raise ValueError('catalog file %s does not exist' % catalog_file)
+        self.catalog_file = catalog_file
+        self.connection = sqlite3.connect(catalog_file)
+        self.file_readers = dict()
+
+    def find_groups(self, start_time=None, stop_time=None, only_schemas=None, only_tables=None,
+                    event_types=None, transaction_ids=None):
+        """
+        :param start_time: 包含该时间，与时间范围有交集的语句组整组返回，组内可能包含范围之外的语句
+        :param stop_time: 不包含该时间
+        :param only_schemas:
+        :param only_tables:
+        :param event_types: 原始binlog事件类型INSERT/UPDATE/DELETE
+        :param transaction_ids:
+        :return: 按回滚执行顺序排列的语句组
+        """
+        conditions, params = [], []
+        # 语句组的最早和最晚时间与时间范围有交集
+        if start_time:
+            conditions.append("g.max_event_time >= ?")
+            params.append(start_time)
+        if stop_time:
+            conditions.append("g.event_time < ?")
+            params.append(stop_time)
+        for column, values in (('g.schema_name', only_schemas), ('g.table_name', only_tables),
+                               ('g.event_type', event_types), ('g.transaction_id', transaction_ids)):
+            if values:
+                conditions.append("{0} IN ({1})".format(column, ', '.join('?' * len(values))))
+                params.extend(values)
+        sql = CATALOG_SELECT
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY g.file_id, g.byte_offset"
+        return self.connection.execute(sql, params).fetchall()
+
+    def resolve_file(self, file_path):
+        """
+        回滚文件被移动到目录文件所在的目录时按文件名查找
+        """
+        if os.path.exists(file_path):
+            return file_path
+        moved_path = os.path.join(os.path.dirname(os.path.abspath(self.catalog_file)), os.path.basename(file_path))
+        if os.path.exists(moved_path):
+            return moved_path
+        raise ValueError('rollback file %s does not exist' % file_path)
+
+    def get_file_reader(self, file_id, file_path, codec_id):
+        file_reader = self.file_readers.get(file_id)
+        if file_reader is None:
+            block_entries = self.connection.execute(
+                "SELECT raw_offset, file_offset, compressed_size, raw_size FROM catalog_blocks "
+                "WHERE file_id = ? ORDER BY raw_offset", (file_id,)).fetchall() if codec_id else None
+            file_reader = CatalogFileReader(self.resolve_file(file_path), codec_id, block_entries)
+            self.file_readers[file_id] = file_reader
+        return file_reader
+
+    def write_groups(self, groups, f_output):
+        """
+        按回滚文件的格式输出选中的语句组，事务之间写入事务标志
+        :return: 输出的语句数
+        """
+        statement_count = 0
+        last_transaction_id = None
+        for group in groups:
+            file_path, codec_id, file_id, byte_offset, byte_length, transaction_id = group[:6]
+            data = self.get_file_reader(file_id, file_path, codec_id).read(byte_offset, byte_length)
+            if last_transaction_id is None:
+                f_output.write((SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG).encode('utf-8'))
+            f_output.write(EMPTY_LINE_FLAG.encode('utf-8'))
+            if last_transaction_id is not None and transaction_id != last_transaction_id:
+                f_output.write((SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG).encode('utf-8'))
+            f_output.write(data)
+            last_transaction_id = transaction_id
+            statement_count += group[13]
+        return statement_count
+
+    def close(self):
+        for file_reader in self.file_readers.values():
+            file_reader.close()
+        self.file_readers = dict()
+        self.connection.close()
+
+
+def parse_time(value, option):
+    try:
+        return datetime.datetime.strptime(value, TIME_FORMAT).strftime(TIME_FORMAT)
+    except ValueError:
+        raise ValueError('Incorrect datetime argument: %s %s' % (option, value))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Extract part of a rollback script by the rollback catalog')
+    parser.add_argument('--catalog', dest='catalog', type=str, required=True,
+                        help='Rollback catalog file generated with the rollback sql files')
+    parser.add_argument('--start-datetime', dest='start_time', type=str, default=None,
+                        help="Start time of the original events. format %%Y-%%m-%%d %%H:%%M:%%S. A statement group "
+                             "overlapping the time range is extracted as a whole, so a few statements of the same "
+                             "transaction and table may fall outside the range")
+    parser.add_argument('--stop-datetime', dest='stop_time', type=str, default=None,
+                        help="Stop time of the original events, not included. format %%Y-%%m-%%d %%H:%%M:%%S")
+    parser.add_argument('-d', '--databases', dest='databases', type=str, nargs='*', default='',
+                        help='dbs you want to extract')
+    parser.add_argument('-t', '--tables', dest='tables', type=str, nargs='*', default='',
+                        help='tables you want to extract')
+    parser.add_argument('--sql-type', dest='sql_type', type=str, nargs='*', default='',
+                        help='Original event types you want to roll back, support INSERT, UPDATE, DELETE')
+    parser.add_argument('--transactions', dest='transactions', type=int, nargs='*', default=[],
+                        help='Transaction ids in the catalog you want to extract')
+    parser.add_argument('--list', dest='list_groups', action='store_true', default=False,
+                        help='List the selected statement groups instead of extracting sql')
+    parser.add_argument('--result-file', dest='result_file', type=str, default=None,
+                        help='Write the extracted sql to this file. default: stdout')
+    args = parser.parse_args(args)
+    if args.start_time:
+        args.start_time = parse_time(args.start_time, '--start-datetime')
+    if args.stop_time:
+        args.stop_time = parse_time(args.stop_time, '--stop-datetime')
+    args.sql_type = [sql_type.upper() for sql_type in args.sql_type]
+    for sql_type in args.sql_type:
+        if sql_type not in ROLLBACK_EVENT_TYPES:
+            raise ValueError('Incorrect sql-type argument: %s' % sql_type)
+    return args
+
+
+def print_groups(groups):
+    print("{0:<10}{1:>14}{2:>10}{3:>8}{4:>12}{5:>12}{6:>21}  {7:<8}{8:>8}  {9}".format(
+        'file', 'offset', 'bytes', 'trx', 'start', 'end', 'time', 'type', 'sqls', 'table'))
+    for group in groups:
+        file_path, _, _, byte_offset, byte_length, transaction_id, start_pos, end_pos, event_time, schema, table, \
+            event_type, _, statement_count, _ = group
+        file_name = os.path.basename(file_path).rsplit('_', 1)[-1]
+        print("{0:<10}{1:>14}{2:>10}{3:>8}{4:>12}{5:>12}{6:>21}  {7:<8}{8:>8}  {9}".format(
+            file_name, byte_offset, byte_length, transaction_id, str(start_pos), str(end_pos), str(event_time),
+            str(event_type), statement_count, '{0}.{1}'.format(schema, table) if table else ''))
+
+
+def main(argv):
+    args = parse_args(argv)
+    catalog_reader = RollbackCatalogReader(args.catalog)
+    try:
+        groups = catalog_reader.find_groups(
+            start_time=args.start_time, stop_time=args.stop_time, only_schemas=args.databases,
+            only_tables=args.tables, event_types=args.sql_type, transaction_ids=args.transactions)
+        if args.list_groups:
+            print_groups(groups)
+            return 0
+        if args.result_file:
+            with open(args.result_file, "wb") as f_output:
+                statement_count = catalog_reader.write_groups(groups, f_output)
+            print("extract {0} sql in {1} groups to {2}".format(statement_count, len(groups), args.result_file))
+        else:
+            catalog_reader.write_groups(groups, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+    finally:
+        catalog_reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import sqlite3
+from types import SimpleNamespace
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_util2 import SQL_TEMPLATE_CACHE
+
+# 内存中最多保存的行变更数，超过后合并写入磁盘
+DEFAULT_COMPACT_MEMORY_ROWS = 100000
+# 行变更: [是否在窗口开始前存在, 窗口开始时的行, 窗口结束时的行, 最后一次变更的序号, 事务起始位点, 事件结束位点, 时间]
+CHANGE_EXISTED, CHANGE_FIRST, CHANGE_LAST, CHANGE_SEQ, CHANGE_START_POS, CHANGE_END_POS, CHANGE_TIME = range(7)
+COMPACT_SPILL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS row_changes (
+        table_key TEXT NOT NULL,
+        row_key TEXT NOT NULL,
+        existed INTEGER NOT NULL,
+        first_image BLOB,
+        last_image BLOB,
+        seq INTEGER NOT NULL,
+        start_pos INTEGER,
+        end_pos INTEGER,
+        timestamp INTEGER,
+        PRIMARY KEY (table_key, row_key)
+    )
+"""
+# 磁盘上已有的行保留窗口开始时的状态，只更新窗口结束时的状态
+COMPACT_SPILL_UPSERT = """
+    INSERT INTO row_changes (table_key, row_key, existed, first_image, last_image, seq, start_pos, end_pos, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (table_key, row_key) DO UPDATE SET
+        last_image = excluded.last_image, seq = excluded.seq, start_pos = excluded.start_pos,
+        end_pos = excluded.end_pos, timestamp = excluded.timestamp
+"""
+
+
+def make_rows_event(event_class, table_item, end_pos, timestamp):
+    """
+    构造只包含生成SQL所需属性的行事件
+    :param event_class: WriteRowsEvent/UpdateRowsEvent/DeleteRowsEvent
+    :param table_item: (schema, table, primary_key, columns)
+    :param end_pos:
+    :param timestamp:
+    :return:
+    """
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.schema, binlog_event.table, binlog_event.primary_key, binlog_event.columns = table_item
+    binlog_event.timestamp = timestamp
+    binlog_event.packet = SimpleNamespace(log_pos=end_pos)
+    return binlog_event
+
+
+class RowChangeCompactor(object):
+    """
+    按(表, 主键)合并回滚窗口内的行变更，每行只保留窗口开始和结束时的状态，生成净回滚语句：
+    窗口内新增的行生成DELETE，窗口内删除的行生成INSERT，其他变更过的行生成一条UPDATE恢复为窗口开始时的状态。
+    内存中的行变更超过上限后合并写入sqlite文件。
+    """
+
+    def __init__(self, spill_file, max_memory_rows=DEFAULT_COMPACT_MEMORY_ROWS):
+        self.spill_file = spill_file
+        self.max_memory_rows = max_memory_rows
+        self.tables = dict()
+        self.changes = dict()
+        self.seq = 0
+        self.row_count = 0
+        self.spill_count = 0
+        self.connection = None
+
+    @staticmethod
+    def has_primary_key(binlog_event):
+        return bool(binlog_event.primary_key)
+
+    def add_event(self, binlog_event, e_start_pos):
+        """
+        :param binlog_event: 有主键的行事件
+        :param e_start_pos: 事务起始位点
+        :return:
+        """
+        table_key = '{0}.{1}'.format(binlog_event.schema, binlog_event.table)
+        self.tables[table_key] = (binlog_event.schema, binlog_event.table, binlog_event.primary_key,
+                                  getattr(binlog_event, 'columns', None))
+        primary_key_list = SQL_TEMPLATE_CACHE.get_primary_key_list(binlog_event.primary_key)
+        position = (e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp)
+        for row in binlog_event.rows:
+            self.row_count += 1
+            if isinstance(binlog_event, WriteRowsEvent):
+                self.add_change(table_key, primary_key_list, None, row['values'], position)
+            elif isinstance(binlog_event, DeleteRowsEvent):
+                self.add_change(table_key, primary_key_list, row['values'], None, position)
+            else:
+                before_values, after_values = row['before_values'], row['after_values']
+                if self.get_row_key(primary_key_list, before_values) == \
+                        self.get_row_key(primary_key_list, after_values):
+                    self.add_change(table_key, primary_key_list, before_values, after_values, position)
+                else:
+                    # 主键变化时按删除原主键的行、新增新主键的行处理
+                    self.add_change(table_key, primary_key_list, before_values, None, position)
+                    self.add_change(table_key, primary_key_list, None, after_values, position)
+
+    @staticmethod
+    def get_row_key(primary_key_list, values):
+        return repr(tuple(values[primary_key] for primary_key in primary_key_list))
+
+    def add_change(self, table_key, primary_key_list, before_values, after_values, position):
+        self.seq += 1
+        change_key = (table_key, self.get_row_key(primary_key_list, before_values or after_values))
+        change = self.changes.get(change_key)
+        if change is None:
+            self.changes[change_key] = [before_values is not None, before_values, after_values, self.seq] + \
+                list(position)
+            if len(self.changes) >= self.max_memory_rows:
+                self.spill()
+        else:
+            change[CHANGE_LAST] = after_values
+            change[CHANGE_SEQ] = self.seq
+            change[CHANGE_START_POS:] = position
+
+    def spill(self):
+        """
+        将内存中的行变更合并写入sqlite文件，磁盘上已有的行保留窗口开始时的状态
+        """
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.spill_file)
+            self.connection.execute("PRAGMA journal_mode = OFF")
+            self.connection.execute("PRAGMA synchronous = OFF")
+            self.connection.execute(COMPACT_SPILL_SCHEMA)
+        self.connection.executemany(COMPACT_SPILL_UPSERT, (
+            (table_key, row_key, int(change[CHANGE_EXISTED]), pickle.dumps(change[CHANGE_FIRST]),
+             pickle.dumps(change[CHANGE_LAST]), change[CHANGE_SEQ], change[CHANGE_START_POS],
+             change[CHANGE_END_POS], change[CHANGE_TIME])
+            for (table_key, row_key), change in self.changes.items()))
+        self.connection.commit()
+        self.changes = dict()
+        self.spill_count += 1
+
+    def iter_changes(self):
+        """
+        按最后一次变更的顺序返回每行的(表, 变更)
+        """
+        if self.connection is None:
+            for (table_key, _), change in sorted(self.changes.items(), key=lambda item: item[1][CHANGE_SEQ]):
+                yield table_key, change
+            return
+        self.spill()
+        cursor = self.connection.execute(
+            "SELECT table_key, existed, first_image, last_image, seq, start_pos, end_pos, timestamp "
+            "FROM row_changes ORDER BY seq")
+        for table_key, existed, first_image, last_image, seq, start_pos, end_pos, timestamp in cursor:
+            yield table_key, [bool(existed), pickle.loads(first_image), pickle.loads(last_image), seq,
+                              start_pos, end_pos, timestamp]
+
+    def iter_net_rows(self):
+        """
+        :return: (行事件, 行数据, 事务起始位点)的迭代器，行事件的类型为窗口内的净变更，按最后一次变更的顺序返回
+        """
+        for table_key, change in self.iter_changes():
+            first_values, last_values = change[CHANGE_FIRST], change[CHANGE_LAST]
+            if change[CHANGE_EXISTED]:
+                if last_values is None:
+                    event_class, row = DeleteRowsEvent, {'values': first_values}
+                elif first_values != last_values:
+                    event_class, row = UpdateRowsEvent, {'before_values': first_values, 'after_values': last_values}
+                else:
+                    continue
+            elif last_values is not None:
+                event_class, row = WriteRowsEvent, {'values': last_values}
+            else:
+                continue
+            binlog_event = make_rows_event(event_class, self.tables[table_key], change[CHANGE_END_POS],
+                                           change[CHANGE_TIME])
+            yield binlog_event, row, change[CHANGE_START_POS]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if os.path.exists(self.spill_file):
+            os.remove(self.spill_file)
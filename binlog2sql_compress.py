@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import codecs
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 每个压缩块的原始数据大小，块之间相互独立，可以并行压缩
+COMPRESS_BLOCK_SIZE = 1048576
+GZIP_COMPRESS_LEVEL = 6
+ZSTD_COMPRESS_LEVEL = 3
+
+
+class GzipBlockCodec(object):
+    """
+    每个块压缩为独立的gzip member，多个member拼接后仍是合法的gzip文件
+    """
+    codec_id = 1
+    suffix = '.gz'
+
+    @staticmethod
+    def compress(data):
+        return gzip.compress(data, compresslevel=GZIP_COMPRESS_LEVEL)
+
+    @staticmethod
+    def decompress(data):
+        return gzip.decompress(data)
+
+
+class ZstdBlockCodec(object):
+    """
+    每个块压缩为独立的zstd frame，ZstdCompressor不是线程安全的，每个线程使用各自的实例
+    """
+    codec_id = 2
+    suffix = '.zst'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def compress(self, data):
+        if not hasattr(self.local, 'compressor'):
+            self.local.compressor = zstandard.ZstdCompressor(level=ZSTD_COMPRESS_LEVEL)
+        return self.local.compressor.compress(data)
+
+    def decompress(self, data):
+        if not hasattr(self.local, 'decompressor'):
+            self.local.decompressor = zstandard.ZstdDecompressor()
+        return self.local.decompressor.decompress(data)
+
+
+BLOCK_CODECS = {
+    'gzip': GzipBlockCodec,
+    'zstd': ZstdBlockCodec,
+}
+
+
+def get_block_codec(compression):
+    """
+    :param compression: none/gzip/zstd
+    :return: 压缩方式对应的codec，不压缩时返回None
+    """
+    if not compression or compression == 'none':
+        return None
+    if compression not in BLOCK_CODECS:
+        raise ValueError('unknown compression: %s' % compression)
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package')
+    return BLOCK_CODECS[compression]()
+
+
+def get_block_codec_by_id(codec_id):
+    for compression, codec_class in BLOCK_CODECS.items():
+        if codec_class.codec_id == codec_id:
+            return get_block_codec(compression)
+    raise ValueError('unknown compression codec id: %s' % codec_id)
+
+
+class BlockCompressWriter(object):
+    """
+    将写入的数据按块提交到线程池压缩，并按提交顺序写入文件，同时处理中的块数量有上限
+    """
+
+    def __init__(self, f_output, codec, executor, max_pending_blocks=2, on_block_written=None):
+        """
+        :param f_output: 以二进制追加方式打开的文件
+        :param codec:
+        :param executor: 压缩线程池
+        :param max_pending_blocks: 最多同时压缩的块数
+        :param on_block_written: 块写入文件后的回调(原始数据偏移, 文件偏移, 压缩后大小, 原始大小)
+        """
+        self.f_output = f_output
+        self.codec = codec
+        self.executor = executor
+        self.max_pending_blocks = max_pending_blocks
+        self.on_block_written = on_block_written
+        self.buffer = bytearray()
+        self.pending_blocks = collections.deque()
+        self.raw_offset = 0
+        self.file_offset = f_output.tell()
+
+    def write(self, data):
+        """
+        写入的数据不会被拆分到两个块中
+        """
+        self.buffer += data
+        if len(self.buffer) >= COMPRESS_BLOCK_SIZE:
+            self.flush_block()
+
+    def flush_block(self):
+        if self.buffer:
+            raw_data = bytes(self.buffer)
+            self.buffer = bytearray()
+            self.pending_blocks.append((self.raw_offset, len(raw_data),
+                                        self.executor.submit(self.codec.compress, raw_data)))
+            self.raw_offset += len(raw_data)
+        while len(self.pending_blocks) > self.max_pending_blocks:
+            self.write_pending_block()
+
+    def write_pending_block(self):
+        raw_offset, raw_size, future = self.pending_blocks.popleft()
+        block_data = future.result()
+        self.f_output.write(block_data)
+        if self.on_block_written:
+            self.on_block_written(raw_offset, self.file_offset, len(block_data), raw_size)
+        self.file_offset += len(block_data)
+
+    def flush(self):
+        """
+        压缩并写入所有缓存的数据
+        """
+        self.flush_block()
+        while self.pending_blocks:
+            self.write_pending_block()
+        self.f_output.flush()
+
+    def close(self):
+        self.flush()
+        self.f_output.close()
+
+
+class CompressedTextWriter(object):
+    """
+    压缩后的文本输出文件，接口与codecs.open返回的文件对象一致(write/close)
+    """
+
+    def __init__(self, file_path, block_writer_factory):
+        self.file_path = file_path
+        self.block_writer = block_writer_factory(open(file_path, "ab"))
+
+    def write(self, text):
+        self.block_writer.write(text.encode('utf-8'))
+
+    def close(self):
+        self.block_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class OutputCompressor(object):
+    """
+    管理输出文件的压缩方式和压缩线程池
+    """
+
+    def __init__(self, compression=None, compress_workers=0):
+        self.codec = get_block_codec(compression)
+        self.compress_workers = compress_workers if compress_workers else (os.cpu_count() or 1)
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.compress_workers)
+        return self.executor
+
+    def create_block_writer(self, f_output, on_block_written=None):
+        """
+        创建使用共享压缩线程池的块压缩写入器，同时处理中的块数为线程数的2倍
+        """
+        return BlockCompressWriter(f_output, self.codec, self.get_executor(),
+                                   max_pending_blocks=self.compress_workers * 2,
+                                   on_block_written=on_block_written)
+
+    def get_output_file(self, file_path):
+        """
+        返回实际写入的文件路径，压缩时增加压缩格式后缀
+        """
+        return file_path + self.codec.suffix if self.codec else file_path
+
+    def open_text_file(self, file_path, on_block_written=None):
+        """
+        以追加方式打开文本输出文件
+        :param file_path: 已包含压缩格式后缀的文件路径
+        :param on_block_written: 压缩时每个块写入文件后的回调，参数同BlockCompressWriter
+        :return:
+        """
+        if self.codec is None:
+            return codecs.open(file_path, "a+", 'utf-8')
+        return CompressedTextWriter(
+            file_path, lambda f_output: self.create_block_writer(f_output, on_block_written=on_block_written))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pickle
+import shutil
+import datetime
+from types import SimpleNamespace
+from pymysqlreplication.column import Column
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_rowindex import make_rotate_event
+from binlog2sql_pipeline import set_event_rows
+
+EVENT_SPOOL_META_SUFFIX = '.meta.json'
+# 记录类型，0为表结构定义，其余为事件类型在列表中的序号
+EVENT_SPOOL_TABLE = 0
+EVENT_SPOOL_CLASSES = [None, QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent,
+                       WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent]
+EVENT_SPOOL_CODES = {event_class: code for code, event_class in enumerate(EVENT_SPOOL_CLASSES) if event_class}
+# 非行事件需要保存的属性，解析时只用到这些属性
+EVENT_SPOOL_ATTRS = {
+    QueryEvent: ('timestamp', 'slave_proxy_id', 'execution_time', 'schema', 'query'),
+    RotateEvent: ('timestamp', 'next_binlog', 'position'),
+    FormatDescriptionEvent: ('timestamp',),
+    XidEvent: ('timestamp', 'xid'),
+    GtidEvent: ('timestamp', 'commit_flag', 'sid', 'gno'),
+}
+
+
+def get_event_spool_meta_file(spool_file):
+    return spool_file + EVENT_SPOOL_META_SUFFIX
+
+
+def load_event_spool_meta(spool_file):
+    with open(get_event_spool_meta_file(spool_file), "r", encoding='utf-8') as f_meta:
+        return json.load(f_meta)
+
+
+def binlog_file_number(log_file):
+    return int(log_file.rsplit('.', 1)[1])
+
+
+def check_event_spool_filters(meta, start_file, start_pos, only_schemas, only_tables, sql_type, only_dml):
+    """
+    事件文件只包含记录时过滤条件选择的事件，回放的范围和过滤条件超出记录时的条件会生成不完整的SQL，直接报错
+    :param meta: 事件文件的meta信息
+    :return:
+    """
+    for option, values, recorded_values in (('databases', only_schemas, meta.get('only_schemas')),
+                                            ('tables', only_tables, meta.get('only_tables')),
+                                            ('sql-type', sql_type, meta.get('sql_type'))):
+        if recorded_values is None:
+            continue
+        if not values or not set(values) <= set(recorded_values):
+            raise ValueError('event spool was recorded with --{0} {1}, replay can not use {2}'.format(
+                option, ' '.join(recorded_values), ' '.join(values) if values else 'all'))
+    if meta.get('only_dml') and not only_dml:
+        raise ValueError('event spool was recorded with --only-dml, replay must use --only-dml')
+    if meta['first_file'] is not None and (binlog_file_number(start_file), start_pos) < \
+            (binlog_file_number(meta['first_file']), meta['first_pos']):
+        raise ValueError('event spool starts at {0}:{1}, replay can not start at {2}:{3}'.format(
+            meta['first_file'], meta['first_pos'], start_file, start_pos))
+
+
+class EventSpoolWriter(object):
+    """
+    将解码后的事件保存到事件文件，每条记录为一个pickle元组：行事件只保存表结构编号、字段名和按字段顺序排列的值元组，
+    表结构在变化时单独保存一次；非行事件只保存解析时用到的属性。
+    同时在.meta.json文件中保存覆盖的binlog文件、起止位点和记录时的过滤条件
+    """
+
+    def __init__(self, spool_file, meta=None):
+        """
+        :param spool_file:
+        :param meta: 记录时的过滤条件等信息，保存到meta文件中
+        """
+        self.spool_file = spool_file
+        self.meta = dict(meta or {}, binlog_files=[], first_file=None, first_pos=None, last_file=None,
+                         last_pos=None, event_count=0)
+        self.f_spool = open(spool_file, "wb")
+        # {(schema, table): (表结构编号, columns对象, 字段定义)}
+        self.tables = dict()
+        self.table_count = 0
+
+    def dump(self, record):
+        pickle.dump(record, self.f_spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def get_table_id(self, binlog_event):
+        """
+        :return: 行事件的表结构编号，表结构与上次不同时先写入新的表结构定义
+        """
+        table_key = (binlog_event.schema, binlog_event.table)
+        table_item = self.tables.get(table_key)
+        if table_item is not None and table_item[1] is binlog_event.columns:
+            return table_item[0]
+        columns_data = [column.data for column in binlog_event.columns]
+        if table_item is not None and table_item[2] == columns_data:
+            self.tables[table_key] = (table_item[0], binlog_event.columns, columns_data)
+            return table_item[0]
+        self.table_count += 1
+        self.dump((EVENT_SPOOL_TABLE, self.table_count, binlog_event.schema, binlog_event.table,
+                   binlog_event.primary_key, columns_data))
+        self.tables[table_key] = (self.table_count, binlog_event.columns, columns_data)
+        return self.table_count
+
+    def write_event(self, binlog_event, log_file, log_pos):
+        """
+        :param binlog_event:
+        :param log_file: 读取该事件后的binlog文件
+        :param log_pos: 读取该事件后的位点
+        :return:
+        """
+        code = EVENT_SPOOL_CODES.get(binlog_event.__class__)
+        if code is None:
+            return
+        header = (code, log_file, log_pos, binlog_event.packet.log_pos, binlog_event.packet.event_size)
+        if isinstance(binlog_event, UpdateRowsEvent):
+            rows = binlog_event.rows
+            keys = (tuple(rows[0]['before_values']), tuple(rows[0]['after_values'])) if rows else ((), ())
+            self.dump(header + (binlog_event.timestamp, self.get_table_id(binlog_event), keys,
+                                [(tuple(row['before_values'].values()), tuple(row['after_values'].values()))
+                                 for row in rows]))
+        elif code >= EVENT_SPOOL_CODES[WriteRowsEvent]:
+            rows = binlog_event.rows
+            keys = tuple(rows[0]['values']) if rows else ()
+            self.dump(header + (binlog_event.timestamp, self.get_table_id(binlog_event), keys,
+                                [tuple(row['values'].values()) for row in rows]))
+        else:
+            self.dump(header + tuple(getattr(binlog_event, attr) for attr in EVENT_SPOOL_ATTRS[binlog_event.__class__]))
+        self.observe_position(log_file, log_pos)
+        self.meta['event_count'] += 1
+
+    def observe_position(self, log_file, log_pos):
+        if log_file not in self.meta['binlog_files']:
+            self.meta['binlog_files'].append(log_file)
+        if self.meta['first_file'] is None:
+            self.meta['first_file'], self.meta['first_pos'] = log_file, log_pos
+        self.meta['last_file'], self.meta['last_pos'] = log_file, log_pos
+
+    def set_start_position(self, log_file, log_pos):
+        self.observe_position(log_file, log_pos)
+
+    def append_part(self, part_file):
+        """
+        追加并行进程生成的事件文件，表结构编号在每个文件内部重新定义，可以直接拼接
+        """
+        self.f_spool.flush()
+        with open(part_file, "rb") as f_part:
+            shutil.copyfileobj(f_part, self.f_spool)
+        part_meta = load_event_spool_meta(part_file)
+        binlog_files = self.meta['binlog_files'] + [log_file for log_file in part_meta['binlog_files']
+                                                   if log_file not in self.meta['binlog_files']]
+        self.meta['binlog_files'] = sorted(binlog_files, key=binlog_file_number)
+        if part_meta['first_file'] is not None:
+            if self.meta['first_file'] is None or \
+                    (binlog_file_number(part_meta['first_file']), part_meta['first_pos']) < \
+                    (binlog_file_number(self.meta['first_file']), self.meta['first_pos']):
+                self.meta['first_file'], self.meta['first_pos'] = part_meta['first_file'], part_meta['first_pos']
+            if self.meta['last_file'] is None or \
+                    (binlog_file_number(part_meta['last_file']), part_meta['last_pos']) > \
+                    (binlog_file_number(self.meta['last_file']), self.meta['last_pos']):
+                self.meta['last_file'], self.meta['last_pos'] = part_meta['last_file'], part_meta['last_pos']
+        self.meta['event_count'] += part_meta['event_count']
+        # 其他文件中的表结构编号可能与当前文件重复，之后的行事件重新写入表结构
+        self.tables = dict()
+        remove_event_spool(part_file)
+
+    def close(self):
+        if self.f_spool is None:
+            return
+        self.f_spool.close()
+        self.f_spool = None
+        self.meta['update_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        meta_file = get_event_spool_meta_file(self.spool_file)
+        with open(meta_file + ".tmp", "w", encoding='utf-8') as f_meta:
+            json.dump(self.meta, f_meta, indent=1)
+        os.replace(meta_file + ".tmp", meta_file)
+
+
+def remove_event_spool(spool_file):
+    for file_path in (spool_file, get_event_spool_meta_file(spool_file)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class EventSpoolRecorder(object):
+    """
+    包装binlog事件源，将读取到的事件同时写入事件文件，对外接口与事件源保持一致(log_file/log_pos/迭代/close)
+    """
+
+    def __init__(self, stream, spool_writer):
+        self.stream = stream
+        self.spool_writer = spool_writer
+        self.spool_writer.set_start_position(stream.log_file, stream.log_pos)
+
+    @property
+    def log_file(self):
+        return self.stream.log_file
+
+    @property
+    def log_pos(self):
+        return self.stream.log_pos
+
+    def __iter__(self):
+        for binlog_event in self.stream:
+            self.spool_writer.write_event(binlog_event, self.stream.log_file, self.stream.log_pos)
+            yield binlog_event
+
+    def close(self):
+        self.stream.close()
+        self.spool_writer.close()
+
+
+def make_spool_event(event_class, packet_log_pos, event_size, attrs):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update(attrs)
+    binlog_event.packet = SimpleNamespace(log_pos=packet_log_pos, event_size=event_size)
+    return binlog_event
+
+
+class EventSpoolReader(object):
+    """
+    从事件文件回放解码后的事件，不连接数据库也不读取binlog文件，对外接口与事件源保持一致。
+    按起始位点跳过之前的事件，并按库名、表名和事件类型过滤
+    """
+
+    def __init__(self, spool_file, log_file, log_pos, only_schemas=None, only_tables=None, only_events=None):
+        self.spool_file = spool_file
+        self.log_file, self.log_pos = log_file, log_pos
+        self.only_schemas = only_schemas
+        self.only_tables = only_tables
+        self.only_events = frozenset(only_events) if only_events is not None else None
+        self.f_spool = None
+
+    def iter_records(self):
+        self.f_spool = open(self.spool_file, "rb")
+        while True:
+            try:
+                yield pickle.load(self.f_spool)
+            except EOFError:
+                return
+
+    def __iter__(self):
+        start_position = (binlog_file_number(self.log_file), self.log_pos)
+        tables = dict()
+        yield make_rotate_event(self.log_file, self.log_pos)
+        for record in self.iter_records():
+            code = record[0]
+            if code == EVENT_SPOOL_TABLE:
+                _, table_id, schema, table, primary_key, columns_data = record
+                tables[table_id] = (schema, table, primary_key, [Column(**data) for data in columns_data])
+                continue
+            _, log_file, log_pos, packet_log_pos, event_size = record[:5]
+            if (binlog_file_number(log_file), log_pos) <= start_position:
+                continue
+            event_class = EVENT_SPOOL_CLASSES[code]
+            if self.only_events is not None and event_class not in self.only_events:
+                continue
+            if code >= EVENT_SPOOL_CODES[WriteRowsEvent]:
+                timestamp, table_id, keys, rows = record[5:]
+                schema, table, primary_key, columns = tables[table_id]
+                if (self.only_schemas and schema not in self.only_schemas) or \
+                        (self.only_tables and table not in self.only_tables):
+                    continue
+                if event_class is UpdateRowsEvent:
+                    rows = [{'before_values': dict(zip(keys[0], before_values)),
+                             'after_values': dict(zip(keys[1], after_values))}
+                            for before_values, after_values in rows]
+                else:
+                    rows = [{'values': dict(zip(keys, values))} for values in rows]
+                binlog_event = make_spool_event(event_class, packet_log_pos, event_size, {
+                    'timestamp': timestamp, 'schema': schema, 'table': table, 'primary_key': primary_key,
+                    'columns': columns})
+                set_event_rows(binlog_event, rows)
+            else:
+                binlog_event = make_spool_event(event_class, packet_log_pos, event_size,
+                                                dict(zip(EVENT_SPOOL_ATTRS[event_class], record[5:])))
+            self.log_file, self.log_pos = log_file, log_pos
+            yield binlog_event
+
+    def close(self):
+        if self.f_spool is not None:
+            self.f_spool.close()
+            self.f_spool = None
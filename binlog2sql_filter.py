@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, TableMapEvent
+
+SQL_TYPE_ROW_EVENTS = {
+    'INSERT': WriteRowsEvent,
+    'UPDATE': UpdateRowsEvent,
+    'DELETE': DeleteRowsEvent,
+}
+# BEGIN用于事务边界和pseudo-thread-id过滤，Xid/Gtid/FormatDescription用于计算SQL的起始位点
+BASE_EVENTS = [QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent, TableMapEvent]
+
+
+class EventFilterPlan(object):
+    """
+    根据命令行参数生成下推到binlog事件源的过滤条件，未被选择的事件在解析事件头后直接跳过，不再解码事件内容
+    """
+
+    def __init__(self, sql_type, freeze_schema=False):
+        """
+        :param sql_type: 需要生成SQL的DML类型
+        :param freeze_schema: 由调用方确认binlog范围内没有DDL时指定，同一table_id的TableMap事件只解析一次，
+            范围内有DDL时之后的行数据会按修改前的表结构解码
+        """
+        self.row_events = [SQL_TYPE_ROW_EVENTS[item] for item in sql_type if item in SQL_TYPE_ROW_EVENTS]
+        self.only_events = BASE_EVENTS + self.row_events
+        self.ignored_events = None
+        self.freeze_schema = freeze_schema
+        self.read_event_count = 0
+        self.read_bytes = 0
+        self.skipped_bytes = 0
+        self.skipped_range_count = 0
+
+    def observe(self, binlog_event, last_pos):
+        """
+        统计事件源返回的事件，当前事件起始位点与上一个事件结束位点之间的字节为被跳过的事件
+        :param binlog_event:
+        :param last_pos: 上一个事件的结束位点
+        :return:
+        """
+        packet = binlog_event.packet
+        self.read_event_count += 1
+        self.read_bytes += packet.event_size
+        if isinstance(binlog_event, RotateEvent) or not packet.log_pos:
+            return
+        skipped_bytes = packet.log_pos - packet.event_size - last_pos
+        if skipped_bytes > 0:
+            self.skipped_bytes += skipped_bytes
+            self.skipped_range_count += 1
+
+    def report(self):
+        return "event filter: events={0}, freeze_schema={1}, read events:{2}, read bytes:{3}, " \
+               "skipped bytes:{4} in {5} ranges".format(
+                   ','.join(event.__name__ for event in self.only_events), self.freeze_schema,
+                   self.read_event_count, self.read_bytes, self.skipped_bytes, self.skipped_range_count)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import binascii
+from pymysqlreplication.gtid import Gtid
+from pymysqlreplication.event import GtidEvent, QueryEvent, XidEvent
+from pymysqlreplication.row_event import RowsEvent
+
+
+def parse_gtid_set(gtid_set):
+    """
+    :param gtid_set: 'uuid:1-5:7,uuid2:3'格式的GTID集合
+    :return: {server_uuid: [(起始事务号, 结束事务号+1), ...]}，区间按起始事务号排序并合并相邻区间
+    """
+    gtid_intervals = dict()
+    if not gtid_set:
+        return gtid_intervals
+    for gtid_item in gtid_set.replace('\n', '').split(','):
+        gtid_item = gtid_item.strip()
+        if not gtid_item:
+            continue
+        sid, intervals = Gtid.parse(gtid_item)
+        gtid_intervals.setdefault(sid.lower(), []).extend(intervals)
+    return {sid: merge_intervals(intervals) for sid, intervals in gtid_intervals.items()}
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(intervals, removed_intervals):
+    result = []
+    for start, end in intervals:
+        for removed_start, removed_end in removed_intervals:
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                result.append((start, removed_start))
+            start = max(start, removed_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def union_gtid_sets(*gtid_sets):
+    result = dict()
+    for gtid_intervals in gtid_sets:
+        for sid, intervals in gtid_intervals.items():
+            result[sid] = merge_intervals(result.get(sid, []) + intervals)
+    return result
+
+
+def subtract_gtid_sets(gtid_intervals, removed_gtid_intervals):
+    result = dict()
+    for sid, intervals in gtid_intervals.items():
+        intervals = subtract_intervals(intervals, removed_gtid_intervals.get(sid, []))
+        if intervals:
+            result[sid] = intervals
+    return result
+
+
+def format_gtid_set(gtid_intervals):
+    return ','.join('{0}:{1}'.format(sid, ':'.join(
+        str(start) if start + 1 == end else '{0}-{1}'.format(start, end - 1) for start, end in intervals))
+        for sid, intervals in sorted(gtid_intervals.items()))
+
+
+def contains_gtid(gtid_intervals, sid, gno):
+    intervals = gtid_intervals.get(sid)
+    if not intervals:
+        return False
+    index = bisect.bisect_right(intervals, (gno, float('inf'))) - 1
+    return index >= 0 and intervals[index][0] <= gno < intervals[index][1]
+
+
+class GtidTransactionTracker(object):
+    """
+    按事件顺序跟踪当前事务是否被GTID条件选择。GtidEvent决定其后一个事务的选择结果，
+    之前没有GtidEvent的事务(匿名事务的BEGIN或DDL)按include_gtids是否为空处理，不沿用上一个事务的结果
+    """
+
+    def __init__(self, gtid_filter, selected=None, has_gtid=False):
+        """
+        :param gtid_filter: GtidRangeFilter
+        :param selected: 当前事务是否被选择，None时为匿名事务的选择结果
+        :param has_gtid: 当前事务之前是否有GtidEvent，从断点继续时沿用断点中的值
+        """
+        self.gtid_filter = gtid_filter
+        self.selected = gtid_filter.anonymous_selected if selected is None else selected
+        self.has_gtid = has_gtid
+        self.in_transaction = False
+
+    def update(self, binlog_event):
+        """
+        :param binlog_event:
+        :return: 该事件所在的事务是否被选择
+        """
+        if isinstance(binlog_event, GtidEvent):
+            self.selected = self.gtid_filter.is_selected(binlog_event)
+            self.has_gtid = True
+        elif isinstance(binlog_event, QueryEvent):
+            if binlog_event.query == 'BEGIN':
+                self.start_transaction()
+                self.in_transaction = True
+            elif not self.in_transaction:
+                # 事务之外的DDL语句单独作为一个事务
+                self.start_transaction()
+                self.has_gtid = False
+            elif binlog_event.query in ('COMMIT', 'ROLLBACK'):
+                self.end_transaction()
+        elif isinstance(binlog_event, XidEvent):
+            self.end_transaction()
+        return self.selected
+
+    def start_transaction(self):
+        if not self.has_gtid:
+            self.selected = self.gtid_filter.anonymous_selected
+
+    def end_transaction(self):
+        self.in_transaction = False
+        self.has_gtid = False
+
+
+class GtidRangeFilter(object):
+    """
+    按GTID选择事务：include_gtids不为空时只处理集合中的事务，exclude_gtids和start_gtid_set中的事务不处理。
+    读取线程中丢弃未选择事务的行事件，行数据不再解码；没有GTID的事务按include_gtids是否为空处理
+    """
+
+    def __init__(self, include_gtids=None, exclude_gtids=None, start_gtid_set=None):
+        """
+        :param include_gtids:
+        :param exclude_gtids:
+        :param start_gtid_set: 已经执行过的GTID集合，从该集合之后开始解析
+        """
+        self.include_gtids = parse_gtid_set(include_gtids) if include_gtids else None
+        self.exclude_gtids = union_gtid_sets(parse_gtid_set(exclude_gtids), parse_gtid_set(start_gtid_set))
+        self.start_gtid_set = parse_gtid_set(start_gtid_set) if start_gtid_set else None
+        # 没有GTID的事务只在未指定include_gtids时处理
+        self.anonymous_selected = self.include_gtids is None
+        # 读取线程中当前事务的选择状态
+        self.reader_tracker = GtidTransactionTracker(self)
+        self.skipped_transaction_count = 0
+        self.skipped_rows_event_count = 0
+
+    @staticmethod
+    def get_sid(binlog_event):
+        nibbles = binascii.hexlify(binlog_event.sid).decode('ascii')
+        return '%s-%s-%s-%s-%s' % (nibbles[:8], nibbles[8:12], nibbles[12:16], nibbles[16:20], nibbles[20:])
+
+    def is_selected(self, binlog_event):
+        """
+        :param binlog_event: GtidEvent
+        :return: 该GTID的事务是否需要处理
+        """
+        sid, gno = self.get_sid(binlog_event), binlog_event.gno
+        if self.include_gtids is not None and not contains_gtid(self.include_gtids, sid, gno):
+            return False
+        return not contains_gtid(self.exclude_gtids, sid, gno)
+
+    def accept_event(self, binlog_event):
+        """
+        在读取线程中按事件顺序调用，返回False的行事件不再交给解析线程
+        """
+        selected = self.reader_tracker.update(binlog_event)
+        if isinstance(binlog_event, GtidEvent):
+            if not selected:
+                self.skipped_transaction_count += 1
+            return True
+        if not selected and isinstance(binlog_event, RowsEvent):
+            self.skipped_rows_event_count += 1
+            return False
+        return True
+
+    def get_auto_position(self, gtid_executed=None):
+        """
+        生成auto_position使用的GTID集合，集合中的事务由实例直接跳过，不再发送
+        :param gtid_executed: 实例的gtid_executed，指定include_gtids时跳过其余已执行的事务
+        :return: 未指定start_gtid_set和include_gtids时返回None，按binlog文件和位点解析
+        """
+        if self.start_gtid_set is None and self.include_gtids is None:
+            return None
+        auto_position = self.exclude_gtids
+        if self.include_gtids is not None:
+            auto_position = union_gtid_sets(
+                auto_position, subtract_gtid_sets(parse_gtid_set(gtid_executed), self.include_gtids))
+        return format_gtid_set(auto_position)
+
+    def report(self):
+        return "gtid filter: skipped transactions:{0}, skipped rows events:{1}".format(
+            self.skipped_transaction_count, self.skipped_rows_event_count)
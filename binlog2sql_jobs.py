@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+一次处理多个MySQL实例：按配置文件为每个实例启动一个binlog2sql进程，同时运行的进程数有上限，
+每个实例的输出文件保存在单独的目录中，最后汇总各实例的状态和统计结果。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import subprocess
+from binlog2sql_util import parse_args as parse_binlog2sql_args, command_line_args
+from binlog2sql_metrics import ProcessMetrics, MetricsExporter
+
+BINLOG2SQL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'binlog2sql.py')
+DEFAULT_MAX_JOBS = 4
+JOB_POLL_INTERVAL = 0.5
+JOB_METRICS_FILE = 'metrics.json'
+JOB_LOG_FILE = 'binlog2sql.log'
+JOBS_METRICS_FILE = 'metrics.json'
+JOBS_SUMMARY_FILE = 'summary.json'
+
+
+class BinlogJob(object):
+    """
+    单个实例的解析任务
+    """
+
+    def __init__(self, name, argv, output_dir):
+        """
+        :param name: 任务名，同时作为输出目录名
+        :param argv: binlog2sql的命令行参数
+        :param output_dir: 该任务的输出目录
+        """
+        self.name = name
+        self.argv = argv
+        self.output_dir = output_dir
+        self.metrics_file = os.path.join(output_dir, JOB_METRICS_FILE)
+        self.log_file = os.path.join(output_dir, JOB_LOG_FILE)
+        self.process = None
+        self.f_log = None
+        self.start_time = None
+        self.end_time = None
+        self.return_code = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # 重新运行时不合并上次的统计结果
+        if os.path.exists(self.metrics_file):
+            os.remove(self.metrics_file)
+        self.f_log = open(self.log_file, 'w', encoding='utf-8')
+        command = [sys.executable, BINLOG2SQL_SCRIPT] + self.argv + [
+            '--output-dir', self.output_dir, '--metrics-file', self.metrics_file, '--metrics-format', 'json']
+        self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=self.f_log,
+                                        stderr=subprocess.STDOUT)
+        self.start_time = time.time()
+
+    def poll(self):
+        """
+        :return: 任务是否已经结束
+        """
+        if self.process is None:
+            return False
+        if self.return_code is None:
+            self.return_code = self.process.poll()
+            if self.return_code is not None:
+                self.end_time = time.time()
+                self.f_log.close()
+        return self.return_code is not None
+
+    def terminate(self):
+        if self.process is not None and self.return_code is None:
+            self.process.terminate()
+            self.return_code = self.process.wait()
+            self.end_time = time.time()
+            self.f_log.close()
+
+    @property
+    def status(self):
+        if self.process is None:
+            return 'pending'
+        if self.return_code is None:
+            return 'running'
+        return 'success' if self.return_code == 0 else 'failed'
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    def load_metrics(self):
+        """
+        :return: 该任务最后一次导出的统计结果，还没有导出时返回None
+        """
+        if not os.path.exists(self.metrics_file):
+            return None
+        snapshot = None
+        with open(self.metrics_file, 'r', encoding='utf-8') as f_metrics:
+            for line in f_metrics:
+                # 进程运行中最后一行可能还没有写完
+                try:
+                    snapshot = json.loads(line)
+                except ValueError:
+                    continue
+        return snapshot
+
+    def get_output_files(self):
+        excluded_files = (JOB_METRICS_FILE, JOB_LOG_FILE)
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(os.path.join(self.output_dir, file_name) for file_name in os.listdir(self.output_dir)
+                      if file_name not in excluded_files and not file_name.endswith('.tmp'))
+
+    def summary(self):
+        snapshot = self.load_metrics() or dict()
+        return {
+            'name': self.name,
+            'status': self.status,
+            'return_code': self.return_code,
+            'elapsed': round(self.elapsed, 3),
+            'events': snapshot.get('events', 0),
+            'rows': snapshot.get('rows', 0),
+            'bytes_written': snapshot.get('bytes_written', 0),
+            'log_file': snapshot.get('log_file'),
+            'log_pos': snapshot.get('log_pos'),
+            'output_dir': self.output_dir,
+            'output_files': self.get_output_files(),
+        }
+
+
+def load_jobs(config_file, output_dir=None):
+    """
+    读取任务配置文件:
+    {"output_dir": "...", "max_jobs": 4, "args": [所有任务共用的参数], "jobs": [{"name": "...", "args": [...]}]}
+    :param config_file:
+    :param output_dir: 覆盖配置文件中的output_dir
+    :return: (任务列表, 输出目录, 配置文件中的max_jobs)
+    """
+    with open(config_file, 'r', encoding='utf-8') as f_config:
+        config = json.load(f_config)
+    output_dir = os.path.abspath(output_dir or config.get('output_dir') or 'jobs_{0}'.format(
+        datetime.datetime.now().strftime("%Y%m%d%H%M%S")))
+    common_argv = [str(arg) for arg in config.get('args', [])]
+    jobs = []
+    job_names = set()
+    for job_config in config.get('jobs', []):
+        name = str(job_config.get('name', ''))
+        if not name or name in job_names or os.sep in name or name in (os.curdir, os.pardir):
+            raise ValueError('Incorrect or duplicate job name: %s' % name)
+        job_names.add(name)
+        argv = common_argv + [str(arg) for arg in job_config.get('args', [])]
+        check_job_args(name, argv)
+        jobs.append(BinlogJob(name, argv, os.path.join(output_dir, name)))
+    if not jobs:
+        raise ValueError('No jobs in config file %s' % config_file)
+    return jobs, output_dir, config.get('max_jobs')
+
+
+def check_job_args(name, argv):
+    """
+    在启动子进程前校验参数，子进程不能交互输入密码
+    """
+    parser = parse_binlog2sql_args()
+    # 按解析后的值判断，同时覆盖--output-dir=/x和参数缩写的写法
+    parser.set_defaults(output_dir=None, metrics_file=None, metrics_format=None)
+    args = parser.parse_args(argv)
+    if args.help:
+        raise ValueError('job %s: --help can not be used in jobs' % name)
+    if (not args.binlog_dir or args.apply) and not args.password:
+        raise ValueError('job %s: lack of parameter: password' % name)
+    for option, value in (('--output-dir', args.output_dir), ('--metrics-file', args.metrics_file),
+                          ('--metrics-format', args.metrics_format)):
+        if value is not None:
+            raise ValueError('job %s: %s is set by binlog2sql_jobs' % (name, option))
+    try:
+        command_line_args(argv)
+    except ValueError as ex:
+        raise ValueError('job %s: %s' % (name, ex))
+
+
+class JobRunner(object):
+    """
+    按配置顺序启动任务，同时运行的任务数不超过max_jobs，定期合并各任务的统计结果
+    """
+
+    def __init__(self, jobs, output_dir, max_jobs=DEFAULT_MAX_JOBS, metrics_interval=10):
+        self.jobs = jobs
+        self.output_dir = output_dir
+        self.max_jobs = max_jobs
+        self.metrics_exporter = MetricsExporter(os.path.join(output_dir, JOBS_METRICS_FILE), 'json',
+                                                metrics_interval)
+
+    def merge_metrics(self):
+        """
+        :return: 所有任务最后一次导出的统计结果之和
+        """
+        metrics = ProcessMetrics()
+        metrics.start_time = min([job.start_time for job in self.jobs if job.start_time] or [time.time()])
+        for job in self.jobs:
+            snapshot = job.load_metrics()
+            if snapshot is not None:
+                metrics.merge(snapshot)
+        return metrics
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        pending = list(self.jobs)
+        running = []
+        try:
+            while pending or running:
+                running = [job for job in running if not job.poll()]
+                while pending and len(running) < self.max_jobs:
+                    job = pending.pop(0)
+                    job.start()
+                    print("{0} start job {1}, pid:{2}".format(
+                        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job.name, job.process.pid))
+                    running.append(job)
+                if self.metrics_exporter.is_due():
+                    self.metrics_exporter.export(self.merge_metrics())
+                if running:
+                    time.sleep(JOB_POLL_INTERVAL)
+        finally:
+            for job in running:
+                job.terminate()
+        self.metrics_exporter.export(self.merge_metrics())
+        summary = {
+            'created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'max_jobs': self.max_jobs,
+            'jobs': [job.summary() for job in self.jobs],
+            'total': self.merge_metrics().snapshot(),
+        }
+        with open(os.path.join(self.output_dir, JOBS_SUMMARY_FILE), 'w', encoding='utf-8') as f_summary:
+            json.dump(summary, f_summary, ensure_ascii=False, indent=1)
+        return summary
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Run binlog2sql on many MySQL instances with a bounded worker pool')
+    parser.add_argument('--config', dest='config', type=str, required=True,
+                        help='Jobs config json file: {"output_dir": ..., "max_jobs": ..., "args": [common args], '
+                             '"jobs": [{"name": ..., "args": [binlog2sql args]}]}')
+    parser.add_argument('--max-jobs', dest='max_jobs', type=int, default=None,
+                        help='Max number of jobs running at the same time. default: max_jobs of the config, or %d'
+                             % DEFAULT_MAX_JOBS)
+    parser.add_argument('--output-dir', dest='output_dir', type=str, default=None,
+                        help='Output directory, each job writes to a sub directory named by the job. '
+                             'default: output_dir of the config')
+    parser.add_argument('--metrics-interval', dest='metrics_interval', type=int, default=10,
+                        help="Seconds between exports of the combined metrics. default: 10")
+    args = parser.parse_args(args)
+    if args.max_jobs is not None and args.max_jobs < 1:
+        raise ValueError('Incorrect max-jobs argument')
+    if args.metrics_interval < 1:
+        raise ValueError('Incorrect metrics-interval argument')
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    jobs, output_dir, config_max_jobs = load_jobs(args.config, args.output_dir)
+    max_jobs = args.max_jobs or config_max_jobs or DEFAULT_MAX_JOBS
+    if max_jobs < 1:
+        raise ValueError('Incorrect max_jobs in config file')
+    summary = JobRunner(jobs, output_dir, max_jobs, args.metrics_interval).run()
+    print("===============================================")
+    print("{0:<20}{1:>9}{2:>8}{3:>10}{4:>12}{5:>12}{6:>14}".format(
+        'job', 'status', 'code', 'seconds', 'events', 'rows', 'bytes'))
+    for job_summary in summary['jobs']:
+        print("{0:<20}{1:>9}{2:>8}{3:>10.1f}{4:>12}{5:>12}{6:>14}".format(
+            job_summary['name'], job_summary['status'], str(job_summary['return_code']), job_summary['elapsed'],
+            job_summary['events'], job_summary['rows'], job_summary['bytes_written']))
+    total = summary['total']
+    print("{0:<20}{1:>9}{2:>8}{3:>10.1f}{4:>12}{5:>12}{6:>14}".format(
+        'total', '', '', total['elapsed'], total['events'], total['rows'], total['bytes_written']))
+    print("summary: {0}".format(os.path.join(output_dir, JOBS_SUMMARY_FILE)))
+    print("===============================================")
+    failed_jobs = [job_summary['name'] for job_summary in summary['jobs'] if job_summary['status'] != 'success']
+    if failed_jobs:
+        print("failed jobs: {0}, see {1} in the job directory".format(', '.join(failed_jobs), JOB_LOG_FILE))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
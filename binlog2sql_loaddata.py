@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import shutil
+import datetime
+import codecs
+from collections import OrderedDict
+from pymysqlreplication.constants import FIELD_TYPE
+from binlog2sql_util2 import SqlValueEscaper
+
+# 没有字符集时以bytes返回的字段类型，导出为十六进制并在加载时UNHEX
+BINARY_FIELD_TYPES = {FIELD_TYPE.VARCHAR, FIELD_TYPE.STRING, FIELD_TYPE.VAR_STRING, FIELD_TYPE.BLOB,
+                      FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.GEOMETRY}
+# 所有表缓存的数据超过该大小时写入文件
+MAX_LOAD_DATA_BUFFER_BYTES = 8388608
+LOAD_DATA_FORMATS = {
+    'tsv': "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'",
+    'csv': "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'",
+}
+
+
+class LoadDataValueEscaper(SqlValueEscaper):
+    """
+    生成LOAD DATA字段值，NULL输出为\\N，转义规则与LOAD DATA默认的ESCAPED BY '\\\\'一致，CSV格式的字符串使用双引号包围
+    """
+    FIELD_ESCAPE_TABLE = {
+        ord('\0'): '\\0',
+        ord('\\'): '\\\\',
+        ord('\n'): '\\n',
+        ord('\r'): '\\r',
+        ord('\t'): '\\t',
+    }
+
+    def __init__(self, charset='utf8', data_format='tsv'):
+        super(LoadDataValueEscaper, self).__init__(charset)
+        self.field_escape_table = dict(self.FIELD_ESCAPE_TABLE)
+        self.enclosed_by = ''
+        if data_format == 'csv':
+            self.field_escape_table[ord('"')] = '\\"'
+            self.enclosed_by = '"'
+        for value_type in (datetime.datetime, datetime.date, datetime.time, datetime.timedelta):
+            self.encoders[value_type] = self.unquote(self.encoders[value_type])
+
+    @staticmethod
+    def unquote(encoder):
+        return lambda value: encoder(value)[1:-1]
+
+    def escape_str(self, value):
+        return self.enclosed_by + value.translate(self.field_escape_table) + self.enclosed_by
+
+    @staticmethod
+    def escape_none(value):
+        return '\\N'
+
+    def escape_bytes(self, value):
+        try:
+            return self.escape_str(value.decode(self.encoding))
+        except UnicodeDecodeError:
+            return self.escape_hex(value)
+
+    def escape_hex(self, value):
+        # 数据文件中X'...'会作为普通字符串加载，按原始字节写入并转义分隔符，无法解码的字节写入文件时通过surrogateescape还原
+        return self.escape_str(value.decode('utf-8', 'surrogateescape'))
+
+    @staticmethod
+    def escape_binary(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        return value.hex()
+
+
+class LoadDataWriter(object):
+    """
+    将行数据按表写入LOAD DATA格式的数据文件，各表的数据先缓存在内存中，超过上限后追加写入文件
+    """
+
+    def __init__(self, file_prefix, data_format='tsv', charset='utf8', table_items=None):
+        """
+        :param file_prefix: 数据文件路径前缀，文件名为[file_prefix]_[schema].[table].[data_format]
+        :param data_format: tsv/csv
+        :param charset:
+        :param table_items: 断点续传时断点中保存的表信息
+        """
+        self.file_prefix = file_prefix
+        self.data_format = data_format
+        self.escaper = LoadDataValueEscaper(charset, data_format)
+        self.field_separator = '\t' if data_format == 'tsv' else ','
+        self.tables = OrderedDict()
+        self.buffers = dict()
+        self.buffer_bytes = 0
+        for table_item in table_items or []:
+            table_key = '{0}.{1}'.format(table_item['schema'], table_item['table'])
+            self.tables[table_key] = dict(table_item)
+            self.buffers[table_key] = []
+
+    def get_table_item(self, binlog_event):
+        table_key = '{0}.{1}'.format(binlog_event.schema, binlog_event.table)
+        table_item = self.tables.get(table_key)
+        if table_item is None:
+            table_item = {
+                'schema': binlog_event.schema, 'table': binlog_event.table,
+                'file': '{0}_{1}.{2}'.format(self.file_prefix, table_key, self.data_format),
+                'data_format': self.data_format,
+                'columns': [column.name for column in binlog_event.columns],
+                'binary_columns': [column.name for column in binlog_event.columns
+                                   if column.type in BINARY_FIELD_TYPES and column.character_set_name is None],
+                'bit_columns': [column.name for column in binlog_event.columns if column.type == FIELD_TYPE.BIT],
+                'row_count': 0,
+            }
+            self.tables[table_key] = table_item
+            self.buffers[table_key] = []
+        return table_key, table_item
+
+    def write_row(self, binlog_event, values):
+        """
+        :param binlog_event:
+        :param values: 行数据，{字段名: 值}
+        :return:
+        """
+        table_key, table_item = self.get_table_item(binlog_event)
+        fields = []
+        for column_name in table_item['columns']:
+            if column_name in table_item['binary_columns']:
+                fields.append(self.escaper.escape_binary(values[column_name]))
+            else:
+                fields.append(self.escaper.literal(values[column_name]))
+        line = self.field_separator.join(fields) + '\n'
+        self.buffers[table_key].append(line)
+        table_item['row_count'] += 1
+        self.buffer_bytes += len(line)
+        if self.buffer_bytes >= MAX_LOAD_DATA_BUFFER_BYTES:
+            self.flush()
+
+    def flush(self):
+        for table_key, lines in self.buffers.items():
+            if not lines:
+                continue
+            with codecs.open(self.tables[table_key]['file'], "a+", 'utf-8', 'surrogateescape') as f_data:
+                f_data.write(''.join(lines))
+            self.buffers[table_key] = []
+        self.buffer_bytes = 0
+
+    def append_tables(self, table_items):
+        """
+        将并行进程生成的数据文件追加到对应表的数据文件中，并删除进程的数据文件
+        :param table_items: 并行进程LoadDataWriter生成的表信息
+        :return:
+        """
+        self.flush()
+        for part_item in table_items:
+            table_key = '{0}.{1}'.format(part_item['schema'], part_item['table'])
+            table_item = self.tables.get(table_key)
+            if table_item is None:
+                table_item = dict(part_item, file='{0}_{1}.{2}'.format(self.file_prefix, table_key, self.data_format),
+                                  row_count=0)
+                self.tables[table_key] = table_item
+                self.buffers[table_key] = []
+            if not os.path.exists(part_item['file']):
+                continue
+            with open(table_item['file'], "ab") as f_data, open(part_item['file'], "rb") as f_part:
+                shutil.copyfileobj(f_part, f_data)
+            table_item['row_count'] += part_item['row_count']
+            os.remove(part_item['file'])
+
+    def checkpoint(self):
+        """
+        写入缓存的数据并记录各数据文件的大小
+        :return: 表信息列表
+        """
+        self.flush()
+        for table_item in self.tables.values():
+            table_item['file_size'] = os.path.getsize(table_item['file']) if os.path.exists(table_item['file']) else 0
+        return [dict(table_item) for table_item in self.tables.values()]
+
+    def close(self):
+        return self.checkpoint()
+
+
+def truncate_load_data_files(file_prefix, table_items):
+    """
+    将数据文件截断到断点时的大小，并删除断点之后才创建的数据文件
+    :param file_prefix:
+    :param table_items:
+    :return:
+    """
+    table_files = {table_item['file']: table_item['file_size'] for table_item in table_items}
+    for data_file in glob.glob(glob.escape(file_prefix) + '_*'):
+        if data_file not in table_files:
+            os.remove(data_file)
+    for data_file, file_size in table_files.items():
+        if os.path.exists(data_file):
+            with open(data_file, "ab") as f_data:
+                f_data.truncate(file_size)
+
+
+def get_load_data_statement(table_item, charset='utf8mb4'):
+    """
+    生成加载单个数据文件的LOAD DATA语句，二进制字段通过UNHEX还原，BIT字段通过CONV还原
+    :param table_item: LoadDataWriter生成的表信息
+    :param charset:
+    :return:
+    """
+    column_list, set_list = [], []
+    for column_name in table_item['columns']:
+        if column_name in table_item['binary_columns']:
+            column_list.append('@`{0}`'.format(column_name))
+            set_list.append('`{0}` = UNHEX(@`{0}`)'.format(column_name))
+        elif column_name in table_item['bit_columns']:
+            column_list.append('@`{0}`'.format(column_name))
+            set_list.append('`{0}` = CAST(CONV(@`{0}`, 2, 10) AS UNSIGNED)'.format(column_name))
+        else:
+            column_list.append('`{0}`'.format(column_name))
+    statement = "LOAD DATA LOCAL INFILE '{0}' INTO TABLE `{1}`.`{2}` CHARACTER SET {3} {4} ({5})".format(
+        table_item['file'].replace('\\', '\\\\').replace("'", "\\'"), table_item['schema'], table_item['table'],
+        charset, LOAD_DATA_FORMATS[table_item['data_format']], ', '.join(column_list))
+    if set_list:
+        statement += ' SET ' + ', '.join(set_list)
+    return statement + ';'
+
+
+def write_load_data_script(script_file, table_items):
+    """
+    生成加载所有数据文件的SQL脚本，需要使用mysql --local-infile=1执行
+    :param script_file:
+    :param table_items:
+    :return:
+    """
+    with codecs.open(script_file, "w", 'utf-8') as f_script:
+        for table_item in table_items:
+            if not table_item['row_count'] or not os.path.exists(table_item['file']):
+                continue
+            f_script.write("-- {0} rows\n".format(table_item['row_count']))
+            f_script.write(get_load_data_statement(table_item) + '\n')
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import mmap
+import struct
+import pymysql
+from pymysql.protocol import MysqlPacket
+from pymysqlreplication.packet import BinLogPacketWrapper
+from pymysqlreplication.constants.BINLOG import ROTATE_EVENT, TABLE_MAP_EVENT, FORMAT_DESCRIPTION_EVENT
+from pymysqlreplication.event import (
+    QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent, StopEvent,
+    BeginLoadQueryEvent, ExecuteLoadQueryEvent,
+)
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, TableMapEvent
+
+BINLOG_MAGIC = b'\xfebin'
+BINLOG_HEADER_SIZE = 19
+BINLOG_CHECKSUM_ALG_CRC32 = 1
+# FormatDescriptionEvent: binlog_version(2) + server_version(50)
+FDE_SERVER_VERSION_OFFSET = BINLOG_HEADER_SIZE + 2
+FDE_SERVER_VERSION_LENGTH = 50
+
+TABLE_COLUMN_QUERY = """
+    SELECT
+        TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, COLLATION_NAME, CHARACTER_SET_NAME,
+        COLUMN_COMMENT, COLUMN_TYPE, COLUMN_KEY
+    FROM information_schema.columns
+    WHERE TABLE_SCHEMA NOT IN ('mysql', 'information_schema', 'performance_schema', 'sys')
+    ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+"""
+TABLE_COLUMN_KEYS = ['COLUMN_NAME', 'COLLATION_NAME', 'CHARACTER_SET_NAME', 'COLUMN_COMMENT', 'COLUMN_TYPE',
+                     'COLUMN_KEY']
+
+
+def get_table_key(schema, table):
+    return '{0}.{1}'.format(schema, table)
+
+
+def dump_schema_snapshot(connection_settings, snapshot_file, only_schemas=None, only_tables=None):
+    """
+    从在线实例导出表结构快照，供离线解析本地binlog文件时使用
+    :param connection_settings:
+    :param snapshot_file:
+    :param only_schemas:
+    :param only_tables:
+    :return: 导出的表数量
+    """
+    snapshot = dict()
+    connection = pymysql.connect(**connection_settings)
+    try:
+        with connection as cursor:
+            cursor.execute(TABLE_COLUMN_QUERY)
+            for row in cursor.fetchall():
+                schema, table = row[0], row[1]
+                if only_schemas and schema not in only_schemas:
+                    continue
+                if only_tables and table not in only_tables:
+                    continue
+                column_item = dict(zip(TABLE_COLUMN_KEYS, row[2:]))
+                snapshot.setdefault(get_table_key(schema, table), []).append(column_item)
+    finally:
+        connection.close()
+    with open(snapshot_file, "w", encoding='utf-8') as f_snapshot:
+        json.dump(snapshot, f_snapshot, ensure_ascii=False, indent=1)
+    return len(snapshot)
+
+
+def list_local_binlog_files(binlog_dir, start_file):
+    """
+    按序号返回binlog目录下与start_file同前缀的所有binlog文件
+    :param binlog_dir:
+    :param start_file:
+    :return:
+    """
+    binlog_prefix = start_file.rsplit('.', 1)[0]
+    binlog_pattern = re.compile(r'^{0}\.\d+$'.format(re.escape(binlog_prefix)))
+    binlog_files = [file_name for file_name in os.listdir(binlog_dir) if binlog_pattern.match(file_name)]
+    return sorted(binlog_files, key=lambda x: int(x.rsplit('.', 1)[1]))
+
+
+class SchemaSnapshot(object):
+    """
+    基于表结构快照文件的元数据来源，替代BinLogStreamReader中查询information_schema的控制连接
+    """
+
+    def __init__(self, snapshot_file, charset='utf8'):
+        self.charset = charset
+        with open(snapshot_file, "r", encoding='utf-8') as f_snapshot:
+            self.tables = json.load(f_snapshot)
+
+    def _get_table_information(self, schema, table):
+        return self.tables.get(get_table_key(schema, table), [])
+
+    def close(self):
+        pass
+
+
+class BinLogFileReader(object):
+    """
+    读取本地binlog文件的事件源，对外接口与BinLogStreamReader保持一致(log_file/log_pos/迭代/close)
+    """
+
+    def __init__(self, binlog_dir, binlog_files, schema_snapshot, log_file=None, log_pos=None,
+                 only_schemas=None, only_tables=None, only_events=None, ignored_events=None,
+                 freeze_schema=False):
+        self.binlog_dir = binlog_dir
+        self.binlog_files = list(binlog_files)
+        self.schema_snapshot = schema_snapshot
+        self.log_file = log_file if log_file else self.binlog_files[0]
+        self.log_pos = log_pos if log_pos else len(BINLOG_MAGIC)
+        self.only_schemas = only_schemas
+        self.only_tables = only_tables
+        self.freeze_schema = freeze_schema
+        self.allowed_events = self._allowed_event_list(only_events, ignored_events)
+        self.allowed_events_in_packet = frozenset([TableMapEvent, RotateEvent]).union(self.allowed_events)
+        self.table_map = {}
+        self._file_index = self.binlog_files.index(self.log_file)
+        self._file = None
+        self._mmap = None
+        self._offset = 0
+        self._file_size = 0
+        self._use_checksum = False
+
+    @staticmethod
+    def _allowed_event_list(only_events, ignored_events):
+        if only_events is not None:
+            events = set(only_events)
+        else:
+            events = {QueryEvent, RotateEvent, StopEvent, FormatDescriptionEvent, XidEvent, GtidEvent,
+                      BeginLoadQueryEvent, ExecuteLoadQueryEvent, UpdateRowsEvent, WriteRowsEvent,
+                      DeleteRowsEvent, TableMapEvent}
+        if ignored_events is not None:
+            for ignored_event in ignored_events:
+                events.discard(ignored_event)
+        return frozenset(events)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_binlog_file(self, start_pos):
+        self.close()
+        file_path = os.path.join(self.binlog_dir, self.log_file)
+        self._file = open(file_path, "rb")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        if self._file_size <= len(BINLOG_MAGIC):
+            self._offset = self._file_size
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(BINLOG_MAGIC)] != BINLOG_MAGIC:
+            raise ValueError('invalid binlog file: %s' % file_path)
+        self._use_checksum = self._checksum_enabled()
+        self.table_map = {}
+        self._offset = max(start_pos, len(BINLOG_MAGIC))
+        self.log_pos = self._offset
+
+    def _checksum_enabled(self):
+        """
+        根据文件头部的FormatDescriptionEvent判断binlog是否带有CRC32校验
+        """
+        offset = len(BINLOG_MAGIC)
+        event_type, event_size = struct.unpack('<xxxxBxxxxI', self._mmap[offset:offset + 13])
+        if event_type != FORMAT_DESCRIPTION_EVENT:
+            return False
+        version_data = self._mmap[offset + FDE_SERVER_VERSION_OFFSET:
+                                  offset + FDE_SERVER_VERSION_OFFSET + FDE_SERVER_VERSION_LENGTH]
+        server_version = version_data.split(b'\0', 1)[0].decode('ascii', 'ignore')
+        version_items = re.findall(r'\d+', server_version)[:3]
+        if tuple(int(item) for item in version_items) < (5, 6, 1):
+            return False
+        return self._mmap[offset + event_size - 5] == BINLOG_CHECKSUM_ALG_CRC32
+
+    def _next_binlog_file(self):
+        self._file_index += 1
+        if self._file_index >= len(self.binlog_files):
+            return False
+        self.log_file = self.binlog_files[self._file_index]
+        self._open_binlog_file(len(BINLOG_MAGIC))
+        return True
+
+    def fetchone(self):
+        if self._file is None:
+            self._open_binlog_file(self.log_pos)
+        while True:
+            if self._offset + BINLOG_HEADER_SIZE > self._file_size:
+                if not self._next_binlog_file():
+                    self.close()
+                    return None
+                continue
+            event_size = struct.unpack('<I', self._mmap[self._offset + 9:self._offset + 13])[0]
+            # 与复制协议保持一致，事件数据前补充1字节的OK标志
+            packet = MysqlPacket(b'\x00' + self._mmap[self._offset:self._offset + event_size],
+                                 self.schema_snapshot.charset)
+            self._offset += event_size
+            binlog_event = BinLogPacketWrapper(packet, self.table_map, self.schema_snapshot, self._use_checksum,
+                                               self.allowed_events_in_packet, self.only_tables, None,
+                                               self.only_schemas, None, self.freeze_schema, False)
+            if binlog_event.event_type == ROTATE_EVENT:
+                self.log_pos = binlog_event.event.position
+                self.log_file = binlog_event.event.next_binlog
+                self.table_map = {}
+            elif binlog_event.log_pos:
+                self.log_pos = binlog_event.log_pos
+
+            if binlog_event.event_type == TABLE_MAP_EVENT and binlog_event.event is not None:
+                self.table_map[binlog_event.event.table_id] = binlog_event.event.get_table()
+
+            if binlog_event.event is None or (binlog_event.event.__class__ not in self.allowed_events):
+                continue
+            return binlog_event.event
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
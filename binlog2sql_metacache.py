@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import threading
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import QueryEvent
+from binlog2sql_local import TABLE_COLUMN_KEYS, get_table_key
+
+# 按表汇总缓存中保存的字段信息的MD5作为表结构版本，INSTANT或不重建表的ALTER同样会改变版本，
+# 每个表只返回一行，QUOTE区分NULL和空字符串
+TABLE_FINGERPRINT_QUERY = """
+    SELECT TABLE_SCHEMA, TABLE_NAME,
+           MD5(GROUP_CONCAT(CONCAT_WS(',', {0}) ORDER BY ORDINAL_POSITION SEPARATOR '\\n'))
+    FROM information_schema.columns
+    WHERE TABLE_SCHEMA NOT IN ('mysql', 'information_schema', 'performance_schema', 'sys')
+    GROUP BY TABLE_SCHEMA, TABLE_NAME
+""".format(', '.join('QUOTE({0})'.format(column_key) for column_key in TABLE_COLUMN_KEYS))
+# 避免字段很多的表汇总结果被截断
+GROUP_CONCAT_MAX_LEN = 4294967295
+DDL_QUERY_PATTERN = re.compile(r'^\s*(ALTER|CREATE|DROP|RENAME|TRUNCATE)\b', re.I)
+DDL_TABLE_PATTERN = re.compile(
+    r'^\s*(?:ALTER|CREATE|DROP|TRUNCATE)\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?'
+    r'(`[^`]+`|\w+)(?:\.(`[^`]+`|\w+))?\s*(?:$|[\s(;])', re.I)
+DDL_DATABASE_PATTERN = re.compile(
+    r'^\s*(?:ALTER|CREATE|DROP)\s+(?:DATABASE|SCHEMA)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(`[^`]+`|\w+)', re.I)
+LEADING_COMMENT_PATTERN = re.compile(r'^\s*(/\*.*?\*/\s*)+', re.S)
+
+
+def get_ddl_table(query, default_schema):
+    """
+    从DDL语句中解析被修改的表
+    :param query:
+    :param default_schema:
+    :return: (schema, table)，不是DDL时返回None，无法解析出单个表时table为None
+    """
+    query = LEADING_COMMENT_PATTERN.sub('', query)
+    if not DDL_QUERY_PATTERN.match(query):
+        return None
+    match = DDL_DATABASE_PATTERN.match(query)
+    if match:
+        return match.group(1).strip('`'), None
+    match = DDL_TABLE_PATTERN.match(query)
+    if not match:
+        return default_schema, None
+    first_name, second_name = [name.strip('`') if name else name for name in match.groups()]
+    if second_name:
+        return first_name, second_name
+    return default_schema, first_name
+
+
+class TableMetadataCache(object):
+    """
+    按实例保存在磁盘上的表元数据缓存，缓存项包含表结构版本，与实例上的版本不一致时重新查询information_schema。
+    读取线程查询和删除缓存，解析线程在断点处保存缓存，对缓存的访问通过lock互斥
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.tables = dict()
+        self.fingerprints = dict()
+        self.invalidated_tables = set()
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.exists(cache_file):
+            with open(cache_file, "r", encoding='utf-8') as f_cache:
+                self.tables = json.load(f_cache)
+
+    def load_fingerprints(self, cursor):
+        """
+        一次查询获取所有表的结构版本
+        :param cursor:
+        :return:
+        """
+        cursor.execute("SET SESSION group_concat_max_len = %d" % GROUP_CONCAT_MAX_LEN)
+        cursor.execute(TABLE_FINGERPRINT_QUERY)
+        for schema, table, fingerprint in cursor.fetchall():
+            self.fingerprints[get_table_key(schema, table)] = fingerprint
+
+    def get_table_information(self, schema, table, loader):
+        """
+        返回表的字段信息，缓存失效时通过loader查询
+        :param schema:
+        :param table:
+        :param loader: 查询information_schema的函数
+        :return:
+        """
+        table_key = get_table_key(schema, table)
+        with self.lock:
+            fingerprint = self.fingerprints.get(table_key)
+            table_item = self.tables.get(table_key)
+        if fingerprint and table_item and table_item['fingerprint'] == fingerprint:
+            return table_item['columns']
+        columns = [{key: column[key] for key in TABLE_COLUMN_KEYS} for column in loader(schema, table)]
+        if fingerprint and columns:
+            with self.lock:
+                self.tables[table_key] = {'fingerprint': fingerprint, 'columns': columns}
+                self.invalidated_tables.discard(table_key)
+                self.dirty = True
+        return columns
+
+    def invalidate(self, schema, table=None):
+        """
+        删除表的缓存，table为None时删除整个库的缓存
+        """
+        with self.lock:
+            if table is not None:
+                table_keys = [get_table_key(schema, table)]
+            else:
+                table_keys = [table_key for table_key in self.tables if table_key.startswith(schema + '.')]
+            for table_key in table_keys:
+                self.fingerprints.pop(table_key, None)
+                if self.tables.pop(table_key, None) is not None:
+                    self.invalidated_tables.add(table_key)
+                    self.dirty = True
+
+    def invalidate_query(self, query_event):
+        """
+        遇到DDL语句时删除对应表的缓存
+        :param query_event:
+        :return:
+        """
+        ddl_table = get_ddl_table(query_event.query, query_event.schema.decode('utf-8', 'ignore'))
+        if ddl_table is not None:
+            self.invalidate(*ddl_table)
+
+    def save(self):
+        """
+        与磁盘上的缓存合并后保存，并行解析时多个进程会写同一个缓存文件
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            tables = dict()
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, "r", encoding='utf-8') as f_cache:
+                    tables = json.load(f_cache)
+            for table_key in self.invalidated_tables:
+                tables.pop(table_key, None)
+            tables.update(self.tables)
+            tmp_cache_file = "{0}.{1}.tmp".format(self.cache_file, os.getpid())
+            with open(tmp_cache_file, "w", encoding='utf-8') as f_cache:
+                json.dump(tables, f_cache, ensure_ascii=False)
+            os.replace(tmp_cache_file, self.cache_file)
+            self.dirty = False
+
+
+class CachedBinLogStreamReader(BinLogStreamReader):
+    """
+    TableMap事件需要的表字段信息优先从表元数据缓存中读取，table_metadata_cache为None时与BinLogStreamReader一致。
+    读取到DDL语句时立即删除对应表的缓存，之后的TableMap事件不会使用修改前的表结构
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.table_metadata_cache = kwargs.pop('table_metadata_cache', None)
+        super(CachedBinLogStreamReader, self).__init__(*args, **kwargs)
+
+    def fetchone(self):
+        binlog_event = super(CachedBinLogStreamReader, self).fetchone()
+        if self.table_metadata_cache is not None and isinstance(binlog_event, QueryEvent) \
+                and binlog_event.query != 'BEGIN':
+            self.table_metadata_cache.invalidate_query(binlog_event)
+        return binlog_event
+
+    def _BinLogStreamReader__get_table_information(self, schema, table):
+        loader = super(CachedBinLogStreamReader, self)._BinLogStreamReader__get_table_information
+        if self.table_metadata_cache is None:
+            return loader(schema, table)
+        return self.table_metadata_cache.get_table_information(schema, table, loader)
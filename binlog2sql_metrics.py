@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+import threading
+import collections
+from binlog2sql_util import event_type
+
+# read: 从事件源读取和解码事件，build: 生成SQL模板，format: 格式化字段值并生成SQL，write: 写入临时文件，
+# result: 生成执行脚本或回滚脚本
+METRICS_STAGES = ['read', 'build', 'format', 'write', 'result']
+METRICS_FORMATS = ['json', 'prometheus']
+PROMETHEUS_PREFIX = 'binlog2sql'
+
+
+def get_peak_rss():
+    """
+    :return: 峰值内存(KB)
+    """
+    try:
+        with open('/proc/self/status') as f_status:
+            for line in f_status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+class ProcessMetrics(object):
+    """
+    解析过程的计数器、各阶段耗时和binlog延迟
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        # {schema.table: {event_type: [事件数, 行数]}}
+        self.table_counters = dict()
+        self.event_count = 0
+        self.row_count = 0
+        self.bytes_written = 0
+        self.stage_seconds = dict.fromkeys(METRICS_STAGES, 0.0)
+        self.log_file = None
+        self.log_pos = None
+        self.event_timestamp = None
+        self.eof_file = None
+        self.eof_pos = None
+        self.binlog_sizes = dict()
+        # 并行进程的最大峰值内存(KB)
+        self.worker_peak_rss_kb = 0
+
+    def add_time(self, stage, seconds):
+        self.stage_seconds[stage] += seconds
+
+    def timed_iter(self, iterable, stage='read'):
+        """
+        统计迭代器每次返回元素的耗时，用于统计从事件源读取事件的时间
+        """
+        iterator = iter(iterable)
+        while True:
+            read_start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stage_seconds[stage] += time.perf_counter() - read_start
+                return
+            self.stage_seconds[stage] += time.perf_counter() - read_start
+            yield item
+
+    def observe_event(self, binlog_event, log_file, log_pos):
+        """
+        :param binlog_event:
+        :param log_file: 当前binlog文件
+        :param log_pos: 当前事件的结束位点
+        :return:
+        """
+        self.event_count += 1
+        self.log_file, self.log_pos = log_file, log_pos
+        if binlog_event.timestamp:
+            self.event_timestamp = binlog_event.timestamp
+
+    def observe_rows(self, binlog_event, row_count):
+        table_key = '{0}.{1}'.format(binlog_event.schema, binlog_event.table)
+        counter = self.table_counters.setdefault(table_key, dict()).setdefault(event_type(binlog_event), [0, 0])
+        counter[0] += 1
+        counter[1] += row_count
+        self.row_count += row_count
+
+    def set_binlog_eof(self, eof_file, eof_pos, binlog_sizes):
+        """
+        :param eof_file: SHOW MASTER STATUS返回的最新binlog文件
+        :param eof_pos: SHOW MASTER STATUS返回的最新位点
+        :param binlog_sizes: {binlog文件: 文件大小}
+        :return:
+        """
+        self.eof_file, self.eof_pos = eof_file, eof_pos
+        self.binlog_sizes = dict(binlog_sizes)
+
+    def get_lag(self):
+        """
+        :return: 当前解析位点落后于最新位点的(文件数, 字节数, 秒数)
+        """
+        if self.log_file is None or self.eof_file is None:
+            return None, None, None
+        binlog_files = sorted(self.binlog_sizes, key=lambda x: int(x.rsplit('.', 1)[1]))
+        lag_files, lag_bytes = 0, 0
+        if self.log_file in binlog_files and self.eof_file in binlog_files:
+            for binlog_file in binlog_files[binlog_files.index(self.log_file):binlog_files.index(self.eof_file) + 1]:
+                file_size = self.eof_pos if binlog_file == self.eof_file else self.binlog_sizes[binlog_file]
+                if binlog_file == self.log_file:
+                    file_size -= self.log_pos
+                else:
+                    lag_files += 1
+                lag_bytes += max(file_size, 0)
+        lag_seconds = max(0, int(time.time()) - self.event_timestamp) if self.event_timestamp else None
+        return lag_files, lag_bytes, lag_seconds
+
+    def merge(self, snapshot):
+        """
+        合并并行进程的统计结果
+        :param snapshot: 并行进程ProcessMetrics.snapshot()的返回值
+        :return:
+        """
+        for table_key, counters in snapshot['tables'].items():
+            for table_event_type, (table_events, table_rows) in counters.items():
+                counter = self.table_counters.setdefault(table_key, dict()).setdefault(table_event_type, [0, 0])
+                counter[0] += table_events
+                counter[1] += table_rows
+        self.event_count += snapshot['events']
+        self.row_count += snapshot['rows']
+        self.bytes_written += snapshot['bytes_written']
+        for stage, seconds in snapshot['stage_seconds'].items():
+            self.stage_seconds[stage] += seconds
+        if snapshot['log_file']:
+            self.log_file, self.log_pos = snapshot['log_file'], snapshot['log_pos']
+            self.event_timestamp = snapshot['event_timestamp']
+        self.worker_peak_rss_kb = max(self.worker_peak_rss_kb, snapshot.get('peak_rss_kb', 0))
+
+    def snapshot(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        lag_files, lag_bytes, lag_seconds = self.get_lag()
+        return {
+            'time': int(time.time()),
+            'elapsed': round(elapsed, 3),
+            'events': self.event_count,
+            'rows': self.row_count,
+            'bytes_written': self.bytes_written,
+            'events_per_sec': round(self.event_count / elapsed, 1),
+            'rows_per_sec': round(self.row_count / elapsed, 1),
+            'stage_seconds': {stage: round(seconds, 6) for stage, seconds in self.stage_seconds.items()},
+            'log_file': self.log_file,
+            'log_pos': self.log_pos,
+            'event_timestamp': self.event_timestamp,
+            'lag_files': lag_files,
+            'lag_bytes': lag_bytes,
+            'lag_seconds': lag_seconds,
+            'peak_rss_kb': max(get_peak_rss(), self.worker_peak_rss_kb),
+            'tables': {table_key: {table_event_type: list(counter) for table_event_type, counter in counters.items()}
+                       for table_key, counters in self.table_counters.items()},
+        }
+
+
+def format_prometheus_metrics(snapshot):
+    """
+    生成node_exporter textfile collector格式的指标
+    :param snapshot: ProcessMetrics.snapshot()的返回值
+    :return:
+    """
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        lines.append('# HELP {0}_{1} {2}'.format(PROMETHEUS_PREFIX, name, help_text))
+        lines.append('# TYPE {0}_{1} {2}'.format(PROMETHEUS_PREFIX, name, metric_type))
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join('{0}="{1}"'.format(key, str(label_value).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for key, label_value in labels)
+            lines.append('{0}_{1}{2} {3}'.format(PROMETHEUS_PREFIX, name,
+                                                  '{' + label_text + '}' if label_text else '', value))
+
+    add_metric('events_total', 'counter', 'Binlog events read.', [((), snapshot['events'])])
+    add_metric('rows_total', 'counter', 'Rows converted to sql.', [((), snapshot['rows'])])
+    add_metric('bytes_written_total', 'counter', 'Sql bytes written to the tmp file.',
+               [((), snapshot['bytes_written'])])
+    add_metric('events_per_second', 'gauge', 'Average events read per second.', [((), snapshot['events_per_sec'])])
+    add_metric('rows_per_second', 'gauge', 'Average rows converted per second.', [((), snapshot['rows_per_sec'])])
+    add_metric('stage_seconds_total', 'counter', 'Time spent in each stage.',
+               [((('stage', stage),), seconds) for stage, seconds in sorted(snapshot['stage_seconds'].items())])
+    table_events, table_rows = [], []
+    for table_key, counters in sorted(snapshot['tables'].items()):
+        for table_event_type, (events, rows) in sorted(counters.items()):
+            labels = (('table', table_key), ('type', table_event_type))
+            table_events.append((labels, events))
+            table_rows.append((labels, rows))
+    add_metric('table_events_total', 'counter', 'Rows events per table and type.', table_events)
+    add_metric('table_rows_total', 'counter', 'Rows per table and type.', table_rows)
+    add_metric('lag_files', 'gauge', 'Binlog files behind SHOW MASTER STATUS.', [((), snapshot['lag_files'])])
+    add_metric('lag_bytes', 'gauge', 'Binlog bytes behind SHOW MASTER STATUS.', [((), snapshot['lag_bytes'])])
+    add_metric('lag_seconds', 'gauge', 'Seconds between now and the last event timestamp.',
+               [((), snapshot['lag_seconds'])])
+    add_metric('peak_rss_bytes', 'gauge', 'Peak resident memory of the process and its workers.',
+               [((), snapshot['peak_rss_kb'] * 1024)])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """
+    定期导出统计结果，json格式每次追加一行，prometheus格式每次整体替换文件
+    """
+
+    def __init__(self, metrics_file, metrics_format='json', metrics_interval=10):
+        if metrics_format not in METRICS_FORMATS:
+            raise ValueError('unknown metrics format: %s' % metrics_format)
+        self.metrics_file = metrics_file
+        self.metrics_format = metrics_format
+        self.metrics_interval = metrics_interval
+        self.export_time = time.time()
+
+    def is_due(self):
+        return time.time() - self.export_time >= self.metrics_interval
+
+    def export(self, metrics):
+        snapshot = metrics.snapshot()
+        if self.metrics_format == 'json':
+            with open(self.metrics_file, "a", encoding='utf-8') as f_metrics:
+                f_metrics.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+        else:
+            tmp_metrics_file = "{0}.{1}.tmp".format(self.metrics_file, os.getpid())
+            with open(tmp_metrics_file, "w", encoding='utf-8') as f_metrics:
+                f_metrics.write(format_prometheus_metrics(snapshot))
+            os.replace(tmp_metrics_file, self.metrics_file)
+        self.export_time = time.time()
+
+
+class StackSampler(object):
+    """
+    采样分析器，后台线程定期采集指定线程的调用栈，输出flamegraph.pl可以处理的折叠栈格式
+    """
+
+    def __init__(self, profile_file, sample_interval=0.01, thread_id=None):
+        self.profile_file = profile_file
+        self.sample_interval = sample_interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='binlog2sql-sampler', daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.sample_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        with open(self.profile_file, "w", encoding='utf-8') as f_profile:
+            for stack, count in self.stacks.most_common():
+                f_profile.write('{0} {1}\n'.format(stack, count))
+
+
+class CProfileProfiler(object):
+    """
+    使用cProfile分析，结果保存为pstats文件
+    """
+
+    def __init__(self, profile_file):
+        self.profile_file = profile_file
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_file)
+
+
+def create_profiler(profile_file, sample_interval=0):
+    """
+    :param profile_file: 分析结果文件
+    :param sample_interval: 采样间隔(毫秒)，为0时使用cProfile
+    :return:
+    """
+    if sample_interval > 0:
+        return StackSampler(profile_file, sample_interval / 1000.0)
+    return CProfileProfiler(profile_file)
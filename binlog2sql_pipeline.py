@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+from importlib import metadata
+from pymysqlreplication.row_event import RowsEvent, WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+# 读取线程最多预读的事件数
+PIPELINE_QUEUE_EVENTS = 2000
+# 写入线程最多缓存的SQL批次数
+PIPELINE_QUEUE_BATCHES = 2
+PIPELINE_PUT_TIMEOUT = 0.1
+PIPELINE_JOIN_TIMEOUT = 1.0
+PIPELINE_END = object()
+# RowsEvent.rows属性读取的私有变量，为None时行数据还没有解码
+ROWS_EVENT_ROWS_ATTR = '_RowsEvent__rows'
+# 逐行解码依赖RowsEvent的私有实现(__rows、_fetch_one_row和packet.read_bytes)，只在验证过的版本上使用
+ROWS_EVENT_INTERNALS_VERSIONS = ('0.19',)
+
+
+def get_replication_version():
+    try:
+        return metadata.version('mysql-replication')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def check_rows_event_internals(version=None):
+    """
+    检查当前的pymysqlreplication是否可以逐行解码行事件和直接设置解码后的行数据
+    :param version: mysql-replication的版本，默认为已安装的版本
+    :return:
+    """
+    version = get_replication_version() if version is None else version
+    if version not in ROWS_EVENT_INTERNALS_VERSIONS or not all(
+            callable(getattr(event_class, '_fetch_one_row', None))
+            for event_class in (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+        return False
+    # rows属性已有值时直接返回，不再解码事件内容
+    probe_event = RowsEvent.__new__(RowsEvent)
+    probe_rows = []
+    probe_event.__dict__[ROWS_EVENT_ROWS_ATTR] = probe_rows
+    try:
+        return probe_event.rows is probe_rows
+    except Exception:
+        return False
+
+
+ROWS_EVENT_INTERNALS = check_rows_event_internals()
+
+
+def set_event_rows(binlog_event, rows):
+    """
+    为回放或构造的行事件设置解码后的行数据，之后读取rows属性时不再解码
+    """
+    if not ROWS_EVENT_INTERNALS:
+        raise NotImplementedError('setting decoded rows requires mysql-replication {0}, installed: {1}'.format(
+            ' or '.join(ROWS_EVENT_INTERNALS_VERSIONS), get_replication_version()))
+    binlog_event.__dict__[ROWS_EVENT_ROWS_ATTR] = rows
+
+
+def iter_event_rows(binlog_event):
+    """
+    逐行解码行事件，行数据不保存在事件中，同一时刻只有一行的解码结果在内存中；已经解码的事件直接返回解码结果。
+    逐行解码后事件中的行数据不能再次读取，只能由最后一个使用行数据的地方调用。
+    未验证的pymysqlreplication版本使用公开的rows属性一次解码全部行
+    """
+    if not ROWS_EVENT_INTERNALS:
+        yield from binlog_event.rows
+        return
+    rows = binlog_event.__dict__.get(ROWS_EVENT_ROWS_ATTR)
+    if rows is not None:
+        yield from rows
+        return
+    if not binlog_event.complete:
+        return
+    while binlog_event.packet.read_bytes < binlog_event.event_size:
+        yield binlog_event._fetch_one_row()
+
+
+class PipelineError(object):
+    """
+    后台线程中的异常，由消费线程重新抛出
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+class BinlogEventReader(object):
+    """
+    在后台线程中读取并解码binlog事件，通过有界队列按顺序交给解析线程，队列满时读取线程等待；
+    max_queue_events为0时在调用线程中直接读取
+    """
+
+    def __init__(self, stream, max_queue_events=PIPELINE_QUEUE_EVENTS, prefetch_rows=None, stage_timer=None,
+                 event_filter=None, max_queue_bytes=0):
+        """
+        :param stream: binlog事件源
+        :param max_queue_events:
+        :param max_queue_bytes: 队列中事件的总字节数上限，0表示只按事件数限制，至少可以缓存一个事件
+        :param prefetch_rows: 判断是否在读取线程中预先解码行事件的函数
+        :param stage_timer: 统计读取耗时的ProcessMetrics
+        :param event_filter: 按事件顺序对每个事件调用，返回False的事件直接丢弃
+        """
+        self.stream = stream
+        self.max_queue_events = max_queue_events
+        self.prefetch_rows = prefetch_rows
+        self.event_filter = event_filter
+        self.stage_timer = stage_timer
+        self.queue = queue.Queue(maxsize=max_queue_events) if max_queue_events > 0 else None
+        self.max_queue_bytes = max_queue_bytes
+        self.queued_bytes = 0
+        self.bytes_condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def iter_stream(self):
+        """
+        :return: (事件, 读取该事件后的binlog文件, 读取该事件后的位点)的迭代器
+        """
+        events = self.stage_timer.timed_iter(self.stream) if self.stage_timer is not None else self.stream
+        for binlog_event in events:
+            if self.event_filter is not None and not self.event_filter(binlog_event):
+                continue
+            yield binlog_event, self.stream.log_file, self.stream.log_pos
+
+    def run(self):
+        try:
+            for item in self.iter_stream():
+                if self.prefetch_rows is not None and isinstance(item[0], RowsEvent) and self.prefetch_rows(item[0]):
+                    item[0].rows
+                if not self.put(item):
+                    return
+            self.put(PIPELINE_END)
+        except Exception as ex:
+            if not self.stop_event.is_set():
+                self.put(PipelineError(ex))
+
+    @staticmethod
+    def get_item_bytes(item):
+        return item[0].packet.event_size if isinstance(item, tuple) else 0
+
+    def put(self, item):
+        if self.max_queue_bytes > 0:
+            item_bytes = self.get_item_bytes(item)
+            with self.bytes_condition:
+                while self.queued_bytes > 0 and self.queued_bytes + item_bytes > self.max_queue_bytes:
+                    if self.stop_event.is_set():
+                        return False
+                    self.bytes_condition.wait(PIPELINE_PUT_TIMEOUT)
+                self.queued_bytes += item_bytes
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=PIPELINE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        if self.queue is None:
+            yield from self.iter_stream()
+            return
+        self.thread = threading.Thread(target=self.run, name='binlog2sql-reader', daemon=True)
+        self.thread.start()
+        while True:
+            item = self.queue.get()
+            if item is PIPELINE_END:
+                return
+            if isinstance(item, PipelineError):
+                raise item.error
+            if self.max_queue_bytes > 0:
+                with self.bytes_condition:
+                    self.queued_bytes -= self.get_item_bytes(item)
+                    self.bytes_condition.notify()
+            yield item
+
+    def close(self):
+        """
+        停止读取线程，读取线程阻塞在等待新事件时关闭事件源使其退出
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join(PIPELINE_JOIN_TIMEOUT)
+        if self.thread.is_alive():
+            self.stream.close()
+            self.thread.join(PIPELINE_JOIN_TIMEOUT)
+        self.thread = None
+
+
+class SqlBatchWriter(object):
+    """
+    在后台线程中按提交顺序写入SQL批次，队列满时提交线程等待；max_pending_batches为0时在调用线程中直接写入
+    """
+
+    def __init__(self, write_batch, max_pending_batches=PIPELINE_QUEUE_BATCHES):
+        """
+        :param write_batch: 写入一批SQL的函数
+        :param max_pending_batches:
+        """
+        self.write_batch = write_batch
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if max_pending_batches > 0:
+            self.queue = queue.Queue(maxsize=max_pending_batches)
+            self.thread = threading.Thread(target=self.run, name='binlog2sql-writer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            sql_list = self.queue.get()
+            try:
+                if sql_list is PIPELINE_END:
+                    return
+                if self.error is None:
+                    self.write_batch(sql_list)
+            except Exception as ex:
+                self.error = ex
+            finally:
+                self.queue.task_done()
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, sql_list):
+        """
+        :param sql_list: 提交后不能再修改
+        """
+        if self.queue is None:
+            self.write_batch(sql_list)
+            return
+        self.check_error()
+        self.queue.put(sql_list)
+
+    def sync(self):
+        """
+        等待已提交的批次全部写入
+        """
+        if self.queue is not None:
+            self.queue.join()
+        self.check_error()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(PIPELINE_END)
+            self.thread.join()
+            self.thread = None
+        self.check_error()
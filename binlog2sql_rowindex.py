@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+from types import SimpleNamespace
+from pymysqlreplication.event import RotateEvent
+from pymysqlreplication.row_event import RowsEvent, UpdateRowsEvent
+from binlog2sql_util import event_type
+from binlog2sql_util2 import SQL_TEMPLATE_CACHE
+
+# 内存中缓存的索引记录数，超过后写入sqlite文件
+ROW_INDEX_BATCH_ROWS = 10000
+# 并行解析时多个进程写入同一个索引文件，等待写锁的秒数
+ROW_INDEX_LOCK_TIMEOUT = 60
+ROW_INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS index_tables (
+        table_id INTEGER PRIMARY KEY,
+        schema_name TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        UNIQUE (schema_name, table_name)
+    );
+    CREATE TABLE IF NOT EXISTS index_files (
+        file_id INTEGER PRIMARY KEY,
+        log_file TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS row_changes (
+        table_id INTEGER NOT NULL,
+        row_key TEXT NOT NULL,
+        file_id INTEGER NOT NULL,
+        end_pos INTEGER NOT NULL,
+        start_pos INTEGER NOT NULL,
+        timestamp INTEGER,
+        event_type TEXT NOT NULL,
+        PRIMARY KEY (table_id, row_key, file_id, end_pos)
+    ) WITHOUT ROWID;
+"""
+# 重复解析同一范围时不重复记录
+ROW_INDEX_INSERT = """
+    INSERT OR IGNORE INTO row_changes (table_id, row_key, file_id, end_pos, start_pos, timestamp, event_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+ROW_INDEX_SELECT = """
+    SELECT f.log_file, c.start_pos, c.end_pos, c.timestamp, c.event_type
+    FROM row_changes c JOIN index_files f ON f.file_id = c.file_id
+    WHERE c.table_id = (SELECT table_id FROM index_tables WHERE schema_name = ? AND table_name = ?) AND c.row_key = ?
+"""
+
+
+def format_row_key(values):
+    """
+    :param values: 按主键顺序排列的主键字段值
+    :return: 索引中的行标识，多个主键字段用tab分隔
+    """
+    return '\t'.join(value.decode('utf-8', 'backslashreplace') if isinstance(value, bytes) else str(value)
+                     for value in values)
+
+
+def get_row_keys(binlog_event, row):
+    """
+    :return: 行变更涉及的行标识，UPDATE修改主键时同时返回修改前和修改后的行标识
+    """
+    primary_key_list = SQL_TEMPLATE_CACHE.get_primary_key_list(binlog_event.primary_key)
+    if isinstance(binlog_event, UpdateRowsEvent):
+        row_keys = [format_row_key([row['before_values'][primary_key] for primary_key in primary_key_list])]
+        after_row_key = format_row_key([row['after_values'][primary_key] for primary_key in primary_key_list])
+        if after_row_key != row_keys[0]:
+            row_keys.append(after_row_key)
+        return row_keys
+    return [format_row_key([row['values'][primary_key] for primary_key in primary_key_list])]
+
+
+class RowChangeIndex(object):
+    """
+    按(表, 主键)记录行变更所在的binlog文件、事务起始位点、事件结束位点、时间和类型，保存在sqlite文件中，
+    查询单行的历史变更时只需要读取这些事务。没有主键的表不记录。
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.connection = sqlite3.connect(index_file, timeout=ROW_INDEX_LOCK_TIMEOUT)
+        self.connection.executescript(ROW_INDEX_SCHEMA)
+        self.table_ids = dict()
+        self.file_ids = dict()
+        self.entries = []
+        self.row_count = 0
+
+    def get_table_id(self, schema, table):
+        table_id = self.table_ids.get((schema, table))
+        if table_id is None:
+            self.connection.execute("INSERT OR IGNORE INTO index_tables (schema_name, table_name) VALUES (?, ?)",
+                                    (schema, table))
+            table_id = self.connection.execute(
+                "SELECT table_id FROM index_tables WHERE schema_name = ? AND table_name = ?",
+                (schema, table)).fetchone()[0]
+            self.table_ids[(schema, table)] = table_id
+        return table_id
+
+    def get_file_id(self, log_file):
+        file_id = self.file_ids.get(log_file)
+        if file_id is None:
+            self.connection.execute("INSERT OR IGNORE INTO index_files (log_file) VALUES (?)", (log_file,))
+            file_id = self.connection.execute(
+                "SELECT file_id FROM index_files WHERE log_file = ?", (log_file,)).fetchone()[0]
+            self.file_ids[log_file] = file_id
+        return file_id
+
+    def add_event(self, binlog_event, log_file, e_start_pos):
+        """
+        :param binlog_event: 行事件，没有主键的表忽略
+        :param log_file: 事件所在的binlog文件
+        :param e_start_pos: 事务起始位点，查询时从该位点开始读取，保证行事件之前有对应的TableMap事件
+        :return:
+        """
+        if not binlog_event.primary_key:
+            return
+        table_id = self.get_table_id(binlog_event.schema, binlog_event.table)
+        file_id = self.get_file_id(log_file)
+        row_event_type = event_type(binlog_event)
+        end_pos = binlog_event.packet.log_pos
+        for row in binlog_event.rows:
+            for row_key in get_row_keys(binlog_event, row):
+                self.entries.append((table_id, row_key, file_id, end_pos, e_start_pos, binlog_event.timestamp,
+                                     row_event_type))
+        if len(self.entries) >= ROW_INDEX_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.entries:
+            self.connection.executemany(ROW_INDEX_INSERT, self.entries)
+            self.row_count += len(self.entries)
+            self.entries = []
+        self.connection.commit()
+
+    def find_changes(self, schema, table, row_key):
+        """
+        :return: [(binlog文件, 事务起始位点, 事件结束位点, 时间戳, 类型), ...]，按binlog顺序排列
+        """
+        changes = self.connection.execute(ROW_INDEX_SELECT, (schema, table, row_key)).fetchall()
+        return sorted(changes, key=lambda change: (int(change[0].rsplit('.', 1)[1]), change[2]))
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def make_rotate_event(log_file, log_pos):
+    """
+    构造切换到指定文件和位点的RotateEvent，使解析循环从该位点重新计算事务起始位点
+    """
+    binlog_event = RotateEvent.__new__(RotateEvent)
+    binlog_event.next_binlog, binlog_event.position = log_file, log_pos
+    binlog_event.timestamp = 0
+    binlog_event.packet = SimpleNamespace(log_pos=0, event_size=0)
+    return binlog_event
+
+
+class RowLookupStream(object):
+    """
+    按行变更索引只读取包含指定行变更的事务：每个事务从起始位点开始读取到最后一个相关行事件，
+    其他行事件不解码，相关行事件中只保留指定行的变更
+    """
+
+    def __init__(self, create_stream, changes, row_key):
+        """
+        :param create_stream: 从指定binlog文件和位点开始创建事件源的函数
+        :param changes: RowChangeIndex.find_changes()的返回值
+        :param row_key:
+        """
+        self.create_stream = create_stream
+        self.row_key = row_key
+        self.matched_events = set((log_file, end_pos) for log_file, _, end_pos, _, _ in changes)
+        # (binlog文件, 事务起始位点) -> 最后一个相关行事件的结束位点
+        self.ranges = dict()
+        for log_file, start_pos, end_pos, _, _ in changes:
+            range_key = (log_file, start_pos)
+            self.ranges[range_key] = max(self.ranges.get(range_key, 0), end_pos)
+        self.log_file, self.log_pos = changes[0][0], changes[0][1]
+        self.stream = None
+
+    def __iter__(self):
+        for (log_file, start_pos), end_pos in self.ranges.items():
+            self.stream = self.create_stream(log_file, start_pos)
+            self.log_file, self.log_pos = log_file, start_pos
+            yield make_rotate_event(log_file, start_pos)
+            for binlog_event in self.stream:
+                self.log_file, self.log_pos = self.stream.log_file, self.stream.log_pos
+                if isinstance(binlog_event, RowsEvent):
+                    if (self.log_file, self.log_pos) not in self.matched_events:
+                        continue
+                    binlog_event.rows[:] = [row for row in binlog_event.rows
+                                            if self.row_key in get_row_keys(binlog_event, row)]
+                yield binlog_event
+                if self.log_file != log_file or self.log_pos >= end_pos:
+                    break
+            self.close()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
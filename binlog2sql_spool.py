@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import bisect
+import shutil
+from binlog2sql_compress import get_block_codec_by_id
+
+# 数据文件中每条记录的长度前缀
+SPOOL_RECORD_HEADER = struct.Struct('<I')
+# 索引文件中每条记录的(数据文件偏移, 记录长度, 标识)
+SPOOL_INDEX_ENTRY = struct.Struct('<QIB')
+SPOOL_FLAG_NEW_TRANSACTION = 0x01
+SPOOL_INDEX_SUFFIX = '.idx'
+SPOOL_INDEX_READ_COUNT = 4096
+# 压缩时数据文件由独立压缩的块组成，块索引文件保存每个块的(原始数据偏移, 文件偏移, 压缩后大小, 原始大小)，
+# 记录索引中的偏移为原始数据中的偏移
+SPOOL_BLOCK_SUFFIX = '.blk'
+SPOOL_BLOCK_MAGIC = b'B2SB'
+SPOOL_BLOCK_HEADER = struct.Struct('<4sB3x')
+SPOOL_BLOCK_ENTRY = struct.Struct('<QQII')
+
+
+def get_spool_index_file(spool_file):
+    return spool_file + SPOOL_INDEX_SUFFIX
+
+
+def get_spool_block_file(spool_file):
+    return spool_file + SPOOL_BLOCK_SUFFIX
+
+
+def read_spool_block_file(block_file):
+    """
+    :param block_file:
+    :return: 压缩格式编号和块索引列表
+    """
+    with open(block_file, "rb") as f_block:
+        block_data = f_block.read()
+    magic, codec_id = SPOOL_BLOCK_HEADER.unpack_from(block_data)
+    if magic != SPOOL_BLOCK_MAGIC:
+        raise ValueError('invalid spool block file: %s' % block_file)
+    return codec_id, list(SPOOL_BLOCK_ENTRY.iter_unpack(block_data[SPOOL_BLOCK_HEADER.size:]))
+
+
+def get_spool_raw_size(spool_file):
+    """
+    返回临时文件未压缩时的数据大小
+    """
+    block_file = get_spool_block_file(spool_file)
+    if not os.path.exists(block_file):
+        return os.path.getsize(spool_file)
+    _, block_entries = read_spool_block_file(block_file)
+    if not block_entries:
+        return 0
+    raw_offset, _, _, raw_size = block_entries[-1]
+    return raw_offset + raw_size
+
+
+def remove_spool(spool_file):
+    for file_path in (spool_file, get_spool_index_file(spool_file), get_spool_block_file(spool_file)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def truncate_spool(spool_file, record_count):
+    """
+    将临时文件截断到前record_count条记录，用于断点续传时丢弃断点之后写入的记录
+    :param spool_file:
+    :param record_count:
+    :return: 截断后数据文件的大小
+    """
+    index_file = get_spool_index_file(spool_file)
+    data_size = 0
+    if record_count > 0:
+        with open(index_file, "rb") as f_index:
+            f_index.seek((record_count - 1) * SPOOL_INDEX_ENTRY.size)
+            index_data = f_index.read(SPOOL_INDEX_ENTRY.size)
+        if len(index_data) < SPOOL_INDEX_ENTRY.size:
+            raise ValueError('spool file %s has less than %s records' % (spool_file, record_count))
+        offset, length, _ = SPOOL_INDEX_ENTRY.unpack(index_data)
+        data_size = offset + length
+    truncate_files = [(spool_file, data_size), (index_file, record_count * SPOOL_INDEX_ENTRY.size)]
+    block_file = get_spool_block_file(spool_file)
+    if os.path.exists(block_file):
+        _, block_entries = read_spool_block_file(block_file)
+        block_entries = [block_entry for block_entry in block_entries if block_entry[0] < data_size]
+        raw_end, file_end = 0, 0
+        if block_entries:
+            raw_offset, file_offset, compressed_size, raw_size = block_entries[-1]
+            raw_end, file_end = raw_offset + raw_size, file_offset + compressed_size
+        if raw_end != data_size:
+            raise ValueError('spool file %s can not be truncated inside a compressed block' % spool_file)
+        truncate_files = [(spool_file, file_end), truncate_files[1],
+                          (block_file, SPOOL_BLOCK_HEADER.size + len(block_entries) * SPOOL_BLOCK_ENTRY.size)]
+    for file_path, file_size in truncate_files:
+        with open(file_path, "ab") as f_spool:
+            f_spool.truncate(file_size)
+    return data_size
+
+
+class SqlSpoolWriter(object):
+    """
+    临时SQL文件的写入器，数据文件保存带长度前缀的记录，索引文件保存每条记录的偏移和事务边界
+    """
+
+    def __init__(self, spool_file, compressor=None):
+        """
+        :param spool_file:
+        :param compressor: OutputCompressor，指定压缩格式时数据文件按块压缩
+        """
+        self.spool_file = spool_file
+        self.f_data = open(spool_file, "ab")
+        self.f_index = open(get_spool_index_file(spool_file), "ab")
+        self.offset = self.f_data.tell()
+        self.record_count = self.f_index.tell() // SPOOL_INDEX_ENTRY.size
+        self.f_block = None
+        self.block_writer = None
+        if compressor is not None and compressor.codec is not None:
+            self.open_block_file(compressor)
+        elif os.path.exists(get_spool_block_file(spool_file)):
+            raise ValueError('spool file %s is compressed' % spool_file)
+
+    def open_block_file(self, compressor):
+        block_file = get_spool_block_file(self.spool_file)
+        if os.path.exists(block_file) and os.path.getsize(block_file) > 0:
+            codec_id, _ = read_spool_block_file(block_file)
+            if codec_id != compressor.codec.codec_id:
+                raise ValueError('spool file %s is compressed with another codec' % self.spool_file)
+            self.offset = get_spool_raw_size(self.spool_file)
+            self.f_block = open(block_file, "ab")
+        else:
+            if self.offset > 0:
+                raise ValueError('spool file %s is not compressed' % self.spool_file)
+            self.f_block = open(block_file, "ab")
+            self.f_block.write(SPOOL_BLOCK_HEADER.pack(SPOOL_BLOCK_MAGIC, compressor.codec.codec_id))
+        self.block_writer = compressor.create_block_writer(self.f_data, on_block_written=self.write_block_entry)
+        self.block_writer.raw_offset = self.offset
+
+    def write_block_entry(self, raw_offset, file_offset, compressed_size, raw_size):
+        self.f_block.write(SPOOL_BLOCK_ENTRY.pack(raw_offset, file_offset, compressed_size, raw_size))
+
+    def write(self, sql, new_transaction=False):
+        """
+        写入一条SQL记录
+        :param sql:
+        :param new_transaction: 该记录是否为新事务的第一条记录
+        :return:
+        """
+        self.write_record(sql.encode('utf-8'), SPOOL_FLAG_NEW_TRANSACTION if new_transaction else 0)
+
+    def write_record(self, data, flags):
+        if self.block_writer is not None:
+            # 记录不会跨越两个压缩块
+            self.block_writer.write(SPOOL_RECORD_HEADER.pack(len(data)) + data)
+        else:
+            self.f_data.write(SPOOL_RECORD_HEADER.pack(len(data)))
+            self.f_data.write(data)
+        self.f_index.write(SPOOL_INDEX_ENTRY.pack(self.offset + SPOOL_RECORD_HEADER.size, len(data), flags))
+        self.offset += SPOOL_RECORD_HEADER.size + len(data)
+        self.record_count += 1
+
+    def append_spool(self, spool_file):
+        """
+        将另一个临时文件的记录追加到当前文件末尾，用于合并并行解析的结果
+        :param spool_file:
+        :return:
+        """
+        if self.block_writer is not None:
+            self.block_writer.flush()
+        base_offset = self.offset
+        base_file_offset = self.f_data.tell()
+        part_raw_size = get_spool_raw_size(spool_file)
+        with open(spool_file, "rb") as f_part:
+            shutil.copyfileobj(f_part, self.f_data)
+        if self.block_writer is not None:
+            _, block_entries = read_spool_block_file(get_spool_block_file(spool_file))
+            for raw_offset, file_offset, compressed_size, raw_size in block_entries:
+                self.write_block_entry(base_offset + raw_offset, base_file_offset + file_offset,
+                                       compressed_size, raw_size)
+            self.block_writer.raw_offset = base_offset + part_raw_size
+            self.block_writer.file_offset = self.f_data.tell()
+        with open(get_spool_index_file(spool_file), "rb") as f_part_index:
+            while True:
+                index_data = f_part_index.read(SPOOL_INDEX_ENTRY.size * SPOOL_INDEX_READ_COUNT)
+                if not index_data:
+                    break
+                for offset, length, flags in SPOOL_INDEX_ENTRY.iter_unpack(index_data):
+                    self.f_index.write(SPOOL_INDEX_ENTRY.pack(base_offset + offset, length, flags))
+                    self.record_count += 1
+        self.offset = base_offset + part_raw_size
+
+    def flush(self):
+        """
+        将数据文件和索引文件刷到磁盘，保存断点前调用，压缩时缓存的数据作为一个完整的块写入
+        """
+        if self.block_writer is not None:
+            self.block_writer.flush()
+        for f_spool in (self.f_data, self.f_index, self.f_block):
+            if f_spool is not None:
+                f_spool.flush()
+                os.fsync(f_spool.fileno())
+
+    def close(self):
+        if self.block_writer is not None:
+            self.block_writer.flush()
+        self.f_data.close()
+        self.f_index.close()
+        if self.f_block is not None:
+            self.f_block.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SqlSpoolReader(object):
+    """
+    临时SQL文件的读取器，通过索引文件支持正序和倒序读取，压缩的数据文件每次解压一个块
+    """
+
+    def __init__(self, spool_file):
+        self.spool_file = spool_file
+        self.f_data = open(spool_file, "rb")
+        self.f_index = open(get_spool_index_file(spool_file), "rb")
+        self.record_count = os.fstat(self.f_index.fileno()).st_size // SPOOL_INDEX_ENTRY.size
+        self.codec = None
+        self.block_entries = []
+        self.block_raw_offsets = []
+        self.cached_block_index = -1
+        self.cached_block = b''
+        block_file = get_spool_block_file(spool_file)
+        if os.path.exists(block_file):
+            codec_id, self.block_entries = read_spool_block_file(block_file)
+            self.codec = get_block_codec_by_id(codec_id)
+            self.block_raw_offsets = [block_entry[0] for block_entry in self.block_entries]
+
+    def __len__(self):
+        return self.record_count
+
+    def iter_index(self, reverse=False):
+        """
+        按批读取索引，倒序读取时从索引文件末尾向前读取
+        """
+        if reverse:
+            end_index = self.record_count
+            while end_index > 0:
+                start_index = max(0, end_index - SPOOL_INDEX_READ_COUNT)
+                self.f_index.seek(start_index * SPOOL_INDEX_ENTRY.size)
+                index_data = self.f_index.read((end_index - start_index) * SPOOL_INDEX_ENTRY.size)
+                for index_entry in reversed(list(SPOOL_INDEX_ENTRY.iter_unpack(index_data))):
+                    yield index_entry
+                end_index = start_index
+        else:
+            self.f_index.seek(0)
+            while True:
+                index_data = self.f_index.read(SPOOL_INDEX_ENTRY.size * SPOOL_INDEX_READ_COUNT)
+                if not index_data:
+                    break
+                for index_entry in SPOOL_INDEX_ENTRY.iter_unpack(index_data):
+                    yield index_entry
+
+    def iter_records(self, reverse=False):
+        """
+        返回(SQL, 是否为新事务的第一条记录)
+        """
+        for offset, length, flags in self.iter_index(reverse=reverse):
+            yield self.read_data(offset, length).decode('utf-8'), bool(flags & SPOOL_FLAG_NEW_TRANSACTION)
+
+    def read_data(self, offset, length):
+        if self.codec is None:
+            self.f_data.seek(offset)
+            return self.f_data.read(length)
+        block_index = bisect.bisect_right(self.block_raw_offsets, offset) - 1
+        if block_index != self.cached_block_index:
+            _, file_offset, compressed_size, _ = self.block_entries[block_index]
+            self.f_data.seek(file_offset)
+            self.cached_block = self.codec.decompress(self.f_data.read(compressed_size))
+            self.cached_block_index = block_index
+        block_offset = offset - self.block_raw_offsets[block_index]
+        return self.cached_block[block_offset:block_offset + length]
+
+    def close(self):
+        self.f_data.close()
+        self.f_index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import bisect
+
+# 同一binlog文件中两个采样点之间的最小间隔字节数
+TIME_INDEX_SAMPLE_BYTES = 1048576
+# binlog中的事件时间并不严格递增，定位时向前多留出的秒数
+TIME_INDEX_SAFETY_SECONDS = 60
+
+
+class BinlogTimeIndex(object):
+    """
+    binlog文件位点与时间的稀疏索引，每个binlog文件在事务开始(BEGIN)处按间隔采样(位点, 时间戳)，
+    用于将--start-datetime转换为起始文件和位点，避免从--start-file开始逐个解析事件
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.files = dict()
+        self.dirty = False
+        if os.path.exists(index_file):
+            with open(index_file, "r", encoding='utf-8') as f_index:
+                self.files = json.load(f_index)
+
+    def add_sample(self, log_file, log_pos, timestamp):
+        """
+        添加采样点，与前后采样点的间隔小于TIME_INDEX_SAMPLE_BYTES时忽略，每个文件的第一个事务总是采样。
+        与前后采样点的时间先后矛盾时，说明文件名已被重新使用(如RESET MASTER)，丢弃该文件原有的采样点
+        :param log_file:
+        :param log_pos:
+        :param timestamp:
+        :return:
+        """
+        samples = self.files.setdefault(log_file, [])
+        sample_index = bisect.bisect_left(samples, [log_pos, -1])
+        if (sample_index > 0 and samples[sample_index - 1][1] > timestamp + TIME_INDEX_SAFETY_SECONDS) or \
+                (sample_index < len(samples) and samples[sample_index][1] < timestamp - TIME_INDEX_SAFETY_SECONDS):
+            del samples[:]
+            sample_index = 0
+            self.dirty = True
+        if sample_index < len(samples) and samples[sample_index][0] == log_pos:
+            return
+        if sample_index > 0:
+            if log_pos - samples[sample_index - 1][0] < TIME_INDEX_SAMPLE_BYTES:
+                return
+            if sample_index < len(samples) and samples[sample_index][0] - log_pos < TIME_INDEX_SAMPLE_BYTES:
+                return
+        samples.insert(sample_index, [log_pos, int(timestamp)])
+        self.dirty = True
+
+    def merge(self, files):
+        """
+        合并其他进程生成的采样点
+        :param files: {binlog文件: [[位点, 时间戳], ...]}
+        :return:
+        """
+        for log_file, samples in files.items():
+            for log_pos, timestamp in samples:
+                self.add_sample(log_file, log_pos, timestamp)
+
+    def prune(self, bin_index, binlog_sizes=None):
+        """
+        删除已经被清理的binlog文件的采样点；文件名被重新使用后，新文件比采样点的位点小时删除超出文件大小的采样点
+        :param bin_index: 现有的binlog文件
+        :param binlog_sizes: {binlog文件: 文件大小}
+        :return:
+        """
+        for log_file in list(self.files.keys()):
+            if log_file not in bin_index:
+                del self.files[log_file]
+                self.dirty = True
+            elif binlog_sizes and log_file in binlog_sizes:
+                samples = self.files[log_file]
+                sample_count = bisect.bisect_left(samples, [binlog_sizes[log_file], -1])
+                if sample_count < len(samples):
+                    del samples[sample_count:]
+                    self.dirty = True
+
+    def find_start_position(self, binlog_files, start_time, start_file, start_pos):
+        """
+        查找时间早于start_time的最后一个采样点
+        :param binlog_files: 按顺序排列的待解析binlog文件
+        :param start_time: 时间戳
+        :param start_file:
+        :param start_pos:
+        :return: (binlog文件, 位点)，没有可用的采样点时返回None
+        """
+        seek_time = start_time - TIME_INDEX_SAFETY_SECONDS
+        for log_file in reversed(binlog_files):
+            for log_pos, timestamp in reversed(self.files.get(log_file, [])):
+                if log_file == start_file and log_pos <= start_pos:
+                    break
+                if timestamp <= seek_time:
+                    return log_file, log_pos
+        return None
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_index_file = self.index_file + ".tmp"
+        with open(tmp_index_file, "w", encoding='utf-8') as f_index:
+            json.dump(self.files, f_index)
+        os.replace(tmp_index_file, self.index_file)
+        self.dirty = False
@@ -7,6 +7,7 @@ import argparse
 import datetime
 import getpass
 import json
+from time import perf_counter
 from contextlib import contextmanager
 from pymysqlreplication.event import QueryEvent
 from pymysqlreplication.row_event import (
@@ -14,7 +15,8 @@ from pymysqlreplication.row_event import (
     UpdateRowsEvent,
     DeleteRowsEvent,
 )
-from binlog2sql_util2 import SqlExecutePattern, SqlRollbackPattern, RowValueFormatter
+from binlog2sql_util2 import SqlExecutePattern, SqlRollbackPattern, SQL_VALUE_ESCAPER
+from binlog2sql_gtid import parse_gtid_set
 
 if sys.version > '3':
     PY3PLUS = True
@@ -31,19 +33,79 @@ def is_valid_datetime(string):
         return False
 
 
-def create_unique_file(filename):
+def is_valid_gtid_set(string):
+    try:
+        parse_gtid_set(string)
+        return True
+    except Exception as ex:
+        print(str(ex))
+        return False
+
+
+def get_log_dir(output_dir=None):
+    """
+    :param output_dir: 输出目录，默认为程序目录下的log目录
+    :return:
+    """
+    if output_dir:
+        log_dir = output_dir
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        log_dir = os.path.join(base_dir, "log")
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+
+def create_unique_file(filename, output_dir=None):
     filename = str(filename).replace(",", "_").replace("-", "_")
     dt_string = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    log_dir = os.path.join(base_dir, "log")
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+    log_dir = get_log_dir(output_dir)
     execute_sql_file = os.path.join(log_dir, "{0}_{1}_executed.sql".format(filename, dt_string))
     rollback_sql_file = os.path.join(log_dir, "{0}_{1}_rollback_[file_id].sql".format(filename, dt_string))
-    tmp_sql_file = os.path.join(log_dir, "{0}_{1}_tmp.sql".format(filename, dt_string))
+    tmp_sql_file = os.path.join(log_dir, "{0}_{1}_tmp.spool".format(filename, dt_string))
     return execute_sql_file, rollback_sql_file, tmp_sql_file
 
 
+def get_time_index_file(server_key, output_dir=None):
+    """
+    时间索引文件保存在输出目录下，按实例的server_uuid区分
+    :param server_key:
+    :param output_dir:
+    :return:
+    """
+    return os.path.join(get_log_dir(output_dir), "time_index_{0}.json".format(server_key))
+
+
+def get_table_metadata_cache_file(host, port, output_dir=None):
+    return os.path.join(get_log_dir(output_dir),
+                        "table_meta_{0}_{1}.json".format(str(host).replace(":", "_"), port))
+
+
+def get_checkpoint_file(tmp_sql_file):
+    return tmp_sql_file.replace("_tmp.spool", "_checkpoint.json")
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    """
+    先写入临时文件再替换，避免进程中断时留下不完整的断点文件
+    :param checkpoint_file:
+    :param checkpoint:
+    :return:
+    """
+    tmp_checkpoint_file = checkpoint_file + ".tmp"
+    with open(tmp_checkpoint_file, "w", encoding='utf-8') as f_checkpoint:
+        json.dump(checkpoint, f_checkpoint, indent=1)
+        f_checkpoint.flush()
+        os.fsync(f_checkpoint.fileno())
+    os.replace(tmp_checkpoint_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file):
+    with open(checkpoint_file, "r", encoding='utf-8') as f_checkpoint:
+        return json.load(f_checkpoint)
+
+
 def parse_args():
     """parse args for binlog2sql"""
 
@@ -69,6 +131,14 @@ def parse_args():
                           help="Start time. format %%Y-%%m-%%d %%H:%%M:%%S", default='')
     interval.add_argument('--stop-datetime', dest='stop_time', type=str,
                           help="Stop Time. format %%Y-%%m-%%d %%H:%%M:%%S;", default='')
+    interval.add_argument('--start-gtid-set', dest='start_gtid_set', type=str, default='',
+                          help="Start after this executed GTID set. Online it uses auto-position and "
+                               "ignores --start-file/--start-position")
+    interval.add_argument('--include-gtids', dest='include_gtids', type=str, default='',
+                          help="Only process transactions in this GTID set. Online it uses auto-position and "
+                               "ignores --start-file/--start-position")
+    interval.add_argument('--exclude-gtids', dest='exclude_gtids', type=str, default='',
+                          help="Skip transactions in this GTID set")
     parser.add_argument('--stop-never', dest='stop_never', action='store_true', default=False,
                         help="Continuously parse binlog. default: stop at the latest event when you start.")
     parser.add_argument('--help', dest='help', action='store_true', help='help information', default=False)
@@ -82,6 +152,9 @@ def parse_args():
     event = parser.add_argument_group('type filter')
     event.add_argument('--only-dml', dest='only_dml', action='store_true', default=False,
                        help='only print dml, ignore ddl')
+    event.add_argument('--freeze-schema', dest='freeze_schema', action='store_true', default=False,
+                       help='Parse the TableMap event of each table_id only once. Use it only when no DDL changes '
+                            'the tables in the binlog range, otherwise rows after the DDL are decoded wrongly')
     event.add_argument('--sql-type', dest='sql_type', type=str, nargs='*', default=['INSERT', 'UPDATE', 'DELETE'],
                        help='Sql type you want to process, support INSERT, UPDATE, DELETE.')
 
@@ -98,6 +171,106 @@ def parse_args():
                         help="Sleep time between chunks of 1000 rollback sql. set it to 0 if do not need sleep")
     parser.add_argument('--pseudo-thread-id', dest='pseudo_thread_id', type=int, default=0,
                         help="the thread id which run in master server")
+    parser.add_argument('--multi-row', dest='multi_row', action='store_true', default=False,
+                        help="Merge continuous rows of the same table into multi-row INSERT or DELETE ... IN statement")
+    parser.add_argument('--max-statement-bytes', dest='max_statement_bytes', type=int, default=0,
+                        help="Max bytes of a multi-row statement. default: derived from max_allowed_packet")
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help="Number of processes to parse binlog files in parallel, one binlog file per process")
+
+    local = parser.add_argument_group('local binlog')
+    local.add_argument('--binlog-dir', dest='binlog_dir', type=str, default='',
+                       help='Parse binlog files in this directory instead of connecting to mysql server')
+    local.add_argument('--schema-file', dest='schema_file', type=str, default='',
+                       help='Table schema snapshot file used with --binlog-dir')
+    local.add_argument('--dump-schema', dest='dump_schema', action='store_true', default=False,
+                       help='Dump table schema snapshot of mysql server to --schema-file and exit')
+
+    parser.add_argument('--output-dir', dest='output_dir', type=str, default='',
+                        help="Directory of the output files, checkpoints and caches. default: the log directory "
+                             "next to binlog2sql.py")
+    parser.add_argument('--table-cache', dest='table_cache', action='store_true', default=False,
+                        help="Use and update the on-disk table metadata cache in the output directory")
+    parser.add_argument('--time-index', dest='time_index', action='store_true', default=False,
+                        help="Use and update the on-disk binlog time index for --start-datetime")
+
+    parser.add_argument('--compress', dest='compress', type=str, default='none', choices=['none', 'gzip', 'zstd'],
+                        help="Compress the output files and the tmp file. zstd requires the zstandard package")
+    parser.add_argument('--compress-workers', dest='compress_workers', type=int, default=0,
+                        help="Number of compression threads. default: cpu count")
+    parser.add_argument('--no-pipeline', dest='pipeline', action='store_false', default=True,
+                        help="Read events, generate sql and write the tmp file in one thread instead of "
+                             "a reader thread and a writer thread connected by bounded queues")
+    parser.add_argument('--compact', dest='compact', action='store_true', default=False,
+                        help="With --flashback, merge all changes of a row (by primary key) in the window into "
+                             "one net rollback statement. Tables without primary key are not merged")
+    parser.add_argument('--compact-memory-rows', dest='compact_memory_rows', type=int, default=100000,
+                        help="Rows kept in memory by --compact before spilling to a sqlite file. default: 100000")
+    parser.add_argument('--hex-blob-threshold', dest='hex_blob_threshold', type=int, default=0,
+                        help="Binary values of at least this many bytes are written as X'...' hex literals "
+                             "without trying to decode them first. default: 0, always try to decode")
+    parser.add_argument('--memory-budget', dest='memory_budget', type=int, default=0,
+                        help="Approximate memory budget in MB for buffered events and sql. Rows events are decoded "
+                             "row by row and sql is written to the tmp file by bytes instead of statement count. "
+                             "default: 0, no budget")
+    parser.add_argument('--load-data', dest='load_data', type=str, choices=['tsv', 'csv'], default=None,
+                        help="With --flashback --sql-type DELETE, write deleted rows to per-table tsv/csv files "
+                             "and a LOAD DATA script instead of INSERT statements")
+
+    metrics = parser.add_argument_group('metrics')
+    metrics.add_argument('--metrics-file', dest='metrics_file', type=str, default=None,
+                         help="Export counters, stage timings and binlog lag to this file instead of printing "
+                              "progress")
+    metrics.add_argument('--metrics-format', dest='metrics_format', type=str, choices=['json', 'prometheus'],
+                         default='json',
+                         help="json appends one JSON line per export, prometheus rewrites a textfile for "
+                              "node_exporter. default: json")
+    metrics.add_argument('--metrics-interval', dest='metrics_interval', type=int, default=10,
+                         help="Seconds between metrics exports. default: 10")
+    metrics.add_argument('--profile', dest='profile', type=str, default=None,
+                         help="Profile the binlog processing and write the result to this file, "
+                              "pstats format with cProfile, folded stacks with --profile-sample-interval")
+    metrics.add_argument('--profile-sample-interval', dest='profile_sample_interval', type=int, default=0,
+                         help="Use a sampling profiler with this interval in milliseconds instead of cProfile")
+
+    row_index = parser.add_argument_group('row index')
+    row_index.add_argument('--row-index', dest='row_index', type=str, default=None,
+                           help="Sqlite file recording the binlog position of each changed row by table and "
+                                "primary key while parsing; with --lookup-key, the index to look up")
+    row_index.add_argument('--lookup-table', dest='lookup_table', type=str, default=None,
+                           help="Table of the row to look up in --row-index, as schema.table")
+    row_index.add_argument('--lookup-key', dest='lookup_key', type=str, nargs='*', default=None,
+                           help="Primary key values of the row to look up, in primary key column order. Only the "
+                                "transactions changing this row are read and only sql of this row is generated")
+
+    event_spool = parser.add_argument_group('event spool')
+    event_spool.add_argument('--event-spool', dest='event_spool', type=str, default=None,
+                             help="Save the decoded events read in this run to this file, so later runs over the "
+                                  "same range can use --replay-event-spool")
+    event_spool.add_argument('--replay-event-spool', dest='replay_event_spool', type=str, default=None,
+                             help="Read decoded events from a file saved by --event-spool instead of the server or "
+                                  "--binlog-dir. default range: the whole file")
+
+    checkpoint = parser.add_argument_group('checkpoint')
+    checkpoint.add_argument('--checkpoint-interval', dest='checkpoint_interval', type=int, default=0,
+                            help='Seconds between checkpoints saved next to the output files. default: 0, disabled')
+    checkpoint.add_argument('--resume', dest='resume', type=str, default='',
+                            help='Resume from the checkpoint file of an interrupted run, with the same other arguments')
+
+    apply = parser.add_argument_group('apply')
+    apply.add_argument('--apply', dest='apply', action='store_true', default=False,
+                       help='Execute the generated sql (or rollback sql with --flashback) on the target server')
+    apply.add_argument('--apply-host', dest='apply_host', type=str, default='',
+                       help='Host of the target server. default: same as --host')
+    apply.add_argument('--apply-port', dest='apply_port', type=int, default=0,
+                       help='Port of the target server. default: same as --port')
+    apply.add_argument('--apply-batch-size', dest='apply_batch_size', type=int, default=1000,
+                       help='Number of sql committed in one transaction, only split at transaction boundary. '
+                            'sleep --back-interval between batches')
+    apply.add_argument('--apply-max-lag', dest='apply_max_lag', type=int, default=0,
+                       help='Pause applying while replication lag of --apply-replicas exceeds this many seconds')
+    apply.add_argument('--apply-replicas', dest='apply_replicas', type=str, nargs='*', default=[],
+                       help='Replicas checked for replication lag, in host:port format')
     return parser
 
 
@@ -108,16 +281,64 @@ def command_line_args(args):
     if args.help or need_print_help:
         parser.print_help()
         sys.exit(1)
-    if not args.start_file:
+    if args.dump_schema:
+        if not args.schema_file:
+            raise ValueError('Lack of parameter: schema_file')
+    elif not args.start_file and not args.lookup_key and not args.replay_event_spool and \
+            (args.binlog_dir or not (args.start_gtid_set or args.include_gtids)):
         raise ValueError('Lack of parameter: start_file')
+    for gtid_set in (args.start_gtid_set, args.include_gtids, args.exclude_gtids):
+        if gtid_set and not is_valid_gtid_set(gtid_set):
+            raise ValueError('Incorrect gtid set argument')
+    if args.binlog_dir and not args.schema_file:
+        raise ValueError('Lack of parameter: schema_file')
+    if args.workers > 1 and args.stop_never:
+        raise ValueError('Only one of workers or stop-never can be set')
+    if args.binlog_dir and args.stop_never:
+        raise ValueError('Only one of binlog-dir or stop-never can be set')
     if args.flashback and args.stop_never:
         raise ValueError('Only one of flashback or stop-never can be True')
+    if args.resume and not os.path.exists(args.resume):
+        raise ValueError('checkpoint file %s not exists' % args.resume)
+    if args.apply and args.stop_never:
+        raise ValueError('Only one of apply or stop-never can be set')
+    if args.compact and (not args.flashback or args.load_data or args.resume):
+        raise ValueError('compact requires --flashback, and can not be used with --load-data or --resume')
+    if (args.lookup_table or args.lookup_key) and not (args.lookup_table and args.lookup_key and args.row_index):
+        raise ValueError('lookup-table and lookup-key must be set together with row-index')
+    if args.lookup_table and '.' not in args.lookup_table:
+        raise ValueError('Incorrect lookup-table argument, should be schema.table')
+    if args.lookup_key and not os.path.exists(args.row_index):
+        raise ValueError('row index file %s not exists' % args.row_index)
+    if args.lookup_key and (args.resume or args.stop_never or args.start_gtid_set or args.include_gtids or
+                            args.exclude_gtids):
+        raise ValueError('lookup-key can not be used with --resume, --stop-never or gtid sets')
+    if args.replay_event_spool and not os.path.exists(args.replay_event_spool):
+        raise ValueError('event spool file %s not exists' % args.replay_event_spool)
+    if args.replay_event_spool and (args.binlog_dir or args.stop_never or args.event_spool):
+        raise ValueError('replay-event-spool can not be used with --binlog-dir, --stop-never or --event-spool')
+    if args.event_spool and (args.resume or args.stop_never):
+        raise ValueError('event-spool can not be used with --resume or --stop-never')
+    if args.memory_budget < 0:
+        raise ValueError('Incorrect memory-budget argument')
+    if args.hex_blob_threshold < 0:
+        raise ValueError('Incorrect hex-blob-threshold argument')
+    if args.compact_memory_rows < 1:
+        raise ValueError('Incorrect compact-memory-rows argument')
+    if args.metrics_interval < 1 or args.profile_sample_interval < 0:
+        raise ValueError('Incorrect metrics-interval or profile-sample-interval argument')
+    if args.apply_batch_size < 1:
+        raise ValueError('Incorrect apply-batch-size argument')
+    if args.load_data and (not args.flashback or args.sql_type != ['DELETE'] or args.apply):
+        raise ValueError('load-data requires --flashback and --sql-type DELETE, and can not be used with --apply')
     if args.flashback and args.no_pk:
         raise ValueError('Only one of flashback or no_pk can be True')
     if (args.start_time and not is_valid_datetime(args.start_time)) or \
             (args.stop_time and not is_valid_datetime(args.stop_time)):
         raise ValueError('Incorrect datetime argument')
-    if not args.password:
+    if (args.binlog_dir or args.replay_event_spool) and not args.apply:
+        args.password = ''
+    elif not args.password:
         args.password = getpass.getpass()
     else:
         args.password = args.password[0]
@@ -161,10 +382,10 @@ def event_type(event):
     return t
 
 
-def concat_sql_from_binlog_event(cursor, binlog_event, row=None,
+def concat_sql_from_binlog_event(binlog_event, row=None,
                                  e_start_pos=None, flashback=False,
                                  no_pk=False, rollback_with_primary_key=False,
-                                 rollback_with_changed_value=False):
+                                 rollback_with_changed_value=False, escaper=SQL_VALUE_ESCAPER, stage_timer=None):
     if flashback and no_pk:
         raise ValueError('only one of flashback or no_pk can be True')
     if not (isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent)
@@ -174,27 +395,98 @@ def concat_sql_from_binlog_event(cursor, binlog_event, row=None,
     sql = ''
     if isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent) \
             or isinstance(binlog_event, DeleteRowsEvent):
+        build_start = perf_counter() if stage_timer else 0
         pattern = generate_sql_pattern(
             binlog_event, row=row,
             flashback=flashback,no_pk=no_pk,
             rollback_with_primary_key=rollback_with_primary_key,
             rollback_with_changed_value=rollback_with_changed_value
         )
-        new_values_list = []
-        for value_item in pattern['values']:
-            new_values_list.append(RowValueFormatter.format_row_value(value_item))
-        pattern['values'] = new_values_list
-        sql = sql + cursor.mogrify(pattern['template'], pattern['values'])
+        if stage_timer:
+            format_start = perf_counter()
+            stage_timer.add_time('build', format_start - build_start)
+        converters = escaper.get_column_converters(binlog_event)
+        sql = sql + pattern['template'] % escaper.convert_values(converters, pattern['columns'], pattern['values'])
         time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
         sql = '### start %s end %s time %s' % (e_start_pos, binlog_event.packet.log_pos, time) + '\n' + sql
+        if stage_timer:
+            stage_timer.add_time('format', perf_counter() - format_start)
     elif flashback is False and isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN' \
             and binlog_event.query != 'COMMIT':
         if binlog_event.schema:
-            sql = 'USE {0};\n'.format(binlog_event.schema)
+            # QueryEvent中的库名为bytes，需要解码后加反引号，生成的USE语句才能直接执行
+            sql = 'USE `{0}`;\n'.format(fix_object(binlog_event.schema).replace('`', '``'))
         sql += '{0};'.format(fix_object(binlog_event.query))
     return sql
 
 
+class MultiRowSqlMerger(object):
+    """
+    将同一事务中连续的同表同类型行合并为多行语句，单条语句大小不超过max_statement_bytes
+    """
+
+    def __init__(self, max_statement_bytes, flashback=False, no_pk=False, rollback_with_primary_key=False,
+                 escaper=SQL_VALUE_ESCAPER, stage_timer=None):
+        self.max_statement_bytes = max_statement_bytes
+        self.flashback = flashback
+        self.no_pk = no_pk
+        self.rollback_with_primary_key = rollback_with_primary_key
+        self.escaper = escaper
+        self.stage_timer = stage_timer
+        self.pattern = None
+        self.row_sql_list = []
+        self.statement_bytes = 0
+        self.start_info = None
+        self.end_pos = None
+
+    def add_row(self, binlog_event, row, e_start_pos=None):
+        """
+        添加一行数据，返回因合并完成而生成的语句列表；该行无法合并时返回None
+        """
+        build_start = perf_counter() if self.stage_timer else 0
+        if self.flashback is True:
+            sql_pattern = SqlRollbackPattern(binlog_event=binlog_event, row=row, flashback=self.flashback,
+                                             rollback_with_primary_key=self.rollback_with_primary_key)
+        else:
+            sql_pattern = SqlExecutePattern(binlog_event=binlog_event, row=row, no_pk=self.no_pk)
+        pattern = sql_pattern.get_multi_row_pattern()
+        if pattern is None:
+            return None
+        if self.stage_timer:
+            format_start = perf_counter()
+            self.stage_timer.add_time('build', format_start - build_start)
+        converters = self.escaper.get_column_converters(binlog_event)
+        row_sql = pattern['row_template'] % self.escaper.convert_values(converters, pattern['columns'],
+                                                                         pattern['values'])
+        row_bytes = len(row_sql.encode('utf-8')) + len(pattern['separator'])
+        sql_list = []
+        if self.pattern is not None and (self.pattern['prefix'] != pattern['prefix']
+                                         or self.statement_bytes + row_bytes > self.max_statement_bytes):
+            sql_list.extend(self.flush())
+        if self.pattern is None:
+            self.pattern = pattern
+            self.statement_bytes = len(pattern['prefix'].encode('utf-8')) + len(pattern['suffix'])
+            self.start_info = (e_start_pos, datetime.datetime.fromtimestamp(binlog_event.timestamp))
+        self.row_sql_list.append(row_sql)
+        self.statement_bytes += row_bytes
+        self.end_pos = binlog_event.packet.log_pos
+        if self.stage_timer:
+            self.stage_timer.add_time('format', perf_counter() - format_start)
+        return sql_list
+
+    def flush(self):
+        """
+        输出当前合并中的语句
+        """
+        if self.pattern is None:
+            return []
+        sql = self.pattern['prefix'] + self.pattern['separator'].join(self.row_sql_list) + self.pattern['suffix']
+        sql = '### start %s end %s time %s' % (self.start_info[0], self.end_pos, self.start_info[1]) + '\n' + sql
+        self.pattern = None
+        self.row_sql_list = []
+        return [sql]
+
+
 def generate_sql_pattern(binlog_event, row=None,
                          flashback=False, no_pk=False,
                          rollback_with_primary_key=False,
@@ -6,6 +6,10 @@ import argparse
 import datetime
 import getpass
 import json
+import decimal
+from collections import OrderedDict
+from pymysql.charset import charset_to_encoding
+from pymysqlreplication.constants import FIELD_TYPE
 from pymysqlreplication.event import QueryEvent
 from pymysqlreplication.row_event import (
     WriteRowsEvent,
@@ -13,18 +17,47 @@ from pymysqlreplication.row_event import (
     DeleteRowsEvent,
 )
 
+MAX_TEMPLATE_CACHE_SIZE = 4096
+# 不小于该字节数的二进制字段值直接输出为十六进制字面量，不再尝试按字符集解码，0表示先尝试解码
+DEFAULT_HEX_BLOB_THRESHOLD = 0
 
-class SQLPatternHelper(object):
-    @staticmethod
-    def fix_object(value):
-        """Fixes python objects so that they can be properly inserted into SQL queries"""
-        if isinstance(value, set):
-            value = ','.join(value)
-        if isinstance(value, bytes):
-            return value.decode('utf-8')
+
+class SqlTemplateCache(object):
+    """
+    按(库, 表, 语句类型, 字段列表, NULL标识, 参数)缓存SQL模板，超过容量时淘汰最久未使用的模板
+    """
+
+    def __init__(self, max_size=MAX_TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.primary_keys = dict()
+
+    def get_template(self, cache_key, build_template):
+        template = self.templates.get(cache_key)
+        if template is None:
+            template = build_template()
+            self.templates[cache_key] = template
+            if len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
         else:
-            return value
+            self.templates.move_to_end(cache_key)
+        return template
+
+    def get_primary_key_list(self, primary_key):
+        primary_key_list = self.primary_keys.get(primary_key)
+        if primary_key_list is None:
+            if type(primary_key) == tuple:
+                primary_key_list = [str(primary_key_item) for primary_key_item in primary_key]
+            else:
+                primary_key_list = [str(primary_key)]
+            self.primary_keys[primary_key] = primary_key_list
+        return primary_key_list
 
+
+SQL_TEMPLATE_CACHE = SqlTemplateCache()
+
+
+class SQLPatternHelper(object):
     @staticmethod
     def compare_items(items):
         # caution: if v is NULL, may need to process
@@ -34,6 +67,22 @@ class SQLPatternHelper(object):
         else:
             return '`%s`=%%s' % k
 
+    @staticmethod
+    def get_null_mask(values):
+        return tuple(value is None for value in values)
+
+    @staticmethod
+    def get_multi_row_insert_pattern(pattern):
+        """
+        将单行INSERT模板拆分为多行INSERT的语句前缀和单行VALUES模板
+        """
+        prefix, row_template = SQL_TEMPLATE_CACHE.get_template(
+            ('multi_row_insert', pattern['template']),
+            lambda: pattern['template'][:-1].split(' VALUES ', 1)
+        )
+        return {'prefix': prefix + ' VALUES ', 'row_template': row_template, 'separator': ', ', 'suffix': ';',
+                'columns': pattern['columns'], 'values': pattern['values']}
+
 
 class SqlExecutePattern(object):
     def __init__(self, binlog_event,
@@ -59,8 +108,11 @@ class SqlExecutePattern(object):
         else:
             return None
 
-    def fix_object(self, value):
-        return SQLPatternHelper.fix_object(value)
+    def get_multi_row_pattern(self):
+        if isinstance(self.binlog_event, WriteRowsEvent):
+            return SQLPatternHelper.get_multi_row_insert_pattern(self.get_insert_pattern())
+        else:
+            return None
 
     def compare_items(self, items):
         return SQLPatternHelper.compare_items(items)
@@ -68,35 +120,45 @@ class SqlExecutePattern(object):
     def get_insert_pattern(self):
         if self.no_pk and self.binlog_event.primary_key:
             self.row['values'].pop(self.binlog_event.primary_key)
-        template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-            self.binlog_event.schema, self.binlog_event.table,
-            ', '.join(map(lambda key: '`%s`' % key, self.row['values'].keys())),
-            ', '.join(['%s'] * len(self.row['values']))
+        columns = tuple(self.row['values'].keys())
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('execute_insert', self.binlog_event.schema, self.binlog_event.table, columns),
+            lambda: 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
+                self.binlog_event.schema, self.binlog_event.table,
+                ', '.join(map(lambda key: '`%s`' % key, columns)),
+                ', '.join(['%s'] * len(columns))
+            )
         )
-        values = map(self.fix_object, self.row['values'].values())
-        return {'template': template, 'values': list(values)}
+        return {'template': template, 'columns': columns, 'values': list(self.row['values'].values())}
 
     def get_update_pattern(self):
-        template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-            self.binlog_event.schema, self.binlog_event.table,
-            ', '.join(['`%s`=%%s' % k for k in self.row['after_values'].keys()]),
-            ' AND '.join(map(self.compare_items, self.row['before_values'].items()))
-        )
-        values = map(
-            self.fix_object,
-            list(self.row['after_values'].values())
-            + list(self.row['before_values'].values())
+        set_columns = tuple(self.row['after_values'].keys())
+        where_items = self.row['before_values']
+        where_columns = tuple(where_items.keys())
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('execute_update', self.binlog_event.schema, self.binlog_event.table, set_columns, where_columns,
+             SQLPatternHelper.get_null_mask(where_items.values())),
+            lambda: 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
+                self.binlog_event.schema, self.binlog_event.table,
+                ', '.join(['`%s`=%%s' % k for k in set_columns]),
+                ' AND '.join(map(self.compare_items, where_items.items()))
+            )
         )
-        return {'template': template, 'values': list(values)}
+        values = list(self.row['after_values'].values()) + list(self.row['before_values'].values())
+        return {'template': template, 'columns': set_columns + where_columns, 'values': values}
 
     def get_delete_pattern(self):
-        template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-            self.binlog_event.schema,
-            self.binlog_event.table,
-            ' AND '.join(map(self.compare_items, self.row['values'].items()))
+        where_items = self.row['values']
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('execute_delete', self.binlog_event.schema, self.binlog_event.table, tuple(where_items.keys()),
+             SQLPatternHelper.get_null_mask(where_items.values())),
+            lambda: 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
+                self.binlog_event.schema,
+                self.binlog_event.table,
+                ' AND '.join(map(self.compare_items, where_items.items()))
+            )
         )
-        values = map(self.fix_object, self.row['values'].values())
-        return {'template': template, 'values': list(values)}
+        return {'template': template, 'columns': tuple(where_items.keys()), 'values': list(where_items.values())}
 
 
 class SqlRollbackPattern(object):
@@ -123,12 +185,36 @@ class SqlRollbackPattern(object):
         else:
             return None
 
-    def fix_object(self, value):
-        return SQLPatternHelper.fix_object(value)
-
     def compare_items(self, items):
         return SQLPatternHelper.compare_items(items)
 
+    def get_multi_row_pattern(self):
+        if isinstance(self.binlog_event, DeleteRowsEvent):
+            return SQLPatternHelper.get_multi_row_insert_pattern(self.get_delete_pattern())
+        elif isinstance(self.binlog_event, WriteRowsEvent) and self.rollback_with_primary_key is True \
+                and self.binlog_event.primary_key:
+            return self.get_multi_row_insert_rollback_pattern()
+        else:
+            return None
+
+    def get_multi_row_insert_rollback_pattern(self):
+        primary_key_list = self.get_primary_key_list()
+        prefix, row_template = SQL_TEMPLATE_CACHE.get_template(
+            ('multi_row_rollback_insert', self.binlog_event.schema, self.binlog_event.table,
+             tuple(primary_key_list)),
+            lambda: (
+                'DELETE FROM `{0}`.`{1}` WHERE {2} IN ('.format(
+                    self.binlog_event.schema, self.binlog_event.table,
+                    '`%s`' % primary_key_list[0] if len(primary_key_list) == 1
+                    else '(%s)' % ', '.join(map(lambda key: '`%s`' % key, primary_key_list))
+                ),
+                '%s' if len(primary_key_list) == 1 else '(%s)' % ', '.join(['%s'] * len(primary_key_list))
+            )
+        )
+        values = [self.row['values'][primary_key_item] for primary_key_item in primary_key_list]
+        return {'prefix': prefix, 'row_template': row_template, 'separator': ', ', 'suffix': ');',
+                'columns': primary_key_list, 'values': values}
+
     def get_diff_items(self):
         diff_items = dict()
         before_items = self.row['before_values']
@@ -139,13 +225,7 @@ class SqlRollbackPattern(object):
         return diff_items
 
     def get_primary_key_list(self):
-        primary_key_list = []
-        if type(self.binlog_event.primary_key) == tuple:
-            for primary_key_item in self.binlog_event.primary_key:
-                primary_key_list.append(str(primary_key_item))
-        else:
-            primary_key_list.append(str(self.binlog_event.primary_key))
-        return primary_key_list
+        return SQL_TEMPLATE_CACHE.get_primary_key_list(self.binlog_event.primary_key)
 
     def get_insert_pattern(self):
         if (self.rollback_with_primary_key is True) and (self.binlog_event.primary_key is not None):
@@ -155,12 +235,15 @@ class SqlRollbackPattern(object):
             where_items = primary_key_dict
         else:
             where_items = self.row['values']
-        template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-            self.binlog_event.schema, self.binlog_event.table,
-            ' AND '.join(map(self.compare_items, where_items.items()))
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('rollback_insert', self.binlog_event.schema, self.binlog_event.table, tuple(where_items.keys()),
+             SQLPatternHelper.get_null_mask(where_items.values())),
+            lambda: 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
+                self.binlog_event.schema, self.binlog_event.table,
+                ' AND '.join(map(self.compare_items, where_items.items()))
+            )
         )
-        values = map(self.fix_object, where_items.values())
-        return {'template': template, 'values': list(values)}
+        return {'template': template, 'columns': tuple(where_items.keys()), 'values': list(where_items.values())}
 
     def get_update_pattern(self):
         if self.rollback_with_changed_value is True:
@@ -176,63 +259,283 @@ class SqlRollbackPattern(object):
             where_items = primary_key_dict
         else:
             where_items = self.row['after_values']
-        template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-            self.binlog_event.schema, self.binlog_event.table,
-            ', '.join(['`%s`=%%s' % x for x in update_items.keys()]),
-            ' AND '.join(map(self.compare_items, where_items.items())))
-        values = map(self.fix_object, list(update_items.values()) + list(where_items.values()))
-        return {'template': template, 'values': list(values)}
+        set_columns = tuple(update_items.keys())
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('rollback_update', self.binlog_event.schema, self.binlog_event.table, set_columns,
+             tuple(where_items.keys()), SQLPatternHelper.get_null_mask(where_items.values())),
+            lambda: 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
+                self.binlog_event.schema, self.binlog_event.table,
+                ', '.join(['`%s`=%%s' % x for x in set_columns]),
+                ' AND '.join(map(self.compare_items, where_items.items())))
+        )
+        values = list(update_items.values()) + list(where_items.values())
+        return {'template': template, 'columns': set_columns + tuple(where_items.keys()), 'values': values}
 
     def get_delete_pattern(self):
-        template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-            self.binlog_event.schema, self.binlog_event.table,
-            ', '.join(map(lambda key: '`%s`' % key, self.row['values'].keys())),
-            ', '.join(['%s'] * len(self.row['values']))
+        columns = tuple(self.row['values'].keys())
+        template = SQL_TEMPLATE_CACHE.get_template(
+            ('rollback_delete', self.binlog_event.schema, self.binlog_event.table, columns),
+            lambda: 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
+                self.binlog_event.schema, self.binlog_event.table,
+                ', '.join(map(lambda key: '`%s`' % key, columns)),
+                ', '.join(['%s'] * len(columns))
+            )
         )
-        values = map(self.fix_object, self.row['values'].values())
-        return {'template': template, 'values': list(values)}
+        return {'template': template, 'columns': columns, 'values': list(self.row['values'].values())}
+
+
+INTEGER_FIELD_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.INT24, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG,
+                       FIELD_TYPE.YEAR}
+FLOAT_FIELD_TYPES = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE}
+DECIMAL_FIELD_TYPES = {FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+DATETIME_FIELD_TYPES = {FIELD_TYPE.DATETIME, FIELD_TYPE.DATETIME2, FIELD_TYPE.TIMESTAMP, FIELD_TYPE.TIMESTAMP2}
+TIME_FIELD_TYPES = {FIELD_TYPE.TIME, FIELD_TYPE.TIME2}
+STRING_FIELD_TYPES = {FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING, FIELD_TYPE.BLOB,
+                      FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB}
 
 
-class RowValueFormatter(object):
+class SqlValueEscaper(object):
+    """
+    不依赖数据库连接的SQL字面量生成器，按值类型分派转义函数，转义规则与PyMySQL保持一致
+    """
+    ESCAPE_TABLE = {
+        ord('\0'): '\\0',
+        ord('\\'): '\\\\',
+        ord('\n'): '\\n',
+        ord('\r'): '\\r',
+        ord('\032'): '\\Z',
+        ord('"'): '\\"',
+        ord('\''): '\\\'',
+    }
+    # 非ASCII字符串逐个替换，str.translate对非ASCII字符串逐字符查表，大字段时很慢；反斜杠需要最先替换
+    ESCAPE_REPLACEMENTS = [('\\', '\\\\'), ('\0', '\\0'), ('\n', '\\n'), ('\r', '\\r'), ('\032', '\\Z'),
+                           ('"', '\\"'), ('\'', '\\\'')]
+
+    def __init__(self, charset='utf8', hex_blob_threshold=DEFAULT_HEX_BLOB_THRESHOLD):
+        """
+        :param charset:
+        :param hex_blob_threshold: 不小于该字节数的二进制值直接输出为十六进制字面量，0表示先尝试解码
+        """
+        self.charset = charset
+        self.encoding = charset_to_encoding(charset)
+        self.hex_blob_threshold = hex_blob_threshold
+        # {(库, 表): (字段列表, 字段签名, {字段名: 转换函数})}
+        self.column_converters = dict()
+        self.encoders = {
+            str: self.escape_str,
+            int: str,
+            float: self.escape_float,
+            bool: self.escape_bool,
+            type(None): self.escape_none,
+            decimal.Decimal: str,
+            bytes: self.escape_bytes,
+            bytearray: self.escape_bytes,
+            datetime.datetime: self.escape_datetime,
+            datetime.date: self.escape_date,
+            datetime.time: self.escape_time,
+            datetime.timedelta: self.escape_timedelta,
+            set: self.escape_set,
+            frozenset: self.escape_set,
+            dict: self.escape_json,
+            list: self.escape_json,
+        }
+
+    def literal(self, value):
+        encoder = self.encoders.get(type(value))
+        if encoder is None:
+            return self.escape_str(str(value))
+        return encoder(value)
+
+    def mogrify(self, template, values):
+        return template % tuple(map(self.literal, values))
+
+    def escape_str(self, value):
+        if value.isascii():
+            return "'" + value.translate(self.ESCAPE_TABLE) + "'"
+        for special_char, replacement in self.ESCAPE_REPLACEMENTS:
+            if special_char in value:
+                value = value.replace(special_char, replacement)
+        return "'" + value + "'"
+
     @staticmethod
-    def format_object(object_item):
-        if type(object_item) == bytes:
-            return RowValueFormatter.format_bytes_value(object_item)
-        elif type(object_item) == dict:
-            return RowValueFormatter.format_dict_value(object_item)
-        elif type(object_item) == list:
-            return RowValueFormatter.format_list_value(object_item)
-        else:
-            return object_item
+    def escape_float(value):
+        return '%.15g' % value
 
     @staticmethod
-    def format_row_value(row_value):
-        new_row_value = RowValueFormatter.format_object(row_value)
-        if type(new_row_value) == dict:
-            return json.dumps(new_row_value)
-        elif type(new_row_value) == list:
-            return json.dumps(new_row_value)
-        else:
-            return new_row_value
+    def escape_bool(value):
+        return str(int(value))
+
+    @staticmethod
+    def escape_none(value):
+        return 'NULL'
+
+    def escape_bytes(self, value):
+        if 0 < self.hex_blob_threshold <= len(value):
+            return self.escape_hex(value)
+        try:
+            return self.escape_str(value.decode(self.encoding))
+        except UnicodeDecodeError:
+            # 无法按字符集解码的二进制数据使用十六进制字面量，保证输出文件可以按文本写入
+            return self.escape_hex(value)
+
+    @staticmethod
+    def escape_hex(value):
+        return "X'%s'" % value.hex()
 
     @staticmethod
-    def format_bytes_value(bytes_item):
-        return str(bytes_item, "utf8")
+    def escape_datetime(value):
+        if value.microsecond:
+            return "'{0.year:04}-{0.month:02}-{0.day:02} {0.hour:02}:{0.minute:02}:{0.second:02}.{0.microsecond:06}'" \
+                .format(value)
+        return "'{0.year:04}-{0.month:02}-{0.day:02} {0.hour:02}:{0.minute:02}:{0.second:02}'".format(value)
 
     @staticmethod
-    def format_dict_value(dict_item):
-        new_dict = dict()
-        for sub_item in dict_item.items():
-            item_key, item_value = sub_item
-            new_item_value = RowValueFormatter.format_object(item_value)
-            new_item_key = RowValueFormatter.format_object(item_key)
-            new_dict[new_item_key] = new_item_value
-        return new_dict
+    def escape_date(value):
+        return "'{0.year:04}-{0.month:02}-{0.day:02}'".format(value)
 
     @staticmethod
-    def format_list_value(list_item):
-        new_list = []
-        for sub_item in list_item:
-            new_sub_item = RowValueFormatter.format_object(sub_item)
-            new_list.append(new_sub_item)
-        return new_list
+    def escape_time(value):
+        if value.microsecond:
+            return "'{0.hour:02}:{0.minute:02}:{0.second:02}.{0.microsecond:06}'".format(value)
+        return "'{0.hour:02}:{0.minute:02}:{0.second:02}'".format(value)
+
+    @staticmethod
+    def escape_timedelta(value):
+        negative = '-' if value < datetime.timedelta(0) else ''
+        value = abs(value)
+        seconds = value.seconds % 60
+        minutes = value.seconds // 60 % 60
+        hours = value.seconds // 3600 + value.days * 24
+        if value.microseconds:
+            return "'{0}{1:02}:{2:02}:{3:02}.{4:06}'".format(negative, hours, minutes, seconds, value.microseconds)
+        return "'{0}{1:02}:{2:02}:{3:02}'".format(negative, hours, minutes, seconds)
+
+    def escape_set(self, value):
+        return self.escape_str(','.join(value))
+
+    def escape_json(self, value):
+        return self.escape_str(dumps_json(decode_json_value(value)))
+
+    def escape_utf8_bytes(self, value):
+        if 0 < self.hex_blob_threshold <= len(value):
+            return self.escape_hex(value)
+        try:
+            return self.escape_str(value.decode('utf-8'))
+        except UnicodeDecodeError:
+            return self.escape_hex(value)
+
+    def convert_value(self, value):
+        """
+        未按字段类型转换时的通用转换：SET拼接为逗号分隔的字符串，bytes按UTF-8解码(无法解码时输出十六进制)，
+        dict/list输出为JSON字符串
+        """
+        value_type = type(value)
+        if value_type is set:
+            value = ','.join(value)
+        elif value_type is bytes:
+            return self.escape_utf8_bytes(value)
+        elif value_type is dict or value_type is list:
+            return self.escape_json(value)
+        return self.literal(value)
+
+    def make_typed_converter(self, expected_type, encoder):
+        """
+        值的类型与字段类型对应时直接使用encoder，否则(NULL或其他类型)使用通用转换
+        """
+        convert_value = self.convert_value
+
+        def convert(value):
+            if type(value) is expected_type:
+                return encoder(value)
+            return convert_value(value)
+        return convert
+
+    def make_column_converter(self, column):
+        column_type = column.type
+        if column_type in INTEGER_FIELD_TYPES:
+            return self.make_typed_converter(int, str)
+        elif column_type in FLOAT_FIELD_TYPES:
+            return self.make_typed_converter(float, self.escape_float)
+        elif column_type in DECIMAL_FIELD_TYPES:
+            return self.make_typed_converter(decimal.Decimal, str)
+        elif column_type in DATETIME_FIELD_TYPES:
+            return self.make_typed_converter(datetime.datetime, self.escape_datetime)
+        elif column_type == FIELD_TYPE.DATE:
+            return self.make_typed_converter(datetime.date, self.escape_date)
+        elif column_type in TIME_FIELD_TYPES:
+            return self.make_typed_converter(datetime.timedelta, self.escape_timedelta)
+        elif column_type in STRING_FIELD_TYPES:
+            if getattr(column, 'character_set_name', None) is not None:
+                return self.make_typed_converter(str, self.escape_str)
+            return self.make_typed_converter(bytes, self.escape_utf8_bytes)
+        elif column_type == FIELD_TYPE.ENUM:
+            return self.make_typed_converter(str, self.escape_str)
+        elif column_type == FIELD_TYPE.SET:
+            return self.make_typed_converter(set, self.escape_set)
+        elif column_type == FIELD_TYPE.JSON:
+            escape_json = self.escape_json
+            convert_value = self.convert_value
+
+            def convert(value):
+                if type(value) is dict or type(value) is list:
+                    return escape_json(value)
+                return convert_value(value)
+            return convert
+        return self.convert_value
+
+    def get_column_converters(self, binlog_event):
+        """
+        按表结构生成{字段名: 转换函数}，表结构不变时复用
+        :param binlog_event: 行事件，没有字段信息时返回空字典，所有字段使用通用转换
+        :return:
+        """
+        columns = getattr(binlog_event, 'columns', None)
+        if not columns:
+            return dict()
+        cache_key = (binlog_event.schema, binlog_event.table)
+        cached = self.column_converters.get(cache_key)
+        if cached is not None and cached[0] is columns:
+            return cached[2]
+        signature = tuple((column.name, column.type, getattr(column, 'character_set_name', None))
+                          for column in columns)
+        if cached is not None and cached[1] == signature:
+            converters = cached[2]
+        else:
+            converters = {column.name: self.make_column_converter(column) for column in columns}
+        self.column_converters[cache_key] = (columns, signature, converters)
+        return converters
+
+    def convert_values(self, converters, columns, values):
+        """
+        :param converters: get_column_converters的返回值
+        :param columns: 与values对应的字段名
+        :param values:
+        :return: SQL字面量元组
+        """
+        convert_value = self.convert_value
+        return tuple([converters.get(column, convert_value)(value) for column, value in zip(columns, values)])
+
+
+def decode_json_value(value):
+    """
+    将binlog中解析出的JSON对象的bytes键和值转换为str
+    """
+    value_type = type(value)
+    if value_type is bytes:
+        return value.decode('utf-8')
+    elif value_type is dict:
+        return {(item_key.decode('utf-8') if type(item_key) is bytes else item_key): decode_json_value(item_value)
+                for item_key, item_value in value.items()}
+    elif value_type is list:
+        return [decode_json_value(sub_item) for sub_item in value]
+    return value
+
+
+def dumps_json(value):
+    """
+    固定使用json模块的默认格式，同一binlog在不同环境下生成的SQL相同
+    """
+    return json.dumps(value)
+
+
+SQL_VALUE_ESCAPER = SqlValueEscaper()
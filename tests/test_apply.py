@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import pytest
+from pymysqlreplication.event import QueryEvent
+import binlog2sql_apply
+from binlog2sql_apply import SqlApplier
+from binlog2sql_util import concat_sql_from_binlog_event
+
+
+class FailingApplier(SqlApplier):
+
+    def apply_batch(self, sql_batch):
+        # 等待读取线程填满队列并阻塞在结束标志上
+        time.sleep(0.5)
+        raise RuntimeError('apply failed')
+
+
+class FakeCursor(object):
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.open = True
+        self.executed = []
+        self.commit_count = 0
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+    def commit(self):
+        self.commit_count += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def make_query_event(schema, query):
+    query_event = QueryEvent.__new__(QueryEvent)
+    query_event.schema = schema
+    query_event.query = query
+    return query_event
+
+
+def test_iter_batches_split_at_transaction_end():
+    applier = SqlApplier({}, batch_size=2, back_interval=0)
+    sql_items = [('### start 1\nINSERT 1;', False), ('INSERT 2;', False), ('INSERT 3;', True),
+                 ('USE db;\nCREATE TABLE t (id int);', True)]
+    assert list(applier.iter_batches(sql_items)) == [['INSERT 1;', 'INSERT 2;', 'INSERT 3;'],
+                                                     ['USE db;', 'CREATE TABLE t (id int);']]
+
+
+def test_apply_error_with_full_queue_does_not_hang():
+    applier = FailingApplier({}, batch_size=1, back_interval=0)
+    sql_items = (('INSERT %d;' % i, True) for i in range(binlog2sql_apply.MAX_PREPARED_BATCH_COUNT + 1))
+    result = {}
+
+    def run():
+        try:
+            applier.apply(sql_items)
+        except Exception as ex:
+            result['error'] = ex
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert isinstance(result['error'], RuntimeError)
+
+
+def test_apply_reports_reader_error():
+    applier = SqlApplier({}, batch_size=1, back_interval=0)
+
+    def sql_items():
+        raise ValueError('bad spool')
+        yield
+
+    with pytest.raises(ValueError):
+        applier.apply(sql_items())
+
+
+def test_ddl_sql_uses_quoted_schema():
+    # pymysqlreplication中QueryEvent的库名为bytes
+    assert concat_sql_from_binlog_event(make_query_event(b'db', 'CREATE TABLE t (id int)')) \
+        == 'USE `db`;\nCREATE TABLE t (id int);'
+    assert concat_sql_from_binlog_event(make_query_event(b'd`b', 'DROP TABLE t')) == 'USE `d``b`;\nDROP TABLE t;'
+    assert concat_sql_from_binlog_event(make_query_event(b'', 'CREATE DATABASE db')) == 'CREATE DATABASE db;'
+
+
+def test_apply_ddl_record(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(binlog2sql_apply.pymysql, 'connect', lambda **kwargs: connection)
+    ddl_sql = concat_sql_from_binlog_event(make_query_event(b'db', 'ALTER TABLE t ADD COLUMN c int'))
+    sql_items = [('### start 4 end 100\nINSERT INTO `db`.`t`(`id`) VALUES (1);', True), (ddl_sql, True)]
+    applier = SqlApplier({}, batch_size=1, back_interval=0)
+    assert applier.apply(iter(sql_items)) == 3
+    assert connection.executed == ['INSERT INTO `db`.`t`(`id`) VALUES (1);', 'USE `db`;',
+                                   'ALTER TABLE t ADD COLUMN c int;']
+    assert connection.commit_count == 2
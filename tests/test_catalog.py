@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import io
+import gzip
+import shutil
+import pytest
+import binlog2sql_catalog
+from binlog2sql_compress import OutputCompressor
+from binlog2sql_catalog import (RollbackCatalog, RollbackCatalogReader, SPLIT_TRAN_FLAG, EMPTY_LINE_FLAG,
+                                get_rollback_catalog_file, parse_statement)
+
+# 按回滚文件中的顺序排列：(事务编号, 回滚语句)，事务编号越大的事务在binlog中越靠后
+ROLLBACK_STATEMENTS = [
+    (3, "### start 900 end 1000 time 2020-09-13 21:03:20\n"
+        "DELETE FROM `db`.`t1` WHERE `id`=2 AND `c`='%s' LIMIT 1;" % ('b' * 40)),
+    (3, "### start 900 end 1000 time 2020-09-13 21:03:25\n"
+        "DELETE FROM `db`.`t1` WHERE `id`=1 AND `c`='%s' LIMIT 1;" % ('中' * 20)),
+    (3, "### start 800 end 900 time 2020-09-13 21:03:20\n"
+        "UPDATE `db`.`t2` SET `c`='x' WHERE `id`=1 LIMIT 1;"),
+    (2, "### start 500 end 700 time 2020-09-13 21:02:00\n"
+        "INSERT INTO `db2`.`t1`(`id`, `c`) VALUES (1, '%s');" % ('a' * 40)),
+    (1, "### start 100 end 300 time 2020-09-13 21:01:00\n"
+        "INSERT INTO `db`.`t1`(`id`, `c`) VALUES (1, 'a');"),
+]
+
+
+@pytest.fixture(params=['none', 'gzip', 'zstd'])
+def compressor(request, monkeypatch):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    # 使用较小的块，一组语句会跨越多个压缩块
+    monkeypatch.setattr('binlog2sql_compress.COMPRESS_BLOCK_SIZE', 64)
+    output_compressor = OutputCompressor(request.param, compress_workers=2)
+    yield output_compressor
+    output_compressor.close()
+
+
+def write_rollback_file(tmp_path, compressor):
+    """
+    按create_rollback_sql的格式写入回滚文件和目录
+    :return: 回滚文件路径和目录文件路径
+    """
+    catalog_file = get_rollback_catalog_file(str(tmp_path / 'rollback_[file_id].sql'))
+    rollback_file = compressor.get_output_file(str(tmp_path / 'rollback_9999.sql'))
+    rollback_catalog = RollbackCatalog(catalog_file)
+    f_rollback = rollback_catalog.open_file(rollback_file, compressor)
+    f_rollback.write(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+    last_transaction_id = None
+    for transaction_id, sql_item in ROLLBACK_STATEMENTS:
+        f_rollback.write(EMPTY_LINE_FLAG)
+        if last_transaction_id is not None and transaction_id != last_transaction_id:
+            f_rollback.write(SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+        statement_offset = f_rollback.offset
+        f_rollback.write(sql_item + EMPTY_LINE_FLAG)
+        rollback_catalog.add_statement(f_rollback, sql_item, statement_offset, transaction_id)
+        last_transaction_id = transaction_id
+    f_rollback.close()
+    rollback_catalog.close()
+    return rollback_file, catalog_file
+
+
+def extract(catalog_file, **kwargs):
+    catalog_reader = RollbackCatalogReader(catalog_file)
+    try:
+        groups = catalog_reader.find_groups(**kwargs)
+        f_output = io.BytesIO()
+        statement_count = catalog_reader.write_groups(groups, f_output)
+    finally:
+        catalog_reader.close()
+    return groups, statement_count, f_output.getvalue().decode('utf-8')
+
+
+def expected_sql(*transactions):
+    lines = [SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG]
+    for index, statements in enumerate(transactions):
+        if index > 0:
+            lines.append(EMPTY_LINE_FLAG + SPLIT_TRAN_FLAG + EMPTY_LINE_FLAG)
+        else:
+            lines.append(EMPTY_LINE_FLAG)
+        lines.append(EMPTY_LINE_FLAG.join(sql_item + EMPTY_LINE_FLAG for sql_item in statements))
+    return ''.join(lines)
+
+
+def test_parse_statement():
+    assert parse_statement(ROLLBACK_STATEMENTS[0][1]) == (900, 1000, '2020-09-13 21:03:20', 'db', 't1', 'DELETE')
+    assert parse_statement("### start 1 end 2 time 2020-09-13 21:03:20\nINSERT INTO `d``b`.`t` VALUES (1);")[3] \
+        == 'd`b'
+    assert parse_statement("USE db;\nCREATE TABLE t (id int);") is None
+
+
+def test_catalog_groups(tmp_path, compressor):
+    _, catalog_file = write_rollback_file(tmp_path, compressor)
+    groups, statement_count, _ = extract(catalog_file)
+    assert statement_count == len(ROLLBACK_STATEMENTS)
+    assert [(group[5], group[6], group[7], group[8], group[14], group[9], group[10], group[11], group[13])
+            for group in groups] \
+        == [(3, 900, 1000, '2020-09-13 21:03:20', '2020-09-13 21:03:25', 'db', 't1', 'INSERT', 2),
+            (3, 800, 900, '2020-09-13 21:03:20', '2020-09-13 21:03:20', 'db', 't2', 'UPDATE', 1),
+            (2, 500, 700, '2020-09-13 21:02:00', '2020-09-13 21:02:00', 'db2', 't1', 'DELETE', 1),
+            (1, 100, 300, '2020-09-13 21:01:00', '2020-09-13 21:01:00', 'db', 't1', 'DELETE', 1)]
+
+
+def test_catalog_extract_all_matches_rollback_file(tmp_path, compressor):
+    rollback_file, catalog_file = write_rollback_file(tmp_path, compressor)
+    with open(rollback_file, "rb") as f_rollback:
+        data = f_rollback.read()
+    if rollback_file.endswith('.gz'):
+        data = gzip.decompress(data)
+    elif rollback_file.endswith('.zst'):
+        zstandard = pytest.importorskip('zstandard')
+        data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+    assert extract(catalog_file)[2] == data.decode('utf-8')
+
+
+def test_catalog_extract_filtered_groups(tmp_path, compressor):
+    _, catalog_file = write_rollback_file(tmp_path, compressor)
+    statements = [sql_item for _, sql_item in ROLLBACK_STATEMENTS]
+    assert extract(catalog_file, transaction_ids=[3])[2] == expected_sql(statements[:3])
+    assert extract(catalog_file, only_schemas=['db'], only_tables=['t1'])[2] \
+        == expected_sql(statements[:2], statements[4:])
+    assert extract(catalog_file, event_types=['DELETE'], start_time='2020-09-13 21:02:00')[2] \
+        == expected_sql(statements[3:4])
+    assert extract(catalog_file, stop_time='2020-09-13 21:02:00')[2] == expected_sql(statements[4:])
+    assert extract(catalog_file, only_tables=['t3']) == ([], 0, '')
+
+
+def test_catalog_time_filter_overlaps_group(tmp_path, compressor):
+    _, catalog_file = write_rollback_file(tmp_path, compressor)
+    statements = [sql_item for _, sql_item in ROLLBACK_STATEMENTS]
+    # 第一组的时间为21:03:20到21:03:25，与时间范围有交集时整组提取
+    assert extract(catalog_file, start_time='2020-09-13 21:03:22')[2] == expected_sql(statements[:2])
+    assert extract(catalog_file, start_time='2020-09-13 21:03:21', stop_time='2020-09-13 21:03:22')[2] \
+        == expected_sql(statements[:2])
+    assert extract(catalog_file, start_time='2020-09-13 21:03:26')[1] == 0
+    assert extract(catalog_file, start_time='2020-09-13 21:02:30', stop_time='2020-09-13 21:03:20')[1] == 0
+
+
+def test_catalog_resolves_moved_files(tmp_path, compressor):
+    origin_dir = tmp_path / 'origin'
+    origin_dir.mkdir()
+    rollback_file, catalog_file = write_rollback_file(origin_dir, compressor)
+    moved_dir = tmp_path / 'moved'
+    moved_dir.mkdir()
+    for file_path in (rollback_file, catalog_file):
+        shutil.move(file_path, str(moved_dir))
+    moved_catalog = str(moved_dir / 'rollback_catalog.db')
+    statements = [sql_item for _, sql_item in ROLLBACK_STATEMENTS]
+    assert extract(moved_catalog, transaction_ids=[2])[2] == expected_sql(statements[3:4])
+
+
+def test_catalog_main(tmp_path, compressor, capsys):
+    _, catalog_file = write_rollback_file(tmp_path, compressor)
+    result_file = str(tmp_path / 'extract.sql')
+    assert binlog2sql_catalog.main(['--catalog', catalog_file, '--sql-type', 'insert', '--result-file',
+                                    result_file]) == 0
+    assert 'extract 2 sql in 1 groups' in capsys.readouterr().out
+    with open(result_file, "rb") as f_result:
+        assert f_result.read().decode('utf-8') == expected_sql([sql_item for _, sql_item in ROLLBACK_STATEMENTS[:2]])
+    with pytest.raises(ValueError, match='Incorrect sql-type'):
+        binlog2sql_catalog.main(['--catalog', catalog_file, '--sql-type', 'replace'])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pytest
+from binlog2sql import Binlog2sql
+from binlog2sql_util import get_checkpoint_file, save_checkpoint, load_checkpoint
+from binlog2sql_spool import SqlSpoolWriter, SqlSpoolReader
+from binlog2sql_loaddata import truncate_load_data_files
+
+BINLOG_FILES = ['mysql-bin.000001', 'mysql-bin.000002', 'mysql-bin.000003']
+
+
+def make_binlog2sql(tmp_path, checkpoint=None):
+    binlog2sql = Binlog2sql.__new__(Binlog2sql)
+    tmp_sql_file = str(tmp_path / '127.0.0.1_3306_20200913213000_tmp.spool')
+    binlog2sql.__dict__.update({
+        'checkpoint_file': get_checkpoint_file(tmp_sql_file), 'checkpoint': checkpoint,
+        'execute_sql_file': str(tmp_path / 'execute.sql'), 'rollback_sql_file': str(tmp_path / 'rollback.sql'),
+        'tmp_sql_file': tmp_sql_file, 'flashback': False, 'load_data': False,
+        'load_data_file_prefix': tmp_sql_file.replace('_tmp.spool', '_load'), 'load_data_tables': [],
+        'binlogList': list(BINLOG_FILES), 'start_file': BINLOG_FILES[0], 'start_pos': 4, 'gtid_filter': None,
+    })
+    return binlog2sql
+
+
+def read_records(spool_file):
+    with SqlSpoolReader(spool_file) as spool_reader:
+        return [sql for sql, _ in spool_reader.iter_records()]
+
+
+def test_save_and_load_checkpoint(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    save_checkpoint(checkpoint_file, {'stage': 'parse', 'log_pos': 4})
+    save_checkpoint(checkpoint_file, {'stage': 'parse', 'log_pos': 120})
+    assert load_checkpoint(checkpoint_file) == {'stage': 'parse', 'log_pos': 120}
+    # 先写入临时文件再替换，不会留下写了一半的断点
+    assert os.listdir(str(tmp_path)) == ['checkpoint.json']
+    assert get_checkpoint_file('/log/127.0.0.1_3306_20200913213000_tmp.spool') \
+        == '/log/127.0.0.1_3306_20200913213000_checkpoint.json'
+
+
+def test_resume_truncates_partial_output(tmp_path, capsys):
+    binlog2sql = make_binlog2sql(tmp_path)
+    with SqlSpoolWriter(binlog2sql.tmp_sql_file) as spool_writer:
+        spool_writer.write('INSERT 1;', True)
+        spool_writer.write('INSERT 2;', False)
+        spool_writer.flush()
+        binlog2sql.save_checkpoint(stage='parse', log_file=BINLOG_FILES[1], log_pos=1000,
+                                   spool_record_count=spool_writer.record_count)
+        # 断点之后写入的记录和进程退出前没有完成的事务
+        spool_writer.write('INSERT 3;', True)
+        spool_writer.write('INSERT 4;', False)
+    # 进程退出时只写入了一部分的记录
+    with open(binlog2sql.tmp_sql_file, 'ab') as f_spool:
+        f_spool.write(b'\x00\x00\x01')
+    with open(binlog2sql.checkpoint_file, encoding='utf-8') as f_checkpoint:
+        checkpoint = json.load(f_checkpoint)
+    assert (checkpoint['log_file'], checkpoint['log_pos'], checkpoint['spool_record_count']) \
+        == (BINLOG_FILES[1], 1000, 2)
+    assert checkpoint['tmp_sql_file'] == binlog2sql.tmp_sql_file
+
+    resumed = make_binlog2sql(tmp_path, load_checkpoint(binlog2sql.checkpoint_file))
+    resumed.resume_from_checkpoint()
+    assert (resumed.start_file, resumed.start_pos) == (BINLOG_FILES[1], 1000)
+    assert resumed.binlogList == BINLOG_FILES[1:]
+    assert read_records(resumed.tmp_sql_file) == ['INSERT 1;', 'INSERT 2;']
+    assert 'resume from mysql-bin.000002:1000, spool records:2' in capsys.readouterr().out
+    # 续传后继续追加，没有重复或缺失的记录
+    with SqlSpoolWriter(resumed.tmp_sql_file) as spool_writer:
+        spool_writer.write('INSERT 3;', True)
+    assert read_records(resumed.tmp_sql_file) == ['INSERT 1;', 'INSERT 2;', 'INSERT 3;']
+
+
+def test_resume_ignores_finished_stages_and_checks_range(tmp_path):
+    binlog2sql = make_binlog2sql(tmp_path, {'stage': 'result', 'log_file': None, 'log_pos': None})
+    binlog2sql.resume_from_checkpoint()
+    assert (binlog2sql.start_file, binlog2sql.start_pos) == (BINLOG_FILES[0], 4)
+    binlog2sql = make_binlog2sql(tmp_path, {'stage': 'parse', 'log_file': 'mysql-bin.000009', 'log_pos': 4,
+                                            'spool_record_count': 0})
+    with pytest.raises(ValueError, match='not in binlog range'):
+        binlog2sql.resume_from_checkpoint()
+
+
+def test_truncate_load_data_files(tmp_path):
+    file_prefix = str(tmp_path / 'x_load')
+    with open(file_prefix + '_db.t1.tsv', 'w') as f_data:
+        f_data.write('1\ta\n2\tb\n')
+    with open(file_prefix + '_db.t2.tsv', 'w') as f_data:
+        f_data.write('1\n')
+    truncate_load_data_files(file_prefix, [{'file': file_prefix + '_db.t1.tsv', 'file_size': 4}])
+    # 断点之后才创建的数据文件被删除
+    assert os.listdir(str(tmp_path)) == ['x_load_db.t1.tsv']
+    with open(file_prefix + '_db.t1.tsv') as f_data:
+        assert f_data.read() == '1\ta\n'
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+from types import SimpleNamespace
+import pytest
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_pipeline import set_event_rows
+from binlog2sql_compact import RowChangeCompactor
+
+
+def make_event(event_class, log_pos, rows, table='t', primary_key='id'):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update({'schema': 'db', 'table': table, 'primary_key': primary_key, 'columns': None,
+                                  'timestamp': 1600000000 + log_pos, 'packet': SimpleNamespace(log_pos=log_pos)})
+    set_event_rows(binlog_event, rows)
+    return binlog_event
+
+
+def insert(log_pos, row_id, c, table='t'):
+    return make_event(WriteRowsEvent, log_pos, [{'values': {'id': row_id, 'c': c}}], table=table)
+
+
+def delete(log_pos, row_id, c):
+    return make_event(DeleteRowsEvent, log_pos, [{'values': {'id': row_id, 'c': c}}])
+
+
+def update(log_pos, row_id, before_c, after_c, after_id=None):
+    return make_event(UpdateRowsEvent, log_pos, [{'before_values': {'id': row_id, 'c': before_c},
+                                                  'after_values': {'id': after_id or row_id, 'c': after_c}}])
+
+
+def compact(tmp_path, events, max_memory_rows=100):
+    row_compactor = RowChangeCompactor(str(tmp_path / 'compact.db'), max_memory_rows=max_memory_rows)
+    for binlog_event in events:
+        row_compactor.add_event(binlog_event, binlog_event.packet.log_pos - 10)
+    net_rows = [(type(binlog_event).__name__, binlog_event.table, row, binlog_event.packet.log_pos, e_start_pos)
+                for binlog_event, row, e_start_pos in row_compactor.iter_net_rows()]
+    spill_count = row_compactor.spill_count
+    row_compactor.close()
+    assert not os.path.exists(row_compactor.spill_file)
+    return net_rows, spill_count
+
+
+@pytest.fixture(params=[100, 1])
+def max_memory_rows(request):
+    # 1表示每个新行都写入磁盘，结果与全部在内存中合并相同
+    return request.param
+
+
+def test_insert_then_update_is_insert(tmp_path, max_memory_rows):
+    net_rows, _ = compact(tmp_path, [insert(100, 1, 'a'), update(200, 1, 'a', 'b'), update(300, 1, 'b', 'c')],
+                          max_memory_rows)
+    assert net_rows == [('WriteRowsEvent', 't', {'values': {'id': 1, 'c': 'c'}}, 300, 290)]
+
+
+def test_insert_then_delete_is_nothing(tmp_path, max_memory_rows):
+    events = [insert(100, 1, 'a'), update(200, 1, 'a', 'b'), delete(300, 1, 'b')]
+    assert compact(tmp_path, events, max_memory_rows)[0] == []
+
+
+def test_update_chain(tmp_path, max_memory_rows):
+    events = [update(100, 1, 'a', 'b'), update(200, 1, 'b', 'c'), update(300, 2, 'x', 'y'), update(400, 2, 'y', 'x')]
+    # 恢复为窗口开始时状态的行没有净变更
+    assert compact(tmp_path, events, max_memory_rows)[0] == [
+        ('UpdateRowsEvent', 't', {'before_values': {'id': 1, 'c': 'a'}, 'after_values': {'id': 1, 'c': 'c'}}, 200, 190)]
+
+
+def test_delete_existing_and_reinsert(tmp_path, max_memory_rows):
+    events = [delete(100, 1, 'a'), delete(200, 2, 'b'), insert(300, 2, 'c')]
+    assert compact(tmp_path, events, max_memory_rows)[0] == [
+        ('DeleteRowsEvent', 't', {'values': {'id': 1, 'c': 'a'}}, 100, 90),
+        ('UpdateRowsEvent', 't', {'before_values': {'id': 2, 'c': 'b'}, 'after_values': {'id': 2, 'c': 'c'}}, 300, 290)]
+
+
+def test_primary_key_change(tmp_path, max_memory_rows):
+    events = [insert(100, 1, 'a'), update(200, 1, 'a', 'a', after_id=2), insert(300, 1, 'b', table='t2')]
+    # 主键变化按删除原行、新增新行处理，不同表的相同主键互不影响
+    assert compact(tmp_path, events, max_memory_rows)[0] == [
+        ('WriteRowsEvent', 't', {'values': {'id': 2, 'c': 'a'}}, 200, 190),
+        ('WriteRowsEvent', 't2', {'values': {'id': 1, 'c': 'b'}}, 300, 290)]
+
+
+def test_spill_keeps_first_image(tmp_path):
+    events = [update(100, 1, 'a', 'b'), update(200, 2, 'x', 'y'), update(300, 1, 'b', 'c'), delete(400, 2, 'y')]
+    net_rows, spill_count = compact(tmp_path, events, max_memory_rows=1)
+    assert spill_count > 1
+    assert net_rows == [
+        ('UpdateRowsEvent', 't', {'before_values': {'id': 1, 'c': 'a'}, 'after_values': {'id': 1, 'c': 'c'}}, 300, 290),
+        ('DeleteRowsEvent', 't', {'values': {'id': 2, 'c': 'x'}}, 400, 390)]
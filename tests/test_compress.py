@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import pytest
+from binlog2sql_compress import OutputCompressor
+from binlog2sql_spool import (SqlSpoolWriter, SqlSpoolReader, truncate_spool, get_spool_raw_size,
+                              get_spool_block_file, read_spool_block_file)
+
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def compressor(request, monkeypatch):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    # 使用较小的块，少量记录即可生成多个压缩块
+    monkeypatch.setattr('binlog2sql_compress.COMPRESS_BLOCK_SIZE', 64)
+    output_compressor = OutputCompressor(request.param, compress_workers=2)
+    yield output_compressor
+    output_compressor.close()
+
+
+def make_records(start, stop):
+    return [('INSERT INTO `db`.`t`(`id`, `c`) VALUES (%d, \'中文%d\');' % (i, i), i % 3 == 0)
+            for i in range(start, stop)]
+
+
+def write_spool(spool_file, records, compressor):
+    with SqlSpoolWriter(spool_file, compressor) as spool_writer:
+        for sql, new_transaction in records:
+            spool_writer.write(sql, new_transaction)
+            # 每两条记录刷一次盘，保存断点时缓存的数据作为一个完整的块写入
+            if spool_writer.record_count % 2 == 0:
+                spool_writer.flush()
+        return spool_writer.record_count
+
+
+def read_spool(spool_file, reverse=False):
+    with SqlSpoolReader(spool_file) as spool_reader:
+        return list(spool_reader.iter_records(reverse=reverse))
+
+
+def test_compressed_spool_block_map(tmp_path, compressor):
+    spool_file = str(tmp_path / 'test.spool')
+    records = make_records(0, 20)
+    write_spool(spool_file, records, compressor)
+    codec_id, block_entries = read_spool_block_file(get_spool_block_file(spool_file))
+    assert codec_id == compressor.codec.codec_id
+    assert len(block_entries) > 1
+    with open(spool_file, "rb") as f_spool:
+        spool_data = f_spool.read()
+    raw_data = b''
+    for raw_offset, file_offset, compressed_size, raw_size in block_entries:
+        assert raw_offset == len(raw_data)
+        block_data = compressor.codec.decompress(spool_data[file_offset:file_offset + compressed_size])
+        assert len(block_data) == raw_size
+        raw_data += block_data
+    assert get_spool_raw_size(spool_file) == len(raw_data)
+    assert read_spool(spool_file) == records
+    assert read_spool(spool_file, reverse=True) == records[::-1]
+
+
+def test_compressed_spool_append_parts(tmp_path, compressor):
+    spool_file = str(tmp_path / 'test.spool')
+    part_files = [str(tmp_path / ('part_%d.spool' % i)) for i in range(2)]
+    write_spool(part_files[0], make_records(1, 8), compressor)
+    write_spool(part_files[1], make_records(8, 15), compressor)
+    with SqlSpoolWriter(spool_file, compressor) as spool_writer:
+        spool_writer.write('INSERT 0;', True)
+        for part_file in part_files:
+            spool_writer.append_spool(part_file)
+        spool_writer.write('INSERT 15;', True)
+    expected = [('INSERT 0;', True)] + make_records(1, 15) + [('INSERT 15;', True)]
+    assert read_spool(spool_file) == expected
+    assert read_spool(spool_file, reverse=True) == expected[::-1]
+
+
+def test_compressed_spool_truncate_at_checkpoint(tmp_path, compressor):
+    spool_file = str(tmp_path / 'test.spool')
+    records = make_records(0, 10)
+    write_spool(spool_file, records, compressor)
+    truncate_spool(spool_file, 4)
+    assert read_spool(spool_file) == records[:4]
+    with SqlSpoolWriter(spool_file, compressor) as spool_writer:
+        assert spool_writer.record_count == 4
+        spool_writer.write('INSERT 4;', True)
+    assert read_spool(spool_file, reverse=True) == [('INSERT 4;', True)] + records[:4][::-1]
+
+
+def test_compressed_spool_truncate_inside_block(tmp_path, compressor):
+    spool_file = str(tmp_path / 'test.spool')
+    write_spool(spool_file, make_records(0, 10), compressor)
+    with pytest.raises(ValueError, match='inside a compressed block'):
+        truncate_spool(spool_file, 3)
+
+
+def test_compressed_spool_rejects_other_codec(tmp_path, compressor):
+    spool_file = str(tmp_path / 'test.spool')
+    write_spool(spool_file, make_records(0, 2), compressor)
+    with pytest.raises(ValueError, match='is compressed'):
+        SqlSpoolWriter(spool_file)
+
+
+def test_open_text_file_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr('binlog2sql_compress.COMPRESS_BLOCK_SIZE', 64)
+    output_compressor = OutputCompressor('gzip', compress_workers=2)
+    output_file = output_compressor.get_output_file(str(tmp_path / 'rollback.sql'))
+    assert output_file.endswith('.sql.gz')
+    block_entries = []
+    text = ''.join(sql + '\n' for sql, _ in make_records(0, 20))
+    with output_compressor.open_text_file(output_file, on_block_written=lambda *args: block_entries.append(args)) \
+            as f_output:
+        for line in text.splitlines(True):
+            f_output.write(line)
+    output_compressor.close()
+    assert len(block_entries) > 1
+    with open(output_file, "rb") as f_output:
+        assert gzip.decompress(f_output.read()).decode('utf-8') == text
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import decimal
+import datetime
+import pytest
+from pymysql.converters import escape_item
+from pymysqlreplication.constants import FIELD_TYPE
+from binlog2sql_util2 import SqlValueEscaper
+
+ESCAPER = SqlValueEscaper()
+
+
+@pytest.mark.parametrize('value', [
+    'abc', '', 'a\'b"c\\d\0e\nf\rg\x1ah', '中\'文\\\0', '\U0001f600"',
+    0, 1, -5, 2 ** 64, 1.5, 0.1, -2.5e-10, 1e20, None, True, False,
+    decimal.Decimal('1.50'), decimal.Decimal('-0.000001'), b'abc', b'a\'b\\',
+    datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.datetime(2020, 1, 2, 3, 4, 5, 6), datetime.date(2020, 1, 2),
+    datetime.time(1, 2, 3), datetime.time(1, 2, 3, 4), datetime.timedelta(0),
+    datetime.timedelta(hours=30, minutes=2, seconds=3), datetime.timedelta(seconds=3, microseconds=5),
+])
+def test_literal_matches_pymysql(value):
+    assert ESCAPER.literal(value) == escape_item(value, 'utf8')
+
+
+def test_mogrify_matches_pymysql():
+    values = ('a\'b', 1, None, datetime.datetime(2020, 1, 2, 3, 4, 5))
+    template = "INSERT INTO `db`.`t`(`a`, `b`, `c`, `d`) VALUES (%s, %s, %s, %s);"
+    assert ESCAPER.mogrify(template, values) == template % tuple(escape_item(value, 'utf8') for value in values)
+
+
+@pytest.mark.parametrize('value, expected, pymysql_value', [
+    # MySQL的负TIME为'-HH:MM:SS'，PyMySQL按timedelta的days和seconds分别格式化，结果不正确
+    (-datetime.timedelta(hours=1), "'-01:00:00'", "'-1:00:00'"),
+    (-datetime.timedelta(hours=1, seconds=1, microseconds=5), "'-01:00:01.000005'", "'-2:59:58.999995'"),
+    (-datetime.timedelta(hours=838, minutes=59, seconds=59), "'-838:59:59'", None),
+])
+def test_negative_time_differs_from_pymysql(value, expected, pymysql_value):
+    assert ESCAPER.literal(value) == expected
+    if pymysql_value is not None:
+        assert escape_item(value, 'utf8') == pymysql_value
+
+
+def test_set_differs_from_pymysql():
+    # SET字段的值输出为逗号分隔的字符串，PyMySQL输出为值列表
+    assert ESCAPER.literal({'a'}) == "'a'"
+    assert escape_item({'a'}, 'utf8') == "('a')"
+    assert ESCAPER.literal({'a', 'b\''}) in ("'a,b\\''", "'b\\',a'")
+    assert ESCAPER.literal(set()) == "''"
+
+
+def test_bytes_not_decodable_as_hex():
+    assert ESCAPER.literal(b'\xff\x00') == "X'ff00'"
+    assert SqlValueEscaper(hex_blob_threshold=3).literal(b'abc') == "X'616263'"
+    assert SqlValueEscaper(hex_blob_threshold=4).literal(b'abc') == "'abc'"
+
+
+def test_json_literal():
+    # JSON值按json模块的默认格式输出后按字符串转义
+    assert ESCAPER.literal({b'k': [1, b'v\'']}) == escape_item('{"k": [1, "v\'"]}', 'utf8')
+
+
+class FakeColumn(object):
+
+    def __init__(self, name, column_type, character_set_name=None):
+        self.name = name
+        self.type = column_type
+        self.character_set_name = character_set_name
+
+
+class FakeRowsEvent(object):
+
+    def __init__(self, columns):
+        self.schema = 'db'
+        self.table = 't'
+        self.columns = columns
+
+
+@pytest.mark.parametrize('column, value, expected', [
+    (FakeColumn('c', FIELD_TYPE.LONGLONG), 18446744073709551615, '18446744073709551615'),
+    (FakeColumn('c', FIELD_TYPE.DOUBLE), 0.1, '0.1'),
+    (FakeColumn('c', FIELD_TYPE.NEWDECIMAL), decimal.Decimal('-12.3400'), '-12.3400'),
+    (FakeColumn('c', FIELD_TYPE.DATETIME2), datetime.datetime(2020, 9, 13, 21, 3, 20, 5),
+     "'2020-09-13 21:03:20.000005'"),
+    (FakeColumn('c', FIELD_TYPE.TIMESTAMP2), datetime.datetime(2020, 9, 13, 21, 3, 20), "'2020-09-13 21:03:20'"),
+    (FakeColumn('c', FIELD_TYPE.DATE), datetime.date(2020, 9, 13), "'2020-09-13'"),
+    (FakeColumn('c', FIELD_TYPE.TIME2), -datetime.timedelta(hours=25, seconds=1), "'-25:00:01'"),
+    (FakeColumn('c', FIELD_TYPE.VARCHAR, 'utf8mb4'), 'a\'中\n', "'a\\'中\\n'"),
+    (FakeColumn('c', FIELD_TYPE.BLOB, 'utf8mb4'), 'text\\', "'text\\\\'"),
+    (FakeColumn('c', FIELD_TYPE.BLOB), b'a\'b', "'a\\'b'"),
+    (FakeColumn('c', FIELD_TYPE.BLOB), '中'.encode('utf-8'), "'中'"),
+    (FakeColumn('c', FIELD_TYPE.BLOB), b'\x00\xff', "X'00ff'"),
+    (FakeColumn('c', FIELD_TYPE.STRING), b'\x80', "X'80'"),
+    (FakeColumn('c', FIELD_TYPE.ENUM), 'a\'b', "'a\\'b'"),
+    (FakeColumn('c', FIELD_TYPE.SET), {'x'}, "'x'"),
+    (FakeColumn('c', FIELD_TYPE.SET), set(), "''"),
+    (FakeColumn('c', FIELD_TYPE.JSON), {b'k': [1, None, b'v"']}, '\'{\\"k\\": [1, null, \\"v\\\\\\"\\"]}\''),
+    (FakeColumn('c', FIELD_TYPE.JSON), [], "'[]'"),
+    (FakeColumn('c', FIELD_TYPE.JSON), None, 'NULL'),
+    (FakeColumn('c', FIELD_TYPE.NEWDECIMAL), None, 'NULL'),
+    (FakeColumn('c', FIELD_TYPE.BLOB), None, 'NULL'),
+    # 值的类型与字段类型不一致时使用通用转换
+    (FakeColumn('c', FIELD_TYPE.LONG), 'x', "'x'"),
+    (FakeColumn('c', FIELD_TYPE.VARCHAR, 'latin1'), b'\xe4', "X'e4'"),
+])
+def test_column_converters(column, value, expected):
+    escaper = SqlValueEscaper()
+    binlog_event = FakeRowsEvent([column])
+    converters = escaper.get_column_converters(binlog_event)
+    assert escaper.convert_values(converters, ('c',), (value,)) == (expected,)
+    # 不按字段类型转换时结果相同
+    assert escaper.convert_value(value) == expected
+
+
+def test_column_converters_reused_by_signature():
+    escaper = SqlValueEscaper()
+    columns = [FakeColumn('id', FIELD_TYPE.LONG), FakeColumn('c', FIELD_TYPE.BLOB)]
+    converters = escaper.get_column_converters(FakeRowsEvent(columns))
+    same_columns = [FakeColumn('id', FIELD_TYPE.LONG), FakeColumn('c', FIELD_TYPE.BLOB)]
+    assert escaper.get_column_converters(FakeRowsEvent(same_columns)) is converters
+    altered_columns = [FakeColumn('id', FIELD_TYPE.LONG), FakeColumn('c', FIELD_TYPE.BLOB, 'utf8mb4')]
+    assert escaper.get_column_converters(FakeRowsEvent(altered_columns)) is not converters
+    # 没有字段信息的事件使用通用转换
+    assert escaper.get_column_converters(FakeRowsEvent([])) == {}
+    assert escaper.convert_values({}, ('id', 'c'), (1, b'\xff')) == ('1', "X'ff'")
+
+
+class NoDecodeBytes(bytes):
+
+    def decode(self, *args, **kwargs):
+        raise AssertionError('bytes above the hex threshold must not be decoded')
+
+
+def test_hex_blob_threshold_skips_decode():
+    escaper = SqlValueEscaper(hex_blob_threshold=4)
+    assert escaper.escape_utf8_bytes(NoDecodeBytes(b'\xe4\xb8\xad\xff')) == "X'e4b8adff'"
+    assert escaper.escape_bytes(NoDecodeBytes(b'abcdef')) == "X'616263646566'"
+    # 小于阈值的值仍按字符集解码
+    assert escaper.escape_utf8_bytes(b'abc') == "'abc'"
+
+
+@pytest.mark.parametrize('hex_blob_threshold, value, expected', [
+    (0, b'\xff\xfe\x00\x01', "X'fffe0001'"),
+    (0, b'\xe4\xb8', "X'e4b8'"),
+    (0, '中文'.encode('utf-8'), "'中文'"),
+    (4, '中文'.encode('utf-8'), "X'e4b8ade69687'"),
+    (4, b'\x00\x01\x02', "'\\0\x01\x02'"),
+    (1024, bytes(range(256)) * 8, "X'%s'" % (bytes(range(256)) * 8).hex()),
+])
+def test_binary_column_hex_literal(hex_blob_threshold, value, expected):
+    escaper = SqlValueEscaper(hex_blob_threshold=hex_blob_threshold)
+    converters = escaper.get_column_converters(FakeRowsEvent([FakeColumn('c', FIELD_TYPE.BLOB)]))
+    assert escaper.convert_values(converters, ('c',), (value,)) == (expected,)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+from types import SimpleNamespace
+import pytest
+from pymysqlreplication.column import Column
+from pymysqlreplication.constants import FIELD_TYPE
+from pymysqlreplication.event import QueryEvent, RotateEvent, XidEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_pipeline import set_event_rows
+from binlog2sql_eventspool import (EventSpoolWriter, EventSpoolReader, EventSpoolRecorder, load_event_spool_meta,
+                                   check_event_spool_filters, EVENT_SPOOL_TABLE)
+
+COLUMNS = [Column(type=FIELD_TYPE.LONG, name='id', character_set_name=None),
+           Column(type=FIELD_TYPE.VARCHAR, name='c', character_set_name='utf8mb4')]
+
+
+def make_event(event_class, log_pos, **attrs):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update(attrs)
+    binlog_event.timestamp = 1600000000 + log_pos
+    binlog_event.packet = SimpleNamespace(log_pos=log_pos, event_size=10)
+    return binlog_event
+
+
+def rows_event(event_class, log_pos, rows, table='t', columns=COLUMNS):
+    binlog_event = make_event(event_class, log_pos, schema='db', table=table, primary_key='id', columns=columns)
+    set_event_rows(binlog_event, rows)
+    return binlog_event
+
+
+def query_event(log_pos, query):
+    return make_event(QueryEvent, log_pos, slave_proxy_id=1, execution_time=0, schema=b'db', query=query)
+
+
+# (事件, 读取该事件后的binlog文件, 位点)
+EVENTS = [
+    (query_event(100, 'BEGIN'), 'mysql-bin.000001', 100),
+    (rows_event(WriteRowsEvent, 200, [{'values': {'id': 1, 'c': 'a'}}, {'values': {'id': 2, 'c': None}}]),
+     'mysql-bin.000001', 200),
+    (rows_event(UpdateRowsEvent, 300, [{'before_values': {'id': 1, 'c': 'a'}, 'after_values': {'id': 1, 'c': 'b'}}]),
+     'mysql-bin.000001', 300),
+    (rows_event(DeleteRowsEvent, 400, [{'values': {'id': 1, 'c': 'x'}}], table='t2'), 'mysql-bin.000001', 400),
+    (make_event(XidEvent, 500, xid=7), 'mysql-bin.000001', 500),
+    (make_event(RotateEvent, 0, next_binlog='mysql-bin.000002', position=4), 'mysql-bin.000002', 4),
+    (query_event(150, 'BEGIN'), 'mysql-bin.000002', 150),
+    (rows_event(WriteRowsEvent, 250, [{'values': {'id': 3, 'c': '中'}}]), 'mysql-bin.000002', 250),
+    (make_event(XidEvent, 300, xid=8), 'mysql-bin.000002', 300),
+]
+
+
+class FakeStream(object):
+
+    def __init__(self, events):
+        self.events = events
+        self.log_file, self.log_pos = 'mysql-bin.000001', 4
+
+    def __iter__(self):
+        for binlog_event, log_file, log_pos in self.events:
+            self.log_file, self.log_pos = log_file, log_pos
+            yield binlog_event
+
+    def close(self):
+        pass
+
+
+def record_events(spool_file, events=EVENTS):
+    recorder = EventSpoolRecorder(FakeStream(events), EventSpoolWriter(spool_file, meta={'sql_type': None}))
+    assert [binlog_event for binlog_event in recorder] == [binlog_event for binlog_event, _, _ in events]
+    recorder.close()
+
+
+def event_items(binlog_event):
+    items = {'class': type(binlog_event), 'log_pos': binlog_event.packet.log_pos, 'timestamp': binlog_event.timestamp}
+    for attr in ('schema', 'table', 'primary_key', 'query', 'xid', 'next_binlog', 'position'):
+        if attr in binlog_event.__dict__:
+            items[attr] = getattr(binlog_event, attr)
+    if isinstance(binlog_event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+        items['rows'] = binlog_event.rows
+        items['columns'] = [column.data for column in binlog_event.columns]
+    return items
+
+
+def replay(spool_file, log_file='mysql-bin.000001', log_pos=4, **kwargs):
+    spool_reader = EventSpoolReader(spool_file, log_file, log_pos, **kwargs)
+    events = []
+    for binlog_event in spool_reader:
+        events.append((binlog_event, spool_reader.log_file, spool_reader.log_pos))
+    spool_reader.close()
+    # 第一个事件为切换到起始位点的RotateEvent
+    assert (events[0][0].next_binlog, events[0][0].position) == (log_file, log_pos)
+    return events[1:]
+
+
+def test_round_trip(tmp_path):
+    spool_file = str(tmp_path / 'events.spool')
+    record_events(spool_file)
+    events = replay(spool_file)
+    assert [(event_items(binlog_event), log_file, log_pos) for binlog_event, log_file, log_pos in events] == \
+        [(event_items(binlog_event), log_file, log_pos) for binlog_event, log_file, log_pos in EVENTS]
+    meta = load_event_spool_meta(spool_file)
+    assert (meta['first_file'], meta['first_pos'], meta['last_file'], meta['last_pos'], meta['event_count']) == \
+        ('mysql-bin.000001', 4, 'mysql-bin.000002', 300, len(EVENTS))
+    assert meta['binlog_files'] == ['mysql-bin.000001', 'mysql-bin.000002']
+
+
+def test_table_definition_written_once(tmp_path):
+    spool_file = str(tmp_path / 'events.spool')
+    record_events(spool_file)
+    with open(spool_file, 'rb') as f_spool:
+        records = []
+        while True:
+            try:
+                records.append(pickle.load(f_spool))
+            except EOFError:
+                break
+    # t和t2各一次，mysql-bin.000002中的t使用相同的表结构
+    assert [record[3] for record in records if record[0] == EVENT_SPOOL_TABLE] == ['t', 't2']
+
+
+def test_replay_filters(tmp_path):
+    spool_file = str(tmp_path / 'events.spool')
+    record_events(spool_file)
+    events = replay(spool_file, 'mysql-bin.000001', 500)
+    assert [log_pos for _, _, log_pos in events] == [4, 150, 250, 300]
+    events = replay(spool_file, only_tables=['t2'])
+    assert [type(binlog_event) for binlog_event, _, _ in events if hasattr(binlog_event, 'table')] == [DeleteRowsEvent]
+    events = replay(spool_file, only_events=[QueryEvent, XidEvent, RotateEvent, UpdateRowsEvent])
+    assert [type(binlog_event) for binlog_event, _, _ in events].count(UpdateRowsEvent) == 1
+    assert not any(isinstance(binlog_event, WriteRowsEvent) for binlog_event, _, _ in events)
+
+
+def test_append_part(tmp_path):
+    spool_file = str(tmp_path / 'events.spool')
+    part_files = [str(tmp_path / 'part_1.spool'), str(tmp_path / 'part_2.spool')]
+    record_events(part_files[0], EVENTS[:5])
+    record_events(part_files[1], EVENTS[5:])
+    spool_writer = EventSpoolWriter(spool_file)
+    for part_file in part_files:
+        spool_writer.append_part(part_file)
+    spool_writer.close()
+    assert [event_items(binlog_event) for binlog_event, _, _ in replay(spool_file)] == \
+        [event_items(binlog_event) for binlog_event, _, _ in EVENTS]
+    assert load_event_spool_meta(spool_file)['event_count'] == len(EVENTS)
+
+
+META = {'only_schemas': ['db'], 'only_tables': None, 'sql_type': ['INSERT', 'DELETE'], 'only_dml': True,
+        'first_file': 'mysql-bin.000002', 'first_pos': 4}
+
+
+def test_check_filters_accepts_narrower_replay():
+    check_event_spool_filters(META, 'mysql-bin.000002', 4, ['db'], None, ['DELETE'], True)
+    check_event_spool_filters(META, 'mysql-bin.000003', 4, ['db'], ['t'], ['INSERT', 'DELETE'], True)
+    check_event_spool_filters(dict(META, only_schemas=None, sql_type=None, only_dml=False, first_file=None),
+                              'mysql-bin.000001', 4, None, None, ['UPDATE'], False)
+
+
+@pytest.mark.parametrize('args, message', [
+    (('mysql-bin.000002', 4, None, None, ['DELETE'], True), 'recorded with --databases db, replay can not use all'),
+    (('mysql-bin.000002', 4, ['db', 'db2'], None, ['DELETE'], True), 'replay can not use db db2'),
+    (('mysql-bin.000002', 4, ['db'], None, ['UPDATE'], True), 'recorded with --sql-type INSERT DELETE'),
+    (('mysql-bin.000002', 4, ['db'], None, ['DELETE'], False), 'replay must use --only-dml'),
+    (('mysql-bin.000001', 120, ['db'], None, ['DELETE'], True), 'replay can not start at mysql-bin.000001:120'),
+])
+def test_check_filters_rejects_mismatch(args, message):
+    with pytest.raises(ValueError, match=message):
+        check_event_spool_filters(META, *args)
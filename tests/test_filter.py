@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent, UpdateRowsEvent
+from binlog2sql_filter import EventFilterPlan, BASE_EVENTS
+from binlog2sql_util import command_line_args
+
+OFFLINE_ARGS = ['--binlog-dir', '/data/binlog', '--schema-file', '/data/schema.json',
+                '--start-file', 'mysql-bin.000001']
+
+
+def test_filter_plan_events():
+    event_filter = EventFilterPlan(['DELETE', 'INSERT'])
+    assert event_filter.only_events == BASE_EVENTS + [DeleteRowsEvent, WriteRowsEvent]
+    assert UpdateRowsEvent not in event_filter.only_events
+    assert EventFilterPlan([]).only_events == BASE_EVENTS
+
+
+def test_only_dml_does_not_freeze_schema():
+    # --only-dml只是不输出DDL，DDL之后仍需要重新解析TableMap事件
+    args = command_line_args(OFFLINE_ARGS + ['--only-dml'])
+    assert args.only_dml and not args.freeze_schema
+    assert EventFilterPlan(args.sql_type).freeze_schema is False
+    args = command_line_args(OFFLINE_ARGS + ['--freeze-schema'])
+    assert EventFilterPlan(args.sql_type, freeze_schema=args.freeze_schema).freeze_schema is True
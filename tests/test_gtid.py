@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+import pytest
+from pymysqlreplication.event import GtidEvent, QueryEvent, XidEvent
+from pymysqlreplication.row_event import WriteRowsEvent
+from binlog2sql_gtid import (parse_gtid_set, merge_intervals, subtract_intervals, union_gtid_sets, subtract_gtid_sets,
+                             format_gtid_set, contains_gtid, GtidRangeFilter, GtidTransactionTracker)
+
+SID = '3e11fa47-71ca-11e1-9e33-c80aa9429562'
+SID2 = 'aaaaaaaa-71ca-11e1-9e33-c80aa9429562'
+
+
+def make_event(event_class, **attrs):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update(attrs)
+    return binlog_event
+
+
+def gtid_event(gno, sid=SID):
+    return make_event(GtidEvent, sid=uuid.UUID(sid).bytes, gno=gno)
+
+
+def query_event(query):
+    return make_event(QueryEvent, query=query, schema=b'db')
+
+
+def transaction(gno=None, rows=1):
+    events = [] if gno is None else [gtid_event(gno)]
+    events.append(query_event('BEGIN'))
+    events.extend(make_event(WriteRowsEvent) for _ in range(rows))
+    events.append(make_event(XidEvent))
+    return events
+
+
+def ddl(gno=None):
+    return ([] if gno is None else [gtid_event(gno)]) + [query_event('ALTER TABLE t ADD COLUMN c int')]
+
+
+def test_parse_gtid_set():
+    assert parse_gtid_set('') == {}
+    assert parse_gtid_set('%s:1-5:7,\n%s:3' % (SID.upper(), SID2)) == {SID: [(1, 6), (7, 8)], SID2: [(3, 4)]}
+    # 相邻和重叠的区间合并
+    assert parse_gtid_set('%s:1-3:4-5, %s:5-9' % (SID, SID)) == {SID: [(1, 10)]}
+
+
+@pytest.mark.parametrize('intervals, expected', [
+    ([], []),
+    ([(5, 8), (1, 3)], [(1, 3), (5, 8)]),
+    ([(1, 3), (3, 5)], [(1, 5)]),
+    ([(1, 10), (2, 4), (9, 12)], [(1, 12)]),
+])
+def test_merge_intervals(intervals, expected):
+    assert merge_intervals(intervals) == expected
+
+
+@pytest.mark.parametrize('intervals, removed_intervals, expected', [
+    ([(1, 10)], [], [(1, 10)]),
+    ([(1, 10)], [(1, 10)], []),
+    ([(1, 10)], [(0, 3)], [(3, 10)]),
+    ([(1, 10)], [(8, 20)], [(1, 8)]),
+    ([(1, 10)], [(3, 5), (6, 7)], [(1, 3), (5, 6), (7, 10)]),
+    ([(1, 5), (10, 15)], [(4, 11)], [(1, 4), (11, 15)]),
+    ([(1, 5)], [(5, 6)], [(1, 5)]),
+])
+def test_subtract_intervals(intervals, removed_intervals, expected):
+    assert subtract_intervals(intervals, removed_intervals) == expected
+
+
+def test_gtid_set_operations():
+    gtid_set = parse_gtid_set('%s:1-10,%s:1-3' % (SID, SID2))
+    removed = parse_gtid_set('%s:4-6,%s:1-3' % (SID, SID2))
+    assert subtract_gtid_sets(gtid_set, removed) == {SID: [(1, 4), (7, 11)]}
+    assert union_gtid_sets(parse_gtid_set('%s:1-3' % SID), parse_gtid_set('%s:4-6,%s:9' % (SID, SID2))) \
+        == {SID: [(1, 7)], SID2: [(9, 10)]}
+    assert format_gtid_set(subtract_gtid_sets(gtid_set, removed)) == '%s:1-3:7-10' % SID
+    assert format_gtid_set(parse_gtid_set('%s:5,%s:1-2' % (SID2, SID))) == '%s:1-2,%s:5' % (SID, SID2)
+    assert contains_gtid(gtid_set, SID, 10)
+    assert not contains_gtid(gtid_set, SID, 11)
+    assert not contains_gtid(gtid_set, SID2, 0)
+    assert not contains_gtid(gtid_set, 'unknown', 1)
+
+
+def select_events(gtid_filter, events):
+    tracker = GtidTransactionTracker(gtid_filter)
+    return [tracker.update(binlog_event) for binlog_event in events]
+
+
+def test_tracker_include_gtids_skips_anonymous_transactions():
+    gtid_filter = GtidRangeFilter(include_gtids='%s:2' % SID)
+    events = transaction(2) + transaction() + ddl() + transaction(3) + ddl(2)
+    # 被选择的GTID事务之后的匿名事务和DDL不沿用上一个事务的选择结果
+    assert select_events(gtid_filter, events) == [True] * 4 + [False] * 3 + [False] + [False] * 4 + [True] * 2
+
+
+def test_tracker_exclude_gtids_keeps_anonymous_transactions():
+    gtid_filter = GtidRangeFilter(exclude_gtids='%s:2' % SID)
+    events = transaction(2) + transaction() + ddl(2) + ddl() + transaction(3)
+    assert select_events(gtid_filter, events) == [False] * 4 + [True] * 3 + [False] * 2 + [True] + [True] * 4
+
+
+def test_tracker_resume_at_begin():
+    gtid_filter = GtidRangeFilter(include_gtids='%s:2' % SID)
+    # 断点位于GTID事务的BEGIN，之前的GtidEvent不会再次读取
+    tracker = GtidTransactionTracker(gtid_filter, selected=True, has_gtid=True)
+    assert [tracker.update(binlog_event) for binlog_event in transaction(rows=2)[:-1]] == [True] * 3
+    tracker = GtidTransactionTracker(gtid_filter, selected=False, has_gtid=False)
+    assert [tracker.update(binlog_event) for binlog_event in transaction() + transaction(2)] \
+        == [False] * 3 + [True] * 4
+
+
+def test_accept_event_drops_rows_of_skipped_transactions():
+    gtid_filter = GtidRangeFilter(include_gtids='%s:2' % SID)
+    events = transaction(1, rows=2) + transaction(2) + transaction(rows=3)
+    accepted = [binlog_event for binlog_event in events if gtid_filter.accept_event(binlog_event)]
+    assert sum(isinstance(binlog_event, WriteRowsEvent) for binlog_event in accepted) == 1
+    assert len(accepted) == len(events) - 5
+    assert gtid_filter.skipped_rows_event_count == 5
+    assert gtid_filter.skipped_transaction_count == 1
+
+
+def test_get_auto_position():
+    assert GtidRangeFilter(exclude_gtids='%s:2' % SID).get_auto_position() is None
+    assert GtidRangeFilter(start_gtid_set='%s:1-5' % SID, exclude_gtids='%s:8' % SID).get_auto_position() \
+        == '%s:1-5:8' % SID
+    # 指定include_gtids时跳过其余已执行的事务
+    assert GtidRangeFilter(include_gtids='%s:3-4' % SID).get_auto_position('%s:1-10,%s:1-2' % (SID, SID2)) \
+        == '%s:1-2:5-10,%s:1-2' % (SID, SID2)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from binlog2sql_jobs import check_job_args
+
+OFFLINE_ARGS = ['--binlog-dir', '/data/binlog', '--schema-file', '/data/schema.json',
+                '--start-file', 'mysql-bin.000001']
+
+
+def test_check_job_args_accepts_offline_job():
+    check_job_args('job1', OFFLINE_ARGS)
+
+
+@pytest.mark.parametrize('extra_args', [
+    ['--output-dir', '/x'], ['--output-dir=/x'], ['--output-d=/x'],
+    ['--metrics-file=/x/metrics.json'], ['--metrics-format', 'prometheus'],
+])
+def test_check_job_args_rejects_options_set_by_runner(extra_args):
+    with pytest.raises(ValueError, match='is set by binlog2sql_jobs'):
+        check_job_args('job1', OFFLINE_ARGS + extra_args)
+
+
+def test_check_job_args_requires_password_online():
+    with pytest.raises(ValueError, match='password'):
+        check_job_args('job1', ['-h', '127.0.0.1', '-u', 'root', '--start-file', 'mysql-bin.000001'])
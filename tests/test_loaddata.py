@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import pytest
+from pymysqlreplication.constants import FIELD_TYPE
+from binlog2sql_loaddata import LoadDataValueEscaper, LoadDataWriter, get_load_data_statement
+
+
+class FakeColumn(object):
+
+    def __init__(self, name, column_type, character_set_name=None):
+        self.name = name
+        self.type = column_type
+        self.character_set_name = character_set_name
+
+
+class FakeRowsEvent(object):
+
+    def __init__(self):
+        self.schema = 'db'
+        self.table = 't'
+        self.columns = [FakeColumn('id', FIELD_TYPE.LONG), FakeColumn('c', FIELD_TYPE.VARCHAR, 'utf8mb4'),
+                        FakeColumn('b', FIELD_TYPE.BLOB), FakeColumn('d', FIELD_TYPE.DATETIME2)]
+
+
+@pytest.mark.parametrize('data_format, value, expected', [
+    ('tsv', None, '\\N'),
+    ('tsv', 'a\tb', 'a\\tb'),
+    ('tsv', 'a\nb\r', 'a\\nb\\r'),
+    ('tsv', 'a\\b\0', 'a\\\\b\\0'),
+    ('tsv', '中\'文"', '中\'文"'),
+    ('tsv', 'N', 'N'),
+    ('tsv', '\\N', '\\\\N'),
+    ('csv', None, '\\N'),
+    ('csv', 'a,b', '"a,b"'),
+    ('csv', 'a"b\\', '"a\\"b\\\\"'),
+    ('csv', 'a\tb\n', '"a\\tb\\n"'),
+    ('csv', '', '""'),
+    ('tsv', 5, '5'),
+    ('tsv', datetime.datetime(2020, 9, 13, 21, 3, 20), '2020-09-13 21:03:20'),
+    ('csv', datetime.date(2020, 9, 13), '2020-09-13'),
+    ('tsv', -datetime.timedelta(hours=1), '-01:00:00'),
+])
+def test_field_escaping(data_format, value, expected):
+    assert LoadDataValueEscaper(data_format=data_format).literal(value) == expected
+
+
+def test_escape_binary():
+    assert LoadDataValueEscaper.escape_binary(None) == '\\N'
+    assert LoadDataValueEscaper.escape_binary(b'\t\n\\\xff') == '090a5cff'
+    assert LoadDataValueEscaper.escape_binary('中') == 'e4b8ad'
+
+
+@pytest.mark.parametrize('data_format, expected', [
+    ('tsv', '1\ta\\tb\\nc\\\\\t090a\t2020-09-13 21:03:20\n2\t\\N\t\\N\t\\N\n'),
+    ('csv', '1,"a\\tb\\nc\\\\",090a,2020-09-13 21:03:20\n2,\\N,\\N,\\N\n'),
+])
+def test_writer_rows(tmp_path, data_format, expected):
+    file_prefix = str(tmp_path / 'x_load')
+    writer = LoadDataWriter(file_prefix, data_format=data_format)
+    binlog_event = FakeRowsEvent()
+    writer.write_row(binlog_event, {'id': 1, 'c': 'a\tb\nc\\', 'b': b'\t\n',
+                                    'd': datetime.datetime(2020, 9, 13, 21, 3, 20)})
+    writer.write_row(binlog_event, {'id': 2, 'c': None, 'b': None, 'd': None})
+    table_items = writer.close()
+    assert [(table_item['row_count'], table_item['binary_columns']) for table_item in table_items] == [(2, ['b'])]
+    with open(table_items[0]['file'], 'rb') as f_data:
+        assert f_data.read().decode('utf-8') == expected
+    assert table_items[0]['file_size'] == len(expected.encode('utf-8'))
+
+
+@pytest.mark.parametrize('data_format, expected', [
+    ('tsv', b'1\tab\\t\xff\\\\\t\\N\t\\N\n'),
+    ('csv', b'1,"ab\\t\xff\\\\\\"",\\N,\\N\n'),
+])
+def test_writer_raw_bytes(tmp_path, data_format, expected):
+    # 非二进制字段中的bytes按原始字节写入数据文件，不能输出X'...'字面量
+    writer = LoadDataWriter(str(tmp_path / 'x_load'), data_format=data_format)
+    writer.write_row(FakeRowsEvent(), {'id': 1, 'c': b'ab\t\xff\\' + (b'"' if data_format == 'csv' else b''),
+                                       'b': None, 'd': None})
+    table_items = writer.close()
+    with open(table_items[0]['file'], 'rb') as f_data:
+        assert f_data.read() == expected
+    assert LoadDataValueEscaper().literal(b'\xe4\t') == '\udce4\\t'
+    assert LoadDataValueEscaper().literal('中'.encode('utf-8')) == '中'
+
+
+def test_load_data_statement(tmp_path):
+    writer = LoadDataWriter(str(tmp_path / 'x_load'))
+    writer.write_row(FakeRowsEvent(), {'id': 1, 'c': 'a', 'b': b'', 'd': None})
+    table_item = writer.close()[0]
+    assert get_load_data_statement(table_item) == (
+        "LOAD DATA LOCAL INFILE '{0}' INTO TABLE `db`.`t` CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+        "(`id`, `c`, @`b`, `d`) SET `b` = UNHEX(@`b`);".format(table_item['file']))
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import threading
+import pytest
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import QueryEvent
+from binlog2sql_local import TABLE_COLUMN_KEYS
+from binlog2sql_metacache import TableMetadataCache, CachedBinLogStreamReader, get_ddl_table
+
+
+def make_columns(*names):
+    return [dict({key: None for key in TABLE_COLUMN_KEYS}, COLUMN_NAME=name) for name in names]
+
+
+class FakeCursor(object):
+
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+
+    def execute(self, sql):
+        pass
+
+    def fetchall(self):
+        return self.fingerprints
+
+
+def make_query_event(schema, query):
+    query_event = QueryEvent.__new__(QueryEvent)
+    query_event.schema = schema
+    query_event.query = query
+    return query_event
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('ALTER TABLE t ADD COLUMN c int', ('db', 't')),
+    ('/* comment */ alter table `db2`.`t 1` drop column c', ('db2', 't 1')),
+    ('CREATE TABLE IF NOT EXISTS db2.t (id int)', ('db2', 't')),
+    ('DROP DATABASE `db2`', ('db2', None)),
+    ('RENAME TABLE t TO t2', ('db', None)),
+    ('INSERT INTO t VALUES (1)', None),
+])
+def test_get_ddl_table(query, expected):
+    assert get_ddl_table(query, 'db') == expected
+
+
+def test_cache_hit_and_fingerprint_change(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    loads = []
+
+    def loader(schema, table):
+        loads.append((schema, table))
+        return make_columns('id', 'c')
+
+    cache = TableMetadataCache(cache_file)
+    cache.load_fingerprints(FakeCursor([('db', 't', 'v1')]))
+    assert cache.get_table_information('db', 't', loader) == make_columns('id', 'c')
+    assert cache.get_table_information('db', 't', loader) == make_columns('id', 'c')
+    assert loads == [('db', 't')]
+    cache.save()
+    with open(cache_file, encoding='utf-8') as f_cache:
+        assert json.load(f_cache)['db.t']['fingerprint'] == 'v1'
+    # 其他进程启动时表结构已经改变
+    cache = TableMetadataCache(cache_file)
+    cache.load_fingerprints(FakeCursor([('db', 't', 'v2')]))
+    cache.get_table_information('db', 't', loader)
+    assert loads == [('db', 't'), ('db', 't')]
+
+
+def test_cache_invalidate_query(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    cache = TableMetadataCache(cache_file)
+    cache.load_fingerprints(FakeCursor([('db', 't1', 'v1'), ('db', 't2', 'v1'), ('db2', 't1', 'v1')]))
+    for schema, table in (('db', 't1'), ('db', 't2'), ('db2', 't1')):
+        cache.get_table_information(schema, table, lambda schema, table: make_columns('id'))
+    cache.save()
+    cache.invalidate_query(make_query_event(b'db', 'ALTER TABLE t1 ADD COLUMN c int'))
+    assert sorted(cache.tables) == ['db.t2', 'db2.t1']
+    # DDL之后不再使用修改前的结构版本，重新查询的结果不写入缓存
+    assert cache.get_table_information('db', 't1', lambda schema, table: make_columns('id', 'c')) \
+        == make_columns('id', 'c')
+    assert 'db.t1' not in cache.tables
+    cache.invalidate_query(make_query_event(b'', 'DROP DATABASE db'))
+    assert sorted(cache.tables) == ['db2.t1']
+    cache.save()
+    with open(cache_file, encoding='utf-8') as f_cache:
+        assert sorted(json.load(f_cache)) == ['db2.t1']
+
+
+def test_stream_reader_invalidates_on_ddl(tmp_path, monkeypatch):
+    cache = TableMetadataCache(str(tmp_path / 'cache.json'))
+    cache.load_fingerprints(FakeCursor([('db', 't', 'v1')]))
+    cache.get_table_information('db', 't', lambda schema, table: make_columns('id'))
+    events = [make_query_event(b'db', 'BEGIN'), make_query_event(b'db', 'ALTER TABLE t ADD COLUMN c int')]
+    monkeypatch.setattr(BinLogStreamReader, 'fetchone', lambda self: events.pop(0))
+    stream = CachedBinLogStreamReader.__new__(CachedBinLogStreamReader)
+    stream.table_metadata_cache = cache
+    stream.fetchone()
+    assert 'db.t' in cache.tables
+    # 读取线程读到DDL时立即删除缓存，早于之后的TableMap事件
+    stream.fetchone()
+    assert 'db.t' not in cache.tables
+
+
+def test_cache_concurrent_access(tmp_path):
+    cache = TableMetadataCache(str(tmp_path / 'cache.json'))
+    table_count = 2000
+    cache.load_fingerprints(FakeCursor([('db', 't%d' % i, 'v1') for i in range(table_count)]))
+    errors = []
+
+    def read_tables():
+        try:
+            for i in range(table_count):
+                cache.get_table_information('db', 't%d' % i, lambda schema, table: make_columns('id'))
+                if i % 3 == 0:
+                    cache.invalidate('db', 't%d' % i)
+        except Exception as ex:
+            errors.append(ex)
+
+    # 缩短线程切换间隔，使读取线程和解析线程交替访问缓存
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        reader = threading.Thread(target=read_tables)
+        reader.start()
+        while reader.is_alive():
+            cache.invalidate('db')
+            cache.save()
+        reader.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from types import SimpleNamespace
+from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent, UpdateRowsEvent
+from binlog2sql_util import MultiRowSqlMerger
+
+TIMESTAMP = 1600002200
+TIME = datetime.datetime.fromtimestamp(TIMESTAMP)
+
+
+def make_event(event_class, log_pos, table='t'):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update({'schema': 'db', 'table': table, 'primary_key': 'id', 'columns': [],
+                                  'timestamp': TIMESTAMP, 'packet': SimpleNamespace(log_pos=log_pos)})
+    return binlog_event
+
+
+def insert_row(row_id):
+    return {'values': {'id': row_id, 'c': 'v%d' % row_id}}
+
+
+def split_sql(sql):
+    comment, statement = sql.split('\n', 1)
+    return comment, statement
+
+
+def test_merge_rows_until_flush():
+    merger = MultiRowSqlMerger(1024)
+    binlog_event = make_event(WriteRowsEvent, 200)
+    assert merger.add_row(binlog_event, insert_row(1), 100) == []
+    assert merger.add_row(binlog_event, insert_row(2), 100) == []
+    assert merger.flush() == ["### start 100 end 200 time %s\n"
+                              "INSERT INTO `db`.`t`(`id`, `c`) VALUES (1, 'v1'), (2, 'v2');" % TIME]
+    assert merger.flush() == []
+
+
+def test_split_by_max_statement_bytes():
+    prefix = "INSERT INTO `db`.`t`(`id`, `c`) VALUES "
+    # 前缀和结尾分号加上两行及分隔符的长度，第三行超出上限
+    max_statement_bytes = len(prefix) + 1 + 2 * len("(1, 'v1'), ")
+    merger = MultiRowSqlMerger(max_statement_bytes)
+    sql_list = []
+    for row_id in range(1, 6):
+        sql_list.extend(merger.add_row(make_event(WriteRowsEvent, 100 + row_id), insert_row(row_id), 100))
+    sql_list.extend(merger.flush())
+    statements = [split_sql(sql)[1] for sql in sql_list]
+    assert statements == [prefix + "(1, 'v1'), (2, 'v2');", prefix + "(3, 'v3'), (4, 'v4');", prefix + "(5, 'v5');"]
+    assert all(len(statement.encode('utf-8')) <= max_statement_bytes for statement in statements)
+    # 每条语句的结束位点为最后一行所在事件的位点
+    assert [split_sql(sql)[0] for sql in sql_list] == ['### start 100 end 102 time %s' % TIME,
+                                                       '### start 100 end 104 time %s' % TIME,
+                                                       '### start 100 end 105 time %s' % TIME]
+
+
+def test_oversized_row_kept_in_own_statement():
+    merger = MultiRowSqlMerger(10)
+    assert merger.add_row(make_event(WriteRowsEvent, 101), insert_row(1), 100) == []
+    sql_list = merger.add_row(make_event(WriteRowsEvent, 102), insert_row(2), 101)
+    assert [split_sql(sql)[1] for sql in sql_list + merger.flush()] \
+        == ["INSERT INTO `db`.`t`(`id`, `c`) VALUES (1, 'v1');", "INSERT INTO `db`.`t`(`id`, `c`) VALUES (2, 'v2');"]
+
+
+def test_flush_on_table_change():
+    merger = MultiRowSqlMerger(1024)
+    merger.add_row(make_event(WriteRowsEvent, 101), insert_row(1), 100)
+    sql_list = merger.add_row(make_event(WriteRowsEvent, 102, table='t2'), insert_row(2), 101)
+    assert [split_sql(sql)[1] for sql in sql_list] == ["INSERT INTO `db`.`t`(`id`, `c`) VALUES (1, 'v1');"]
+    assert [split_sql(sql)[1] for sql in merger.flush()] == ["INSERT INTO `db`.`t2`(`id`, `c`) VALUES (2, 'v2');"]
+
+
+def test_flush_on_type_change():
+    merger = MultiRowSqlMerger(1024, flashback=True, rollback_with_primary_key=True)
+    merger.add_row(make_event(WriteRowsEvent, 101), insert_row(1), 100)
+    merger.add_row(make_event(WriteRowsEvent, 102), insert_row(2), 101)
+    # 回滚DELETE生成INSERT，与之前回滚INSERT生成的DELETE不能合并
+    sql_list = merger.add_row(make_event(DeleteRowsEvent, 103), insert_row(3), 102)
+    assert [split_sql(sql)[1] for sql in sql_list] == ["DELETE FROM `db`.`t` WHERE `id` IN (1, 2);"]
+    assert [split_sql(sql)[1] for sql in merger.flush()] == ["INSERT INTO `db`.`t`(`id`, `c`) VALUES (3, 'v3');"]
+
+
+def test_rows_without_multi_row_pattern():
+    merger = MultiRowSqlMerger(1024)
+    row = {'before_values': {'id': 1}, 'after_values': {'id': 2}}
+    assert merger.add_row(make_event(UpdateRowsEvent, 101), row, 100) is None
+    # 没有主键时回滚INSERT只能逐行删除
+    assert MultiRowSqlMerger(1024, flashback=True).add_row(make_event(WriteRowsEvent, 101), insert_row(1), 100) \
+        is None
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+import pytest
+import binlog2sql_pipeline
+from pymysqlreplication.row_event import WriteRowsEvent
+from binlog2sql_pipeline import check_rows_event_internals, set_event_rows, iter_event_rows
+
+
+class StreamingWriteRowsEvent(WriteRowsEvent):
+    """
+    每次解码一行并推进读取位置，模拟pymysqlreplication 0.19的行事件
+    """
+
+    def _fetch_one_row(self):
+        self.packet.read_bytes += 10
+        return {'values': {'id': self.packet.read_bytes // 10}}
+
+    def _fetch_rows(self):
+        self._RowsEvent__rows = []
+        while self.packet.read_bytes < self.event_size:
+            self._RowsEvent__rows.append(self._fetch_one_row())
+
+
+def make_rows_event(row_count):
+    binlog_event = StreamingWriteRowsEvent.__new__(StreamingWriteRowsEvent)
+    binlog_event.__dict__.update({'complete': True, 'event_size': 10 * row_count, '_RowsEvent__rows': None,
+                                  'packet': SimpleNamespace(read_bytes=0)})
+    return binlog_event
+
+
+def test_check_rows_event_internals():
+    assert check_rows_event_internals('0.19')
+    assert not check_rows_event_internals('0.45.1')
+    assert not check_rows_event_internals('1.0.0')
+
+
+def test_iter_event_rows_streaming():
+    if not binlog2sql_pipeline.ROWS_EVENT_INTERNALS:
+        pytest.skip('installed mysql-replication does not support row streaming')
+    binlog_event = make_rows_event(3)
+    rows = iter_event_rows(binlog_event)
+    assert next(rows) == {'values': {'id': 1}}
+    # 逐行解码，只读取了第一行
+    assert binlog_event.packet.read_bytes == 10
+    assert list(rows) == [{'values': {'id': 2}}, {'values': {'id': 3}}]
+    binlog_event = make_rows_event(2)
+    set_event_rows(binlog_event, [{'values': {'id': 5}}])
+    assert list(iter_event_rows(binlog_event)) == [{'values': {'id': 5}}]
+
+
+def test_iter_event_rows_falls_back_to_rows(monkeypatch):
+    # 未验证的版本不访问私有实现，通过rows属性一次解码全部行
+    monkeypatch.setattr(binlog2sql_pipeline, 'ROWS_EVENT_INTERNALS', False)
+    monkeypatch.setattr(StreamingWriteRowsEvent, '_fetch_one_row', lambda self: pytest.fail('private decode used'))
+    monkeypatch.setattr(StreamingWriteRowsEvent, 'rows', property(lambda self: [{'values': {'id': 1}}]))
+    assert list(iter_event_rows(make_rows_event(1))) == [{'values': {'id': 1}}]
+    with pytest.raises(NotImplementedError, match='mysql-replication 0.19'):
+        set_event_rows(make_rows_event(1), [])
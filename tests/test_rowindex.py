@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from pymysqlreplication.event import RotateEvent, QueryEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_pipeline import set_event_rows
+from binlog2sql_rowindex import RowChangeIndex, RowLookupStream, format_row_key
+
+
+def make_event(event_class, log_pos, rows, primary_key='id', table='t'):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update({'schema': 'db', 'table': table, 'primary_key': primary_key,
+                                  'timestamp': 1600000000 + log_pos, 'packet': SimpleNamespace(log_pos=log_pos)})
+    set_event_rows(binlog_event, rows)
+    return binlog_event
+
+
+def build_index(index_file):
+    row_index = RowChangeIndex(index_file)
+    row_index.add_event(make_event(WriteRowsEvent, 200, [{'values': {'id': 1}}, {'values': {'id': 2}}]),
+                        'mysql-bin.000010', 100)
+    row_index.add_event(make_event(UpdateRowsEvent, 400, [{'before_values': {'id': 1}, 'after_values': {'id': 3}}]),
+                        'mysql-bin.000010', 300)
+    row_index.add_event(make_event(DeleteRowsEvent, 150, [{'values': {'id': 3}}]), 'mysql-bin.000009', 120)
+    row_index.add_event(make_event(DeleteRowsEvent, 900, [{'values': {'id': 1}}], table='t2'), 'mysql-bin.000010', 800)
+    # 没有主键的表不记录
+    row_index.add_event(make_event(WriteRowsEvent, 950, [{'values': {'id': 1}}], primary_key=None),
+                        'mysql-bin.000010', 900)
+    return row_index
+
+
+def test_format_row_key():
+    assert format_row_key([1, 'a']) == '1\ta'
+    assert format_row_key([b'\xe4\xb8\xad', b'\xff']) == '中\t\\xff'
+
+
+def test_find_changes(tmp_path):
+    row_index = build_index(str(tmp_path / 'row_index.db'))
+    row_index.close()
+    row_index = RowChangeIndex(str(tmp_path / 'row_index.db'))
+    # 按binlog文件编号和位点排序，主键修改前后的行都能查到
+    assert row_index.find_changes('db', 't', '1') == [('mysql-bin.000010', 100, 200, 1600000200, 'INSERT'),
+                                                      ('mysql-bin.000010', 300, 400, 1600000400, 'UPDATE')]
+    assert row_index.find_changes('db', 't', '3') == [('mysql-bin.000009', 120, 150, 1600000150, 'DELETE'),
+                                                      ('mysql-bin.000010', 300, 400, 1600000400, 'UPDATE')]
+    assert row_index.find_changes('db', 't2', '1') == [('mysql-bin.000010', 800, 900, 1600000900, 'DELETE')]
+    assert row_index.find_changes('db', 't', '4') == []
+    assert row_index.find_changes('db', 't3', '1') == []
+    row_index.close()
+
+
+def test_reindex_same_range(tmp_path):
+    index_file = str(tmp_path / 'row_index.db')
+    build_index(index_file).close()
+    row_index = build_index(index_file)
+    row_index.flush()
+    assert len(row_index.find_changes('db', 't', '1')) == 2
+    row_index.close()
+
+
+def test_composite_primary_key(tmp_path):
+    row_index = RowChangeIndex(str(tmp_path / 'row_index.db'))
+    binlog_event = make_event(WriteRowsEvent, 200, [{'values': {'a': 1, 'b': 'x', 'c': 0}}], primary_key=('a', 'b'))
+    row_index.add_event(binlog_event, 'mysql-bin.000001', 100)
+    row_index.flush()
+    assert row_index.find_changes('db', 't', '1\tx') == [('mysql-bin.000001', 100, 200, 1600000200, 'INSERT')]
+    row_index.close()
+
+
+class FakeStream(object):
+
+    def __init__(self, events, log_file):
+        self.events = events
+        self.log_file = log_file
+        self.log_pos = None
+        self.closed = False
+
+    def __iter__(self):
+        for binlog_event in self.events:
+            self.log_pos = binlog_event.packet.log_pos
+            yield binlog_event
+
+    def close(self):
+        self.closed = True
+
+
+def test_row_lookup_stream(tmp_path):
+    begin = QueryEvent.__new__(QueryEvent)
+    begin.__dict__.update({'query': 'BEGIN', 'packet': SimpleNamespace(log_pos=250)})
+    events = [begin,
+              make_event(WriteRowsEvent, 280, [{'values': {'id': 5}}]),
+              make_event(UpdateRowsEvent, 400, [{'before_values': {'id': 1}, 'after_values': {'id': 3}},
+                                                {'before_values': {'id': 2}, 'after_values': {'id': 2}}]),
+              make_event(WriteRowsEvent, 500, [{'values': {'id': 1}}])]
+    streams = []
+
+    def create_stream(log_file, start_pos):
+        streams.append(FakeStream(events, log_file))
+        return streams[-1]
+
+    changes = [('mysql-bin.000010', 200, 400, 1600000400, 'UPDATE')]
+    lookup_events = list(RowLookupStream(create_stream, changes, '1'))
+    assert isinstance(lookup_events[0], RotateEvent)
+    assert (lookup_events[0].next_binlog, lookup_events[0].position) == ('mysql-bin.000010', 200)
+    # 不相关的行事件跳过，相关行事件只保留指定行，读到最后一个相关事件后停止
+    assert lookup_events[1:] == events[:1] + events[2:3]
+    assert events[2].rows == [{'before_values': {'id': 1}, 'after_values': {'id': 3}}]
+    assert streams[0].closed
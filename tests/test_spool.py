@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import os
+from binlog2sql_spool import SqlSpoolWriter, SqlSpoolReader, truncate_spool, remove_spool, get_spool_index_file
+
+RECORDS = [('### start 4 end 100\nINSERT INTO `db`.`t`(`id`) VALUES (1);', True),
+           ('INSERT INTO `db`.`t`(`id`) VALUES (2);', False),
+           ('USE db;\nCREATE TABLE t2 (id int);', True),
+           ('UPDATE `db`.`t` SET `c`=\'中文\' WHERE `id`=1 LIMIT 1;', True)]
+
+
+def write_spool(spool_file, records):
+    with SqlSpoolWriter(spool_file) as spool_writer:
+        for sql, new_transaction in records:
+            spool_writer.write(sql, new_transaction)
+        return spool_writer.record_count
+
+
+def read_spool(spool_file, reverse=False):
+    with SqlSpoolReader(spool_file) as spool_reader:
+        return len(spool_reader), list(spool_reader.iter_records(reverse=reverse))
+
+
+def test_spool_read_forward_and_reverse(tmp_path):
+    spool_file = str(tmp_path / 'test.spool')
+    assert write_spool(spool_file, RECORDS) == len(RECORDS)
+    assert read_spool(spool_file) == (len(RECORDS), RECORDS)
+    assert read_spool(spool_file, reverse=True) == (len(RECORDS), RECORDS[::-1])
+
+
+def test_spool_reverse_across_index_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr('binlog2sql_spool.SPOOL_INDEX_READ_COUNT', 3)
+    spool_file = str(tmp_path / 'test.spool')
+    records = [('INSERT %d;' % i, i % 2 == 0) for i in range(10)]
+    write_spool(spool_file, records)
+    assert read_spool(spool_file) == (10, records)
+    assert read_spool(spool_file, reverse=True) == (10, records[::-1])
+
+
+def test_spool_append_parts(tmp_path):
+    spool_file = str(tmp_path / 'test.spool')
+    part_files = [str(tmp_path / ('part_%d.spool' % i)) for i in range(2)]
+    write_spool(part_files[0], RECORDS[:2])
+    write_spool(part_files[1], RECORDS[2:])
+    with SqlSpoolWriter(spool_file) as spool_writer:
+        spool_writer.write('INSERT 0;', True)
+        for part_file in part_files:
+            spool_writer.append_spool(part_file)
+            remove_spool(part_file)
+        spool_writer.write('INSERT 5;', True)
+        assert spool_writer.record_count == len(RECORDS) + 2
+    expected = [('INSERT 0;', True)] + RECORDS + [('INSERT 5;', True)]
+    assert read_spool(spool_file) == (len(expected), expected)
+    assert read_spool(spool_file, reverse=True) == (len(expected), expected[::-1])
+    assert not os.path.exists(part_files[0])
+
+
+def test_spool_truncate_at_checkpoint_and_append(tmp_path):
+    spool_file = str(tmp_path / 'test.spool')
+    with SqlSpoolWriter(spool_file) as spool_writer:
+        for sql, new_transaction in RECORDS[:2]:
+            spool_writer.write(sql, new_transaction)
+        spool_writer.flush()
+        checkpoint = (spool_writer.record_count, spool_writer.offset)
+        # 断点之后写入的记录在续传时丢弃
+        for sql, new_transaction in RECORDS[2:]:
+            spool_writer.write(sql, new_transaction)
+    assert truncate_spool(spool_file, checkpoint[0]) == checkpoint[1]
+    assert os.path.getsize(spool_file) == checkpoint[1]
+    assert read_spool(spool_file) == (2, RECORDS[:2])
+    with SqlSpoolWriter(spool_file) as spool_writer:
+        assert (spool_writer.record_count, spool_writer.offset) == checkpoint
+        spool_writer.write('INSERT 3;', True)
+    assert read_spool(spool_file, reverse=True) == (3, [('INSERT 3;', True)] + RECORDS[:2][::-1])
+
+
+def test_spool_truncate_to_empty(tmp_path):
+    spool_file = str(tmp_path / 'test.spool')
+    write_spool(spool_file, RECORDS)
+    assert truncate_spool(spool_file, 0) == 0
+    assert os.path.getsize(get_spool_index_file(spool_file)) == 0
+    assert read_spool(spool_file) == (0, [])
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import binlog2sql_util2
+from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent, UpdateRowsEvent
+from binlog2sql_util2 import SqlTemplateCache, SqlExecutePattern, SqlRollbackPattern
+
+
+@pytest.fixture
+def template_cache(monkeypatch):
+    template_cache = SqlTemplateCache()
+    monkeypatch.setattr(binlog2sql_util2, 'SQL_TEMPLATE_CACHE', template_cache)
+    return template_cache
+
+
+def make_event(event_class, table='t', primary_key='id'):
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.__dict__.update({'schema': 'db', 'table': table, 'primary_key': primary_key})
+    return binlog_event
+
+
+def test_get_template_builds_once():
+    template_cache = SqlTemplateCache()
+    builds = []
+
+    def build_template():
+        builds.append(1)
+        return 'template'
+
+    assert template_cache.get_template(('k',), build_template) == 'template'
+    assert template_cache.get_template(('k',), build_template) == 'template'
+    assert len(builds) == 1
+
+
+def test_get_template_evicts_least_recently_used():
+    template_cache = SqlTemplateCache(max_size=2)
+    template_cache.get_template('a', lambda: 'A')
+    template_cache.get_template('b', lambda: 'B')
+    # 命中的模板移到末尾，容量不足时先淘汰b
+    template_cache.get_template('a', lambda: 'A2')
+    template_cache.get_template('c', lambda: 'C')
+    assert list(template_cache.templates) == ['a', 'c']
+    assert template_cache.get_template('b', lambda: 'B2') == 'B2'
+    assert list(template_cache.templates) == ['c', 'b']
+
+
+def test_delete_template_keyed_by_null_mask(template_cache):
+    binlog_event = make_event(DeleteRowsEvent)
+    pattern = SqlExecutePattern(binlog_event, row={'values': {'id': 1, 'c': 'x'}}).get_sql_pattern()
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `c`=%s LIMIT 1;'
+    # 同样的字段列表，值为NULL时使用IS比较，不能复用之前的模板
+    pattern = SqlExecutePattern(binlog_event, row={'values': {'id': 2, 'c': None}}).get_sql_pattern()
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `c` IS %s LIMIT 1;'
+    assert pattern['values'] == [2, None]
+    pattern = SqlExecutePattern(binlog_event, row={'values': {'id': 3, 'c': 'y'}}).get_sql_pattern()
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `c`=%s LIMIT 1;'
+    assert len(template_cache.templates) == 2
+
+
+def test_update_template_keyed_by_table_and_columns(template_cache):
+    row = {'before_values': {'id': 1, 'c': None}, 'after_values': {'id': 1, 'c': 'x'}}
+    pattern = SqlExecutePattern(make_event(UpdateRowsEvent), row=row).get_sql_pattern()
+    assert pattern['template'] == 'UPDATE `db`.`t` SET `id`=%s, `c`=%s WHERE `id`=%s AND `c` IS %s LIMIT 1;'
+    assert pattern['values'] == [1, 'x', 1, None]
+    pattern = SqlExecutePattern(make_event(UpdateRowsEvent, table='t2'), row=row).get_sql_pattern()
+    assert pattern['template'] == 'UPDATE `db`.`t2` SET `id`=%s, `c`=%s WHERE `id`=%s AND `c` IS %s LIMIT 1;'
+    row = {'before_values': {'id': 1}, 'after_values': {'id': 2}}
+    pattern = SqlExecutePattern(make_event(UpdateRowsEvent), row=row).get_sql_pattern()
+    assert pattern['template'] == 'UPDATE `db`.`t` SET `id`=%s WHERE `id`=%s LIMIT 1;'
+    assert len(template_cache.templates) == 3
+
+
+def test_rollback_templates(template_cache):
+    binlog_event = make_event(WriteRowsEvent, primary_key=('id', 'k'))
+    row = {'values': {'id': 1, 'k': 2, 'c': None}}
+    pattern = SqlRollbackPattern(binlog_event, row=row, rollback_with_primary_key=True).get_sql_pattern()
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `k`=%s LIMIT 1;'
+    pattern = SqlRollbackPattern(binlog_event, row=row).get_sql_pattern()
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `k`=%s AND `c` IS %s LIMIT 1;'
+    pattern = SqlRollbackPattern(binlog_event, row=row, rollback_with_primary_key=True).get_multi_row_pattern()
+    assert (pattern['prefix'], pattern['row_template'], pattern['values']) \
+        == ('DELETE FROM `db`.`t` WHERE (`id`, `k`) IN (', '(%s, %s)', [1, 2])
+
+
+def test_primary_key_list_cached():
+    template_cache = SqlTemplateCache()
+    assert template_cache.get_primary_key_list('id') == ['id']
+    primary_key_list = template_cache.get_primary_key_list(('id', 'k'))
+    assert primary_key_list == ['id', 'k']
+    assert template_cache.get_primary_key_list(('id', 'k')) is primary_key_list
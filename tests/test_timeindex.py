@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from binlog2sql_timeindex import BinlogTimeIndex, TIME_INDEX_SAMPLE_BYTES, TIME_INDEX_SAFETY_SECONDS
+
+MB = TIME_INDEX_SAMPLE_BYTES
+BINLOG_FILES = ['mysql-bin.000001', 'mysql-bin.000002', 'mysql-bin.000003']
+
+
+def make_time_index(tmp_path):
+    time_index = BinlogTimeIndex(str(tmp_path / 'time_index.json'))
+    # 每个文件3个采样点，每个采样点间隔1000秒
+    for file_index, log_file in enumerate(BINLOG_FILES):
+        for sample_index in range(3):
+            time_index.add_sample(log_file, 4 + sample_index * MB, 10000 * (file_index + 1) + 1000 * sample_index)
+    return time_index
+
+
+def test_add_sample_skips_close_positions(tmp_path):
+    time_index = BinlogTimeIndex(str(tmp_path / 'time_index.json'))
+    time_index.add_sample('mysql-bin.000001', 4, 100)
+    time_index.add_sample('mysql-bin.000001', 1000, 101)
+    time_index.add_sample('mysql-bin.000001', MB + 4, 102)
+    time_index.add_sample('mysql-bin.000001', MB + 4, 102)
+    time_index.add_sample('mysql-bin.000001', MB // 2, 101)
+    assert time_index.files == {'mysql-bin.000001': [[4, 100], [MB + 4, 102]]}
+
+
+def test_find_start_position(tmp_path):
+    time_index = make_time_index(tmp_path)
+    start_time = 20000 + 2000 + TIME_INDEX_SAFETY_SECONDS
+    assert time_index.find_start_position(BINLOG_FILES, start_time, BINLOG_FILES[0], 4) \
+        == ('mysql-bin.000002', 4 + 2 * MB)
+    # 预留的秒数内的采样点不能使用
+    assert time_index.find_start_position(BINLOG_FILES, start_time - 1, BINLOG_FILES[0], 4) \
+        == ('mysql-bin.000002', 4 + MB)
+    # 不早于起始位点，binlog_files从起始文件开始
+    assert time_index.find_start_position(BINLOG_FILES[1:], start_time, BINLOG_FILES[1], 4 + 2 * MB) is None
+    assert time_index.find_start_position(BINLOG_FILES, 10000, BINLOG_FILES[0], 4) is None
+    assert time_index.find_start_position(BINLOG_FILES[2:], start_time, BINLOG_FILES[2], 4) is None
+
+
+def test_save_and_load(tmp_path):
+    time_index = make_time_index(tmp_path)
+    time_index.save()
+    assert not time_index.dirty
+    loaded = BinlogTimeIndex(time_index.index_file)
+    assert loaded.files == time_index.files
+    loaded.merge({'mysql-bin.000004': [[4, 40000]], 'mysql-bin.000001': [[4, 10000]]})
+    assert loaded.dirty and loaded.files['mysql-bin.000004'] == [[4, 40000]]
+
+
+def test_prune_purged_files(tmp_path):
+    time_index = make_time_index(tmp_path)
+    time_index.save()
+    time_index.prune(BINLOG_FILES[1:])
+    assert sorted(time_index.files) == BINLOG_FILES[1:]
+    assert time_index.dirty
+
+
+def test_prune_reused_file_name(tmp_path):
+    time_index = make_time_index(tmp_path)
+    time_index.save()
+    # RESET MASTER之后重新生成的mysql-bin.000001比原来的文件小
+    time_index.prune(BINLOG_FILES[:1], {'mysql-bin.000001': MB})
+    assert time_index.files == {'mysql-bin.000001': [[4, 10000]]}
+    # 新文件的采样点时间晚于原有的更大位点的采样点，丢弃原有的采样点
+    time_index.add_sample('mysql-bin.000001', 4, 50000)
+    assert time_index.files == {'mysql-bin.000001': [[4, 50000]]}
+    time_index.add_sample('mysql-bin.000001', 4 + MB, 51000)
+    assert time_index.find_start_position(BINLOG_FILES[:1], 30000, BINLOG_FILES[0], 4) is None
+    assert time_index.find_start_position(BINLOG_FILES[:1], 52000, BINLOG_FILES[0], 4) == ('mysql-bin.000001', 4 + MB)
+
+
+def test_reused_file_name_detected_while_parsing(tmp_path):
+    time_index = make_time_index(tmp_path)
+    # 没有文件大小时，解析新文件的第一个事务发现与后面的采样点时间矛盾
+    time_index.add_sample('mysql-bin.000002', 4, 50000)
+    assert time_index.files['mysql-bin.000002'] == [[4, 50000]]
+    # 时间在预留范围内的乱序不视为文件被重新使用
+    time_index.add_sample('mysql-bin.000003', 4 + 3 * MB, 32000 - TIME_INDEX_SAFETY_SECONDS)
+    assert len(time_index.files['mysql-bin.000003']) == 4